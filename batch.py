@@ -0,0 +1,107 @@
+"""
+Run per-trial analyses across a pool of worker processes.
+
+Each worker opens its own database session when it starts its first item
+(connections must never be shared between processes), so analysis functions should
+query through batch.session rather than db_api.connect.session. Results are meant
+to be written to files in RESULTS_DIRECTORY, from where they can be viewed later
+without recomputing anything.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import traceback
+import multiprocessing
+
+N_PROCESSES = int(os.getenv('TETHER_N_PROCESSES', multiprocessing.cpu_count()))
+RESULTS_DIRECTORY = os.getenv('ARENA_RESULTS_DIRECTORY', 'results')
+
+session = None
+
+
+def _open_session():
+    """Open this worker's database session the first time it is needed."""
+    global session
+
+    if session is None:
+        from db_api import connect
+        session = connect.Session()
+
+
+def _release_connections():
+    """Close the parent process's database connections so that forked workers do not inherit them."""
+    # only if the database has been used at all (db_api.connect does not connect when imported)
+    connect = sys.modules.get('db_api.connect')
+    if connect is not None:
+        connect.release()
+
+
+def _call(call):
+    function, item, use_database = call
+
+    # errors opening the session are reported with the item (errors raised in a pool
+    # initializer would instead make the pool restart its workers forever)
+    try:
+        if use_database:
+            _open_session()
+        return item, function(item), None
+    except Exception:
+        return item, None, traceback.format_exc()
+
+
+def map_in_pool(function, items, n_processes=N_PROCESSES, use_database=True):
+    """
+    Call function on every item in a pool of worker processes.
+
+    function must be defined at module level so that it can be sent to the workers.
+    A failing item does not stop the others: its error is printed and returned instead.
+
+    :param function: function of one item
+    :param items: list of items (e.g. trial ids)
+    :param n_processes: number of worker processes
+    :param use_database: whether to open a database session (batch.session) in each worker
+    :return: dict of results by item, dict of formatted tracebacks by item
+    """
+    results = {}
+    errors = {}
+
+    if use_database:
+        # ask about the production database here, since workers cannot ask the user themselves
+        from db_api import connect
+        connect.confirm_production()
+
+    _release_connections()
+
+    pool = multiprocessing.Pool(n_processes)
+    try:
+        calls = [(function, item, use_database) for item in items]
+        for i_ctr, (item, result, error) in enumerate(pool.imap_unordered(_call, calls)):
+            if error is None:
+                results[item] = result
+                print('Finished {} ({}/{})'.format(item, i_ctr + 1, len(calls)))
+            else:
+                errors[item] = error
+                print('Error processing {} ({}/{}):\n{}'.format(item, i_ctr + 1, len(calls), error))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return results, errors
+
+
+def results_path(*names):
+    """Path of a file in RESULTS_DIRECTORY, creating its directory if needed."""
+    path = os.path.join(RESULTS_DIRECTORY, *names)
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another worker may have created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+    return path
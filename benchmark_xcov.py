@@ -0,0 +1,151 @@
+"""
+Offline benchmark of the cross-covariance engines on synthetic filter-recovery problems.
+
+Like the control time-series of the trial scripts, a response is made by convolving
+a stimulus with a known filter (a shifted exponential, see control_filter) and adding
+noise. The stimulus here is white noise, so the cross-covariance of stimulus and
+response divided by the stimulus variance recovers the filter itself. Every engine is
+timed on every configuration and its recovery error is compared with the standard
+error expected from the number of samples. No database or edr files are needed.
+
+Run as a script to print a table of timings and errors:
+
+    python benchmark_xcov.py
+"""
+from __future__ import print_function, division
+
+from collections import namedtuple, OrderedDict
+from timeit import default_timer
+import numpy as np
+from scipy import signal as sp_signal
+
+import xcov
+
+# synthetic problems: number of segments, segment length, lags back and forward and response noise
+BENCHMARK_CONFIGS = [
+    dict(n_segments=1, segment_length=20000, n_lags_back=12, n_lags_forward=125, noise=.01),
+    dict(n_segments=20, segment_length=1000, n_lags_back=12, n_lags_forward=125, noise=.01),
+    dict(n_segments=100, segment_length=300, n_lags_back=12, n_lags_forward=125, noise=.1),
+    dict(n_segments=10, segment_length=5000, n_lags_back=50, n_lags_forward=500, noise=.1),
+    dict(n_segments=5, segment_length=200000, n_lags_back=250, n_lags_forward=2500, noise=1.),
+]
+
+N_REPEATS = 3
+MAX_STANDARD_ERRORS = 5  # largest recovery error allowed, in standard errors
+CHUNK_LENGTH = 10000  # chunk length fed to the streaming accumulator
+
+BenchmarkRow = namedtuple('BenchmarkRow', ['n_segments', 'segment_length', 'n_lags_back', 'n_lags_forward',
+                                           'noise', 'engine', 'seconds', 'error', 'standard_error'])
+
+
+def control_filter(n_lags_forward, shift=20, amplitude=.1, time_constant=25):
+    """Exponential filter delayed by shift timesteps (time constant in timesteps), as in the trial scripts."""
+    t = np.arange(n_lags_forward - shift)
+    return np.concatenate([np.zeros(shift), amplitude * np.exp(-t / time_constant)])
+
+
+def synthetic_pair(n_segments, segment_length, filter_, noise, random_state=np.random):
+    """
+    Segments of a white noise stimulus and a noisy response to it through filter_.
+
+    :return: list of stimulus segments, list of response segments
+    """
+    xs = [random_state.normal(0, 1, segment_length) for _ in range(n_segments)]
+    ys = [sp_signal.fftconvolve(x, filter_, 'full')[:segment_length] + random_state.normal(0, noise, segment_length)
+          for x in xs]
+
+    return xs, ys
+
+
+def _xcov_multi(xs, ys, n_lags_back, n_lags_forward):
+    return xcov.xcov_multi({'x': xs, 'y': ys}, [('x', 'y')], n_lags_back, n_lags_forward, normed=False)['x', 'y']
+
+
+def _accumulator(xs, ys, n_lags_back, n_lags_forward):
+    accumulator = xcov.XcovAccumulator([('x', 'y')], n_lags_back, n_lags_forward)
+    for x, y in zip(xs, ys):
+        for start in range(0, len(x), CHUNK_LENGTH):
+            accumulator.add({'x': x[start:start + CHUNK_LENGTH], 'y': y[start:start + CHUNK_LENGTH]})
+        accumulator.end_segment()
+    return accumulator.result(normed=False)['x', 'y']
+
+
+def _simple(xs, ys, n_lags_back, n_lags_forward):
+    from math_tools import signal
+    return xcov.XcovResult(*signal.xcov_simple_two_sided_multi(xs, ys, n_lags_back=n_lags_back,
+                                                              n_lags_forward=n_lags_forward, normed=False))
+
+
+def available_engines():
+    """Engines computing (non-normed) cross-covariances of cause and effect segments, by name."""
+    engines = OrderedDict([('xcov_multi', _xcov_multi), ('accumulator', _accumulator)])
+
+    # the original per-pair implementation, if the author's library is installed
+    try:
+        from math_tools import signal
+        if hasattr(signal, 'xcov_simple_two_sided_multi'):
+            engines['simple'] = _simple
+    except ImportError:
+        pass
+
+    return engines
+
+
+def recovery_error(cov, filter_, n_lags_back):
+    """Largest absolute difference between a non-normed cross-covariance (lags >= 0) and the filter."""
+    return np.max(np.abs(cov[n_lags_back:] - filter_))
+
+
+def standard_error(n_samples, filter_, noise):
+    """Standard error of each filter coefficient estimated from n_samples of unit-variance white noise."""
+    return np.sqrt((np.sum(filter_ ** 2) + noise ** 2) / n_samples)
+
+
+def run_benchmark(configs=BENCHMARK_CONFIGS, engines=None, n_repeats=N_REPEATS, random_state=np.random):
+    """
+    Time every engine on every configuration and measure its recovery error.
+
+    :param configs: list of dicts of n_segments, segment_length, n_lags_back, n_lags_forward and noise
+    :param engines: dict of engines by name (all available engines if None)
+    :param n_repeats: number of repeats, of which the fastest is reported
+    :param random_state: numpy RandomState
+    :return: list of BenchmarkRows
+    """
+    if engines is None:
+        engines = available_engines()
+
+    rows = []
+
+    for config in configs:
+        filter_ = control_filter(config['n_lags_forward'])
+        xs, ys = synthetic_pair(config['n_segments'], config['segment_length'], filter_, config['noise'],
+                                random_state=random_state)
+        se = standard_error(config['n_segments'] * config['segment_length'], filter_, config['noise'])
+
+        for name, engine in engines.items():
+            times = []
+            for _ in range(n_repeats):
+                start = default_timer()
+                result = engine(xs, ys, config['n_lags_back'], config['n_lags_forward'])
+                times += [default_timer() - start]
+
+            error = recovery_error(result.xcov, filter_, config['n_lags_back'])
+
+            rows += [BenchmarkRow(engine=name, seconds=min(times), error=error, standard_error=se, **config)]
+
+    return rows
+
+
+def main():
+    rows = run_benchmark()
+
+    print('{:>8} {:>10} {:>6} {:>6} {:>6} {:>12} {:>10} {:>10} {:>6}'.format(
+        'segments', 'length', 'back', 'fwd', 'noise', 'engine', 'seconds', 'error', 'ok'))
+    for row in rows:
+        print('{:>8} {:>10} {:>6} {:>6} {:>6} {:>12} {:>10.4f} {:>10.2g} {:>6}'.format(
+            row.n_segments, row.segment_length, row.n_lags_back, row.n_lags_forward, row.noise, row.engine,
+            row.seconds, row.error, str(row.error < MAX_STANDARD_ERRORS * row.standard_error)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Monte Carlo calibration of the correlation p-values and confidence bounds used in the
+cross-correlation analyses.
+
+All replicates are drawn at once as 2D arrays (replicates x samples), and their
+correlations, p-values and bounds are computed in closed form across the whole batch
+with the same formulas as xcov.XcovStats.result. Under independence of cause and
+effect, a calibrated test rejects at a rate of alpha and its bounds contain zero at a
+rate of the confidence level; autocorrelated (smoothed) signals show how far from
+this the analytic p-values drift.
+"""
+from __future__ import print_function, division
+
+from collections import namedtuple
+import numpy as np
+from scipy import fftpack
+from scipy import signal as sp_signal
+
+import xcov
+
+CALIBRATION_BATCH_SIZE = 500  # number of replicates drawn at once (limits memory use)
+
+Calibration = namedtuple('Calibration', ['lags', 'false_positive_rate', 'coverage'])
+
+
+def pearsonr_batch(x, y, confidence=.95):
+    """
+    Pearson correlations and two-sided p-values of the rows of two 2D arrays.
+
+    :param x: array of shape (replicates, samples)
+    :param y: array of the same shape
+    :param confidence: confidence level of bounds
+    :return: XcovResult of r, p, lb, ub arrays over replicates
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+
+    stats = xcov.XcovStats(
+        [0], np.tile(x.shape[1], len(x)), x.sum(axis=1), y.sum(axis=1),
+        (x ** 2).sum(axis=1), (y ** 2).sum(axis=1), (x * y).sum(axis=1))
+
+    return stats.result(confidence=confidence)
+
+
+def replicate_xcov_stats(x, y, n_lags_back, n_lags_forward):
+    """
+    Cross-covariance statistics of the rows of two 2D arrays, each row being one
+    replicate (a single segment).
+
+    :param x: cause array of shape (replicates, samples)
+    :param y: effect array of the same shape
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :return: XcovStats whose sums have shape (replicates, number of lags)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if x.shape != y.shape:
+        raise ValueError('Cause and effect replicates must have the same shape!')
+
+    n_replicates, segment_length = x.shape
+    lags = np.arange(-n_lags_back, n_lags_forward)
+
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+
+    n_fft = fftpack.next_fast_len(segment_length + max(n_lags_back, n_lags_forward))
+
+    sxy = np.fft.irfft(np.fft.rfft(x, n=n_fft, axis=1).conj() * np.fft.rfft(y, n=n_fft, axis=1),
+                       n=n_fft, axis=1)[:, lags % n_fft]
+
+    zeros = np.zeros((n_replicates, 1))
+    x_cumsum = np.concatenate([zeros, np.cumsum(x, axis=1)], axis=1)
+    y_cumsum = np.concatenate([zeros, np.cumsum(y, axis=1)], axis=1)
+    x_cumsum_sq = np.concatenate([zeros, np.cumsum(x ** 2, axis=1)], axis=1)
+    y_cumsum_sq = np.concatenate([zeros, np.cumsum(y ** 2, axis=1)], axis=1)
+
+    x_start, x_end, y_start, y_end = xcov.lag_window(lags, segment_length)
+    n = x_end - x_start
+
+    return xcov.XcovStats(
+        lags, np.tile(n, (n_replicates, 1)),
+        sx=x_cumsum[:, x_end] - x_cumsum[:, x_start],
+        sy=y_cumsum[:, y_end] - y_cumsum[:, y_start],
+        sxx=x_cumsum_sq[:, x_end] - x_cumsum_sq[:, x_start],
+        syy=y_cumsum_sq[:, y_end] - y_cumsum_sq[:, y_start],
+        sxy=np.where(n > 0, sxy, 0))
+
+
+def smoothed_noise(n_replicates, n_samples, smoothing=1, random_state=np.random):
+    """
+    Draw replicates of Gaussian white noise smoothed by a moving average.
+
+    :param n_replicates: number of replicates
+    :param n_samples: number of samples per replicate
+    :param smoothing: length of moving average (in timesteps; 1 gives white noise)
+    :param random_state: numpy RandomState
+    :return: array of shape (n_replicates, n_samples)
+    """
+    noise = random_state.normal(0, 1, (n_replicates, n_samples + smoothing - 1))
+
+    if smoothing == 1:
+        return noise
+
+    kernel = np.ones((1, smoothing)) / smoothing
+    return sp_signal.fftconvolve(noise, kernel, 'valid')
+
+
+def calibrate_xcov(n_replicates, n_samples, n_lags_back, n_lags_forward, smoothing_x=1, smoothing_y=1,
+                   alpha=.05, confidence=.95, random_state=np.random):
+    """
+    Estimate the false positive rate and the coverage of the confidence bounds of the
+    lagged cross-correlation between independent smoothed noise signals.
+
+    :param n_replicates: number of replicates
+    :param n_samples: number of samples per replicate
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param smoothing_x: length of moving average applied to cause (see smoothed_noise)
+    :param smoothing_y: length of moving average applied to effect
+    :param alpha: significance level
+    :param confidence: confidence level of bounds
+    :param random_state: numpy RandomState
+    :return: Calibration of lags, fraction of p-values below alpha and fraction of bounds
+             containing zero at each lag
+    """
+    lags = np.arange(-n_lags_back, n_lags_forward)
+
+    n_significant = np.zeros(len(lags))
+    n_covered = np.zeros(len(lags))
+
+    for start in range(0, n_replicates, CALIBRATION_BATCH_SIZE):
+        batch_size = min(CALIBRATION_BATCH_SIZE, n_replicates - start)
+
+        x = smoothed_noise(batch_size, n_samples, smoothing_x, random_state)
+        y = smoothed_noise(batch_size, n_samples, smoothing_y, random_state)
+
+        result = replicate_xcov_stats(x, y, n_lags_back, n_lags_forward).result(confidence=confidence)
+
+        n_significant += np.sum(result.p < alpha, axis=0)
+        n_covered += np.sum((result.lb <= 0) & (0 <= result.ub), axis=0)
+
+    return Calibration(lags, n_significant / n_replicates, n_covered / n_replicates)
@@ -1,4 +1,4 @@
-__all__ = ['connect', 'models']
+__all__ = ['connect', 'models', 'queries', 'ingest', 'migrate']
 
 
 def get_or_create(session, model, id, **kwargs):
@@ -4,26 +4,108 @@ Created on Fri Mar 27 14:35:44 2015
 @author: rkp
 
 Connect to tether or test_tether database.
+
+Nothing is connected when this module is imported: the engine is created the first
+time a session is used, from the URL in TEST_TETHER_DB_CXN_URL, or in
+TETHER_DB_CXN_URL if TETHER_DB is set to "production". Any SQLAlchemy URL works,
+including a local SQLite file (e.g. sqlite:////path/to/tether.db) for offline use and
+tests. A process that is forked after the engine was created gets an engine (and
+connection pool) of its own the first time it uses the database.
+
+Before the production database is first used, the user is asked to confirm it. This
+happens once, in the main process; processes forked after that inherit the answer,
+while other worker processes refuse to connect unless TETHER_DB_CONFIRM_PRODUCTION is
+set to "yes" (which also skips the question in the main process).
+
+session is a thread-local session (a scoped_session) that can be used exactly like a
+Session; Session() opens a new, independent session.
 """
+from __future__ import print_function
 
 import os
+import multiprocessing
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-TEST_CXN = True
-
-if TEST_CXN:
-    print 'CONNECTED TO TETHER TEST DATABASE'
-    engine = create_engine(os.environ['TEST_TETHER_DB_CXN_URL'])
-else:
-    print 'CONNECTED TO TETHER PRODUCTION DATABASE'
-    x = raw_input('Are you sure you want to connect to the production database [y or n]?')
-    if x.lower() == 'y':
-        engine = create_engine(os.environ['TETHER_DB_CXN_URL'])
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# "test" or "production"
+DATABASE = os.getenv('TETHER_DB', 'test')
+
+# connection pool settings (not used for SQLite)
+POOL_SIZE = int(os.getenv('TETHER_DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.getenv('TETHER_DB_MAX_OVERFLOW', 10))
+POOL_PRE_PING = os.getenv('TETHER_DB_POOL_PRE_PING', '1') != '0'
+
+_engine = None
+_engine_pid = None
+_production_confirmed = False
+
+_session_factory = sessionmaker()
+
+
+def database_url(database=None):
+    """Return the URL of the test or production database from the environment."""
+    database = database or DATABASE
+
+    if database == 'test':
+        return os.environ['TEST_TETHER_DB_CXN_URL']
+    elif database == 'production':
+        return os.environ['TETHER_DB_CXN_URL']
     else:
-        raise RuntimeError('User prevented write access to database.')
+        raise ValueError('TETHER_DB must be "test" or "production", not "{}"!'.format(database))
+
+
+def confirm_production():
+    """Ask the user to confirm use of the production database, unless already confirmed (or using the test database)."""
+    global _production_confirmed
+
+    if DATABASE != 'production' or _production_confirmed:
+        return
+
+    if os.getenv('TETHER_DB_CONFIRM_PRODUCTION') != 'yes':
+        if multiprocessing.current_process().name != 'MainProcess':
+            raise RuntimeError('Production database was not confirmed before starting worker processes '
+                               '(set TETHER_DB_CONFIRM_PRODUCTION=yes to allow it)!')
+
+        x = raw_input('Are you sure you want to connect to the production database [y or n]?')
+        if x.lower() != 'y':
+            raise RuntimeError('User prevented write access to database.')
+
+    _production_confirmed = True
+
+
+def get_engine():
+    """Return this process's engine, creating it on first use."""
+    global _engine, _engine_pid
+
+    if _engine is None or _engine_pid != os.getpid():
+        url = database_url()
+
+        kwargs = {}
+        if not url.startswith('sqlite'):
+            kwargs = dict(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=POOL_PRE_PING)
+
+        if DATABASE == 'production':
+            confirm_production()
+            print('CONNECTING TO TETHER PRODUCTION DATABASE')
+
+        # an engine inherited from a parent process is left alone, since its connections belong to the parent
+        _engine = create_engine(url, **kwargs)
+        _engine_pid = os.getpid()
+
+    return _engine
+
+
+def Session(**kwargs):
+    """Open a new session bound to this process's engine."""
+    return _session_factory(bind=get_engine(), **kwargs)
+
+
+session = scoped_session(Session)
+
 
-engine.connect()
+def release():
+    """Close the thread-local session and all pooled connections of this process (e.g. before forking)."""
+    session.remove()
 
-Session = sessionmaker(bind=engine)
-session = Session()
\ No newline at end of file
+    if _engine is not None and _engine_pid == os.getpid():
+        _engine.dispose()
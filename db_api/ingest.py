@@ -0,0 +1,165 @@
+"""
+Bulk registration of new trials.
+
+All file names already registered for an experiment are fetched in one query, and
+only the remaining trials are inserted, together with any new insects, trial pairs
+and odor statuses, using multi-row inserts committed in batches. The number of
+database round-trips therefore grows with the number of batches rather than with
+the number of files.
+
+ingest_directory runs this as a pipeline: the headers of new files are read by a
+scanning function passed in by the caller (e.g. edr_handling.scan_edr_directory, which
+reads them in a pool of threads), while the calling thread parses them and writes the
+trials to the database batch by batch as they arrive, so that reading files and
+writing to the database overlap.
+"""
+import os
+import traceback
+from collections import namedtuple
+
+from db_api import models
+
+INGEST_BATCH_SIZE = int(os.getenv('TETHER_INGEST_BATCH_SIZE', 500))
+
+IngestReport = namedtuple('IngestReport', ['added', 'skipped', 'errors'])
+
+
+def existing_file_names(session, experiment_id):
+    """Return the set of file names of an experiment's trials that are already in the database."""
+    query = session.query(models.Trial.file_name).filter(models.Trial.experiment_id == experiment_id)
+    return set([file_name for file_name, in query])
+
+
+def _insert_missing(session, model, ids):
+    """Insert rows of a model with only an id for ids not already in the database."""
+    ids = set(ids)
+    if not ids:
+        return
+
+    existing = set([id_ for id_, in session.query(model.id).filter(model.id.in_(ids))])
+    missing = sorted(ids - existing)
+
+    if missing:
+        session.execute(model.__table__.insert(), [{'id': id_} for id_ in missing])
+
+
+def bulk_add_trials(session, experiment_id, trials, batch_size=INGEST_BATCH_SIZE):
+    """
+    Add new trials of an experiment with multi-row inserts, committing after every batch.
+
+    Each trial is a dict with keys file_name, recording_start, recording_duration and insect_id,
+    and optionally pair_id and odor_status (a dict with keys odor and solenoid_active). Trials
+    whose file name is already registered for the experiment are skipped.
+
+    :param session: database session
+    :param experiment_id: id of experiment (which must already be in the database)
+    :param trials: list of trial dicts
+    :param batch_size: number of trials inserted per batch
+    :return: sorted list of file names of trials that were added
+    """
+    existing = existing_file_names(session, experiment_id)
+
+    new_trials = [trial for trial in trials if trial['file_name'] not in existing]
+    new_trials = sorted(dict([(trial['file_name'], trial) for trial in new_trials]).values(),
+                        key=lambda trial: trial['file_name'])
+
+    for start in range(0, len(new_trials), batch_size):
+        batch = new_trials[start:start + batch_size]
+
+        _insert_missing(session, models.Insect, [trial['insect_id'] for trial in batch])
+        _insert_missing(session, models.TrialPair, [trial['pair_id'] for trial in batch if trial.get('pair_id')])
+
+        session.execute(models.Trial.__table__.insert(), [
+            {'file_name': trial['file_name'], 'recording_start': trial['recording_start'],
+             'recording_duration': trial['recording_duration'], 'experiment_id': experiment_id,
+             'insect_id': trial['insect_id'], 'pair_id': trial.get('pair_id')} for trial in batch])
+
+        # odor statuses refer to the ids the database gave the new trials
+        odor_statuses = dict([(trial['file_name'], trial['odor_status']) for trial in batch
+                              if trial.get('odor_status')])
+
+        if odor_statuses:
+            trial_ids = session.query(models.Trial.file_name, models.Trial.id). \
+                filter(models.Trial.experiment_id == experiment_id). \
+                filter(models.Trial.file_name.in_(list(odor_statuses)))
+
+            session.execute(models.TrialOdorStatus.__table__.insert(), [
+                {'trial_id': trial_id, 'odor': odor_statuses[file_name]['odor'],
+                 'solenoid_active': odor_statuses[file_name]['solenoid_active']}
+                for file_name, trial_id in trial_ids])
+
+        session.commit()
+
+    return [trial['file_name'] for trial in new_trials]
+
+
+def _write_batch(session, experiment_id, trials, errors):
+    """Add a batch of trials; if that fails, add them one by one so that only bad trials are left out."""
+    if not trials:
+        return []
+
+    try:
+        return bulk_add_trials(session, experiment_id, trials, batch_size=max(len(trials), 1))
+    except Exception:
+        session.rollback()
+
+    added = []
+    for trial in trials:
+        try:
+            added += bulk_add_trials(session, experiment_id, [trial])
+        except Exception:
+            session.rollback()
+            errors[trial['file_name']] = traceback.format_exc()
+
+    return added
+
+
+def ingest_directory(session, experiment_id, directory_path, scan_directory, parse_file,
+                     batch_size=INGEST_BATCH_SIZE):
+    """
+    Add the trials of all new edr files in a directory, reading files and writing to the database concurrently.
+
+    Files whose header cannot be read or whose name cannot be parsed, and trials that cannot be
+    written, are recorded in the report without stopping the others.
+
+    :param session: database session
+    :param experiment_id: id of experiment (which must already be in the database)
+    :param directory_path: directory containing edr files
+    :param scan_directory: function of directory path and list of file names returning an iterable
+                           of (file name, recording start datetime, header, error) tuples, where
+                           error is None or a message (see edr_handling.scan_edr_directory)
+    :param parse_file: function of file name, recording start datetime and header returning a
+                       trial dict (see bulk_add_trials)
+    :param batch_size: number of trials written per batch
+    :return: IngestReport of sorted lists of added and skipped (already registered) file names
+             and a dict of error messages by file name
+    """
+    file_names = sorted([file_name for file_name in os.listdir(directory_path)
+                         if file_name.lower().endswith('.edr')])
+
+    existing = existing_file_names(session, experiment_id)
+    skipped = [file_name for file_name in file_names if file_name in existing]
+    new_file_names = [file_name for file_name in file_names if file_name not in existing]
+
+    added = []
+    errors = {}
+
+    batch = []
+    for file_name, recording_start, header, error in scan_directory(directory_path, new_file_names):
+        if error is None:
+            try:
+                batch += [parse_file(file_name, recording_start, header)]
+            except Exception:
+                error = traceback.format_exc()
+
+        if error is not None:
+            errors[file_name] = error
+            continue
+
+        if len(batch) >= batch_size:
+            added += _write_batch(session, experiment_id, batch, errors)
+            batch = []
+
+    added += _write_batch(session, experiment_id, batch, errors)
+
+    return IngestReport(sorted(added), skipped, errors)
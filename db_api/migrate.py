@@ -0,0 +1,103 @@
+"""
+Bring the indexes of an existing database up to date with models.py.
+
+create_all only creates missing tables, so indexes added to models.py after a
+database was set up have to be created here. Indexes whose work an existing index
+already does (e.g. the index MySQL creates for every foreign key) are not duplicated.
+Running this again does nothing.
+Run it with:
+
+    python -m db_api.migrate
+
+(TETHER_DB and the connection URLs are read as in db_api.connect.)
+"""
+from __future__ import print_function
+
+from sqlalchemy import func, inspect, select
+
+from db_api import models
+from db_api.connect import get_engine
+
+
+def _is_covered(index, existing):
+    """
+    Whether an index declared in models.py is made redundant by one of a table's existing indexes.
+
+    A unique index is only covered by a unique index on the same columns; any other index is
+    covered by an index whose columns start with its columns.
+
+    :param index: sqlalchemy Index
+    :param existing: list of index dicts from inspector.get_indexes
+    """
+    columns = [column.name for column in index.columns]
+
+    for other in existing:
+        if index.unique:
+            if other['unique'] and other['column_names'] == columns:
+                return True
+        elif other['column_names'][:len(columns)] == columns:
+            return True
+
+    return False
+
+
+def missing_indexes(engine):
+    """Return the indexes declared in models.py that the database neither has nor already covers."""
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+
+    missing = []
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        existing = inspector.get_indexes(table.name)
+        existing_names = set([index['name'] for index in existing])
+        missing += sorted([index for index in table.indexes
+                           if index.name not in existing_names and not _is_covered(index, existing)],
+                          key=lambda index: index.name)
+
+    return missing
+
+
+def duplicate_trials(engine):
+    """Return (experiment_id, file_name, count) for files registered more than once in an experiment."""
+    trial = models.Trial.__table__
+    n_trials = func.count(trial.c.id)
+
+    query = select([trial.c.experiment_id, trial.c.file_name, n_trials]). \
+        group_by(trial.c.experiment_id, trial.c.file_name). \
+        having(n_trials > 1). \
+        order_by(trial.c.experiment_id, trial.c.file_name)
+
+    return [tuple(row) for row in engine.execute(query)]
+
+
+def migrate(engine=None):
+    """
+    Create the tables and indexes declared in models.py that are missing from the database.
+
+    Nothing is changed if the database has files registered more than once in an experiment,
+    since the unique index on trial file names could not be created; remove the extra trials first.
+
+    :param engine: database engine (db_api.connect's engine if None)
+    :return: names of indexes that were created
+    """
+    engine = engine or get_engine()
+
+    duplicates = duplicate_trials(engine) if 'trial' in inspect(engine).get_table_names() else []
+    if duplicates:
+        raise ValueError('Files registered more than once in an experiment (experiment, file, count): {}'.format(
+            duplicates))
+
+    indexes = missing_indexes(engine)
+    for index in indexes:
+        index.create(engine)
+
+    models.Base.metadata.create_all(engine)
+
+    return [index.name for index in indexes]
+
+
+if __name__ == '__main__':
+    created = migrate()
+    print('Created {} indexes: {}'.format(len(created), ', '.join(created) or 'none'))
@@ -1,15 +1,20 @@
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy import Column, ForeignKey, Index
 from sqlalchemy import Integer, String, Float, DateTime, Text, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 
-from connect import engine
+from connect import get_engine
 
 Base = declarative_base()
 
 
 class Trial(Base):
     __tablename__ = 'trial'
+    __table_args__ = (
+        # a file can only be registered once per experiment (this also indexes trials by experiment)
+        Index('uq_trial_experiment_id_file_name', 'experiment_id', 'file_name', unique=True),
+        Index('ix_trial_experiment_id_recording_start', 'experiment_id', 'recording_start'),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -18,8 +23,8 @@ class Trial(Base):
     recording_duration = Column(Float)
 
     experiment_id = Column(String(255), ForeignKey('experiment.id'))
-    insect_id = Column(String(255), ForeignKey('insect.id'))
-    pair_id = Column(String(13), ForeignKey('trial_pair.id'))
+    insect_id = Column(String(255), ForeignKey('insect.id'), index=True)
+    pair_id = Column(String(13), ForeignKey('trial_pair.id'), index=True)
 
     ignored_segments = relationship("IgnoredSegment", backref='trial')
 
@@ -50,7 +55,7 @@ class IgnoredSegment(Base):
 
     start_time = Column(Float)
     end_time = Column(Float)
-    trial_id = Column(Integer, ForeignKey('trial.id'))
+    trial_id = Column(Integer, ForeignKey('trial.id'), index=True)
 
 
 class TrialPair(Base):
@@ -65,7 +70,7 @@ class TrialOdorStatus(Base):
     __tablename__ = 'trial_odor_status'
 
     id = Column(Integer, primary_key=True)
-    trial_id = Column(Integer, ForeignKey('trial.id'))
+    trial_id = Column(Integer, ForeignKey('trial.id'), index=True)
 
     solenoid_active = Column(Boolean)
     odor = Column(String(100))
@@ -74,4 +79,4 @@ class TrialOdorStatus(Base):
 
 
 if __name__ == '__main__':
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(get_engine())
\ No newline at end of file
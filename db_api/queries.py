@@ -0,0 +1,85 @@
+"""
+Queries that load trials together with everything the analyses read from them.
+
+Relationships in models.py are lazy by default, so reading trial.experiment,
+trial.odor_status or trial.ignored_segments of many trials costs several database
+round-trips per trial. These queries load many-to-one relationships with joins and
+collections with one extra query each, so the number of round-trips does not grow
+with the number of trials.
+"""
+from sqlalchemy.orm import configure_mappers, joinedload, subqueryload
+
+from db_api import models
+
+# set up backrefs (e.g. Trial.odor_status) so they can be named in loader options
+configure_mappers()
+
+
+def _trial_options(path=None):
+    """Loader options for the relationships of trials, optionally reached through path."""
+    if path is None:
+        return [joinedload(models.Trial.experiment), joinedload(models.Trial.odor_status),
+                subqueryload(models.Trial.ignored_segments)]
+
+    return [subqueryload(path).joinedload(models.Trial.experiment),
+            subqueryload(path).joinedload(models.Trial.odor_status),
+            subqueryload(path).subqueryload(models.Trial.ignored_segments)]
+
+
+def trials_query(session, experiment_id=None):
+    """
+    Query trials with their experiment, odor status and ignored segments.
+
+    :param session: database session
+    :param experiment_id: only include trials of this experiment (all trials if None)
+    :return: query of models.Trial ordered by id
+    """
+    query = session.query(models.Trial).options(*_trial_options())
+
+    if experiment_id is not None:
+        query = query.filter(models.Trial.experiment_id == experiment_id)
+
+    return query.order_by(models.Trial.id)
+
+
+def get_trials(session, trial_ids):
+    """
+    Load several trials with their experiment, odor status and ignored segments.
+
+    :param session: database session
+    :param trial_ids: ids of trials
+    :return: dict of trials by id (ids not found are left out)
+    """
+    trial_ids = list(trial_ids)
+    if not trial_ids:
+        return {}
+
+    trials = trials_query(session).filter(models.Trial.id.in_(trial_ids))
+    return dict([(trial.id, trial) for trial in trials])
+
+
+def get_trial(session, trial_id):
+    """Load one trial with its experiment, odor status and ignored segments (None if not found)."""
+    return get_trials(session, [trial_id]).get(trial_id)
+
+
+def trial_pairs_query(session, experiment_id=None):
+    """
+    Query trial pairs with their trials and the trials' experiment, odor status and ignored segments.
+
+    :param session: database session
+    :param experiment_id: only include pairs with trials of this experiment (all pairs if None)
+    :return: query of models.TrialPair ordered by id
+    """
+    query = session.query(models.TrialPair).options(*_trial_options(models.TrialPair.trials))
+
+    if experiment_id is not None:
+        trial_pair_ids = session.query(models.Trial.pair_id).filter(models.Trial.experiment_id == experiment_id)
+        query = query.filter(models.TrialPair.id.in_(trial_pair_ids))
+
+    return query.order_by(models.TrialPair.id)
+
+
+def get_trial_pair(session, trial_pair_id):
+    """Load one trial pair with its trials (see trial_pairs_query), or None if not found."""
+    return trial_pairs_query(session).filter(models.TrialPair.id == trial_pair_id).first()
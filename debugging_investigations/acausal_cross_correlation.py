@@ -18,43 +18,37 @@ import matplotlib.pyplot as plt
 plt.ion()
 from scipy import signal as sp_signal
 
-from math_tools import signal
 from math_tools import stats
 
 from db_api import models
 from db_api.connect import session
 
 import edr_handling
+import xcov
 
 
 trial = session.query(models.Trial).get(TRIAL_ID)
-data, _, cols, _ = edr_handling.load_from_trial(trial, dt=DT, unwrap_barpos=True, lmr_zscore=False)
+recording = edr_handling.TrialRecording.from_trial(trial, dt=DT)
 
-pos = [data_segment[:, cols.index('Barpos')] for data_segment in data]
-vel = [np.gradient(pos_segment) / DT for pos_segment in pos]
-vel_abs = [np.abs(vel_segment) for vel_segment in vel]
-lmr = [data_segment[:, cols.index('LmR')] for data_segment in data]
-lpr = [data_segment[:, cols.index('Lamp')] + data_segment[:, cols.index('Ramp')]
-       for data_segment in data]
-freq = [data_segment[:, cols.index('Freq')] for data_segment in data]
+pos = recording.barpos_unwrapped
+vel = recording.vel
+vel_abs = recording.vel_abs
+lmr = recording['LmR']
+lpr = recording.lpr
+freq = recording['Freq']
 
 # calculate various cross-correlations (first variable is always "cause", second, "effect")
 n_lags_back = int(round(LAG_BACK / DT))
 n_lags_forward = int(round(LAG_FORWARD / DT))
 
-vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = \
-    signal.xcov_simple_two_sided_multi(vel, lmr, n_lags_back=n_lags_back,
-                                       n_lags_forward=n_lags_forward, normed=True,
-                                       confidence=.95)
-vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = \
-    signal.xcov_simple_two_sided_multi(vel, lpr, n_lags_back=n_lags_back,
-                                       n_lags_forward=n_lags_forward, normed=True)
-vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = \
-    signal.xcov_simple_two_sided_multi(vel, freq, n_lags_back=n_lags_back,
-                                       n_lags_forward=n_lags_forward, normed=True)
-vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = \
-    signal.xcov_simple_two_sided_multi(vel_abs, freq, n_lags_back=n_lags_back,
-                                       n_lags_forward=n_lags_forward, normed=True)
+signals = {'vel': vel, 'vel_abs': vel_abs, 'lmr': lmr, 'lpr': lpr, 'freq': freq}
+results = xcov.xcov_multi(signals, [('vel', 'lmr'), ('vel', 'lpr'), ('vel', 'freq'), ('vel_abs', 'freq')],
+                          n_lags_back=n_lags_back, n_lags_forward=n_lags_forward, normed=True, confidence=.95)
+
+vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = results['vel', 'lmr']
+vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = results['vel', 'lpr']
+vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = results['vel', 'freq']
+vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = results['vel_abs', 'freq']
 
 # plot cross-correlations
 fig, axs = plt.subplots(4, 1, sharex=True, tight_layout=True)
@@ -86,8 +80,8 @@ axs[0].set_title('cross-correlations')
 # plot time-series
 if False:
     fig, axs = plt.subplots(6, 1, figsize=FIG_SIZE_TIME_SERIES, sharex=True, tight_layout=True)
-    for d_ctr, data_segment in enumerate(data):
-        t = data_segment[:, 0]
+    for d_ctr in range(len(recording)):
+        t = recording.time(d_ctr)
         axs[0].plot(t, lmr[d_ctr], lw=LW, color='b')
         axs[1].plot(t, lpr[d_ctr], lw=LW, color='b')
         axs[2].plot(t, freq[d_ctr], lw=LW, color='b')
@@ -102,7 +96,7 @@ if False:
     axs[5].set_ylabel('pos')
     axs[5].set_xlabel('t (s)')
     axs[0].set_title('down-sampled time-series')
-    axs[0].set_xlim(data[0][0, 0], data[-1][-1, 0])
+    axs[0].set_xlim(recording.time(0)[0], recording.time(-1)[-1])
 
 plt.draw()
 
@@ -1,34 +1,69 @@
+"""
+Look at the distributions of Pearson correlation p-values under independence, for
+uniform vs. normal data, binary vs. uniform data, and lagged cross-correlations of
+smoothed (autocorrelated) signals.
+"""
+from __future__ import division, print_function
+
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import stats
+
+import calibration
 
 N = 10000
 
+N_LAGS_BACK = 25
+N_LAGS_FORWARD = 250
+SMOOTHING = 20  # length of moving average applied to the autocorrelated signals (in timesteps)
 
-for N_data in [50, 100, 1000, 5000]:
-    print('{} data points'.format(N_data))
-    fig, axs = plt.subplots(2, 2)
 
+def pearsonr_p_values(draw_x, draw_y):
+    """
+    P-values of N replicates, drawn and correlated CALIBRATION_BATCH_SIZE at a time to limit memory use.
+
+    :param draw_x: function returning an array of shape (replicates, N_data) given a number of replicates
+    :param draw_y: same for y
+    :return: x and y of the last replicate, array of p-values of all replicates
+    """
     p_vals = []
-    for _ in range(N):
-        x = np.random.uniform(0, 1, N_data)
-        y = np.random.normal(0, 1, N_data)
+    for start in range(0, N, calibration.CALIBRATION_BATCH_SIZE):
+        batch_size = min(calibration.CALIBRATION_BATCH_SIZE, N - start)
+        x = draw_x(batch_size)
+        y = draw_y(batch_size)
+        p_vals += [calibration.pearsonr_batch(x, y).p]
+
+    return x[-1], y[-1], np.concatenate(p_vals)
 
-        r, p_val = stats.pearsonr(x, y)
-        p_vals += [p_val]
+
+for N_data in [50, 100, 1000, 5000]:
+    print('{} data points'.format(N_data))
+    fig, axs = plt.subplots(3, 2)
+
+    x, y, p_vals = pearsonr_p_values(lambda n: np.random.uniform(0, 1, (n, N_data)),
+                                     lambda n: np.random.normal(0, 1, (n, N_data)))
 
     axs[0, 0].scatter(x, y)
     axs[0, 1].hist(p_vals, 50)
 
-    p_vals = []
-    for _ in range(N):
-        y = np.random.uniform(0, 1, N_data)
-        x = np.concatenate([np.zeros(N_data/2), np.ones(N_data/2)])
-
-        r, p_val = stats.pearsonr(x, y)
-        p_vals += [p_val]
+    binary = np.concatenate([np.zeros(N_data // 2), np.ones(N_data - N_data // 2)])
+    x, y, p_vals = pearsonr_p_values(lambda n: np.tile(binary, (n, 1)),
+                                     lambda n: np.random.uniform(0, 1, (n, N_data)))
 
     axs[1, 0].scatter(x, y)
     axs[1, 1].hist(p_vals, 50)
 
-plt.show()
\ No newline at end of file
+    if N_data > N_LAGS_FORWARD:
+        for smoothing in [1, SMOOTHING]:
+            calib = calibration.calibrate_xcov(N, N_data, N_LAGS_BACK, N_LAGS_FORWARD,
+                                               smoothing_x=smoothing, smoothing_y=smoothing)
+
+            axs[2, 0].plot(calib.lags, calib.false_positive_rate, label='smoothing = {}'.format(smoothing))
+            axs[2, 1].plot(calib.lags, calib.coverage)
+
+        axs[2, 0].axhline(.05, color='k', ls='--')
+        axs[2, 1].axhline(.95, color='k', ls='--')
+        axs[2, 0].set_ylabel('false positive rate')
+        axs[2, 1].set_ylabel('coverage')
+        axs[2, 0].legend()
+
+plt.show()
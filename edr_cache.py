@@ -0,0 +1,185 @@
+"""
+Persistent on-disk cache of preprocessed edr data.
+
+Each entry holds the data matrix returned by edr_handling.load_edr (or the
+segments of data loaded for a trial, stacked into one matrix) as a .npy file, so
+it can be memory-mapped back in, along with a small json file containing the
+remaining return values and the parameters it was loaded with. Entries are keyed
+by the path, size and modification time of the source file and by the load
+parameters, so editing or replacing an edr file automatically misses the cache.
+When the cache grows beyond its size cap the least recently used entries are
+removed.
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import hashlib
+import datetime
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 3  # bump whenever the way edr data is preprocessed changes
+FILE_START_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+EDR_CACHE_DIRECTORY = os.getenv('EDR_CACHE_DIRECTORY')
+EDR_CACHE_MAX_BYTES = int(os.getenv('EDR_CACHE_MAX_BYTES', 10 * 2 ** 30))
+
+
+class EdrCache(object):
+    """
+    Directory of cached edr data with a size cap and LRU eviction.
+
+    :param directory: directory in which to store cache entries (created if needed)
+    :param max_bytes: maximum total size of all entries
+    """
+
+    def __init__(self, directory, max_bytes=EDR_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, file_name, **params):
+        """Return the key identifying a source file's current state and load parameters."""
+        file_name = os.path.abspath(file_name)
+        stat = os.stat(file_name)
+
+        description = json.dumps([CACHE_VERSION, file_name, stat.st_size, stat.st_mtime,
+                                  sorted(params.items())])
+
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        path = os.path.join(self.directory, key)
+        return path + '.npy', path + '.json'
+
+    def get(self, key):
+        """
+        Return a cached entry, or None if it does not exist.
+
+        :return: data (as a copy-on-write memory map, or list of views into one if it
+                 was stored as a list of segments), file start datetime, column names,
+                 edr file header
+        """
+        data_path, info_path = self._paths(key)
+
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+            data = np.load(data_path, mmap_mode='c')
+        except (IOError, OSError, ValueError):
+            return None
+
+        # mark entry as recently used (unless another process has just evicted it)
+        try:
+            os.utime(data_path, None)
+        except OSError:
+            pass
+
+        file_start = datetime.datetime.strptime(info['file_start'], FILE_START_FORMAT)
+
+        if info.get('segment_lengths') is not None:
+            bounds = np.cumsum([0] + info['segment_lengths'])
+            data = [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        return data, file_start, info['cols'], info['header']
+
+    def put(self, key, data, file_start, cols, header, file_name=None, params=None):
+        """
+        Store an entry, then evict old entries if the cache is too large.
+
+        data can be a single array or a list of arrays with the same number of columns.
+        """
+        data_path, info_path = self._paths(key)
+
+        segment_lengths = None
+        if isinstance(data, list):
+            segment_lengths = [len(segment) for segment in data]
+            if data:
+                data = np.concatenate(data)
+            else:
+                data = np.empty((0, len(cols)))
+
+        info = {
+            'file_name': os.path.abspath(file_name) if file_name else None,
+            'params': params,
+            'file_start': file_start.strftime(FILE_START_FORMAT),
+            'cols': list(cols),
+            'header': header,
+            'segment_lengths': segment_lengths,
+        }
+
+        # write to temporary files first so that readers never see partial entries
+        for path, write in [(data_path, lambda f: np.save(f, np.ascontiguousarray(data))),
+                            (info_path, lambda f: f.write(json.dumps(info).encode('utf-8')))]:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.rename(tmp_path, path)
+
+        self.evict()
+
+    def _entries(self):
+        """Return (last used time, size, key) of every entry."""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.npy'):
+                continue
+            key = file_name[:-4]
+            data_path, info_path = self._paths(key)
+            try:
+                size = os.path.getsize(data_path) + os.path.getsize(info_path)
+                entries += [(os.path.getmtime(data_path), size, key)]
+            except OSError:
+                continue
+        return entries
+
+    @property
+    def size(self):
+        """Total number of bytes used by the cache."""
+        return sum([entry[1] for entry in self._entries()])
+
+    def remove(self, key):
+        """Remove one entry."""
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until the cache is no larger than max_bytes."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = sorted(self._entries())
+        total = sum([entry[1] for entry in entries])
+
+        while entries and total > max_bytes:
+            _, size, key = entries.pop(0)
+            self.remove(key)
+            total -= size
+
+    def invalidate(self, file_name=None):
+        """Remove all entries loaded from file_name (or every entry if file_name is None)."""
+        if file_name is not None:
+            file_name = os.path.abspath(file_name)
+
+        for _, _, key in self._entries():
+            if file_name is not None:
+                try:
+                    with open(self._paths(key)[1]) as f:
+                        if json.load(f)['file_name'] != file_name:
+                            continue
+                except (IOError, OSError, ValueError):
+                    pass
+            self.remove(key)
+
+
+def default_cache():
+    """Return a cache in EDR_CACHE_DIRECTORY, or None if that variable is not set."""
+    if EDR_CACHE_DIRECTORY:
+        return EdrCache(EDR_CACHE_DIRECTORY)
+    return None
@@ -5,190 +5,824 @@ from __future__ import print_function, division
 
 import os
 import datetime
+import traceback
+import _strptime  # datetime.strptime imports it lazily, which is not thread-safe in Python 2
+from collections import namedtuple, OrderedDict
+from fractions import Fraction
+from multiprocessing.pool import ThreadPool
 import numpy as np
-from scipy.stats import zscore
-from math_tools import signal
+from scipy import signal as sp_signal
+
+import edr_cache
 
 HEADER_BLOCK_SIZE = 2048
-BARPOS_CONVERSION = 360 / 5  # from volts to degrees
+CTIME_FORMAT = '%m-%d-%Y %I:%M:%S %p'
+N_SCAN_THREADS = 16
+BARPOS_RANGE_VOLTS = 5  # range over which bar position wraps around
+BARPOS_RANGE_DEGREES = 360
+BARPOS_CONVERSION = BARPOS_RANGE_DEGREES / BARPOS_RANGE_VOLTS  # from volts to degrees
+DERIVED_COLS = ('Barvel',)
+WRAPPED_COLS = ('Barpos',)  # downsampled by picking samples, since filtering would smear the wraps
+
+# decimation parameters
+DECIMATION_MAX_DENOMINATOR = 100  # largest upsampling factor used to approximate dt ratios
+DECIMATION_MIN_FIR_FACTOR = 8  # smallest downsampling factor left to the anti-alias filter
+DECIMATION_HALF_LENGTH = 10  # half-length of anti-alias filter per unit of the larger rate
+DECIMATION_KAISER_BETA = 5.
 
 DATA_DIRECTORY = os.getenv('ARENA_DATA_DIRECTORY')
 
+TRIAL_MEMO_MAX_BYTES = 2 * 2 ** 30
 
-def load_edr(file_name, header_block_size=HEADER_BLOCK_SIZE, dt=.01,
-             lmr_zscore=True, barpos_in_degrees=True, cols=None):
-    """Load header info and data from binary file."""
+# on-disk cache used by load_edr (set to an edr_cache.EdrCache or None)
+cache = edr_cache.default_cache()
 
-    if file_name[-4:].lower() != '.edr':
-        raise ValueError('file_name must end with \'.edr\'')
+# in-memory store of load_from_trial results (set to a TrialMemo to turn on memoization)
+trial_memo = None
 
-    header = {}
 
-    with open(file_name, 'rb') as f:
+def _read_header(f, header_block_size=HEADER_BLOCK_SIZE):
+    """Parse the "key=value" lines of an edr header block into a dict."""
+
+    header = {}
 
-        # read header data
-        end_of_header = False
-        while not end_of_header:
+    end_of_header = False
+    while not end_of_header:
 
-            # read next line
-            line = f.readline().rstrip()
+        # read next line
+        line = f.readline().rstrip()
 
-            # stop if we've moved beyond the header
-            if f.tell() <= header_block_size:
-                # get key and value of line as correct type
-                key, val = line.split('=')
+        # stop if we've moved beyond the header
+        if f.tell() <= header_block_size:
+            # get key and value of line as correct type
+            key, val = line.split('=')
 
+            try:
+                header[key] = int(val)
+            except ValueError:
                 try:
-                    header[key] = int(val)
+                    header[key] = float(val)
                 except ValueError:
-                    try:
-                        header[key] = float(val)
-                    except ValueError:
-                        header[key] = val
-            else:
-                end_of_header = True
+                    header[key] = val
+        else:
+            end_of_header = True
+
+    return header
+
+
+def read_edr_header(file_name, header_block_size=HEADER_BLOCK_SIZE):
+    """
+    Read the header of an edr file without touching any of its data.
+
+    The number of timepoints and the recording duration are derived from the
+    header's NP, NC and DT entries and stored in the returned header.
+
+    :param file_name: path to edr file
+    :param header_block_size: number of bytes in header block
+    :return: file start datetime, edr file header
+    """
+
+    if file_name[-4:].lower() != '.edr':
+        raise ValueError('file_name must end with \'.edr\'')
+
+    with open(file_name, 'rb') as f:
+        header = _read_header(f, header_block_size)
+
+    n_timepoints = int(header['NP'] // header['NC'])
+
+    header['n_timepoints'] = n_timepoints
+    header['recording_duration'] = n_timepoints * header['DT']
+
+    file_start = datetime.datetime.strptime(header['CTIME'], CTIME_FORMAT)
+
+    return file_start, header
+
+
+def scan_edr_directory(directory_path, file_names=None, header_block_size=HEADER_BLOCK_SIZE,
+                       n_threads=N_SCAN_THREADS):
+    """
+    Read the headers of edr files in a directory using a pool of threads.
+
+    Headers are yielded as soon as they have been read, so that the caller can process them
+    while the remaining files are still being read.
+
+    :param directory_path: directory containing edr files
+    :param file_names: names of files to read (all edr files in the directory if None)
+    :param header_block_size: number of bytes in header block
+    :param n_threads: number of files to read concurrently
+    :return: generator of (file name, file start datetime, header, error) tuples in the order
+             the files were read, where error is None or the formatted traceback of an
+             unreadable file (whose file start and header are then None)
+    """
+    if file_names is None:
+        file_names = sorted([file_name for file_name in os.listdir(directory_path)
+                             if file_name.lower().endswith('.edr')])
+
+    def read(file_name):
+        try:
+            file_path = os.path.join(directory_path, file_name)
+            file_start, header = read_edr_header(file_path, header_block_size=header_block_size)
+            return file_name, file_start, header, None
+        except Exception:
+            return file_name, None, None, traceback.format_exc()
+
+    pool = ThreadPool(max(1, min(n_threads, len(file_names))))
+    try:
+        for result in pool.imap_unordered(read, file_names):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+class EdrRecording(object):
+    """
+    Memory-mapped edr file whose channels are decoded only when accessed.
+
+    Opening a recording parses the header and maps the int16 samples that follow it;
+    nothing is read from disk or converted to physical units until a channel is
+    requested, after which the scaled channel is kept for subsequent accesses.
+    Decoded channels have the floating point type dtype.
+    """
+
+    def __init__(self, file_name, header_block_size=HEADER_BLOCK_SIZE, dtype=float):
+
+        self.file_start, header = read_edr_header(file_name, header_block_size=header_block_size)
+
+        self.file_name = file_name
+        self.header = header
+        self.dtype = dtype
 
         # get column names
-        cols_edr = [header['YN%d' % ii] for ii in range(header['NC'])]
-
-        # get normalization constants from header
-        ad = float(header['AD'])
-        adcmax = float(header['ADCMAX'] + 1)
-
-        # move to start of binary data
-        f.seek(header_block_size)
-
-        # load data into array
-        ncols = header['NC']
-        nrows = header['NP'] / ncols
-        data = np.fromfile(f, dtype=np.int16).reshape((nrows, ncols))
-        data = data.astype(float)
-        # normalize data by calibration, etc.
-        for channel in range(ncols):
-            ych_channel = 'YCF%d' % channel
-            data[:, channel] *= (float(ad) / (adcmax * header[ych_channel]))
-
-        # add time as first column
-        time = np.arange(data.shape[0])[:, None] * header['DT']
-        data = np.concatenate([time, data], axis=1)
-        cols_edr = ['time'] + cols_edr
-
-        # downsample data
-        if dt > header['DT']:
-            downsample_factor = dt/header['DT']
-            idxs = np.round(np.arange(data.shape[0], step=downsample_factor))
-            idxs = idxs.astype(int)
-            if idxs[-1] == data.shape[0]:
-                idxs = idxs[:-1]
-            data = data[idxs, :]
-
-    if lmr_zscore:
-        lampz = zscore(data[:, cols_edr.index('Lamp')])
-        rampz = zscore(data[:, cols_edr.index('Ramp')])
-        data[:, cols_edr.index('LmR')] = lampz - rampz
-
-    if barpos_in_degrees:
-        barpos = data[:, cols_edr.index('Barpos')] * BARPOS_CONVERSION
-        barpos[barpos > 180] -= 360
-        data[:, cols_edr.index('Barpos')] = barpos
-
-    # create datetime object for file start time
-    dt_format = '%m-%d-%Y %I:%M:%S %p'
-    file_start_str = header['CTIME']
-    file_start = datetime.datetime.strptime(file_start_str, dt_format)
-
-    # store number of timepoints in header
-    header['n_timepoints'] = int(nrows)
-
-    # store recording duration in header
-    header['recording_duration'] = int(nrows) * header['DT']
+        self.cols = [header['YN%d' % ii] for ii in range(header['NC'])]
+
+        self.dt = header['DT']
+        self.n_timepoints = header['n_timepoints']
+
+        # map (but do not read) the binary data following the header
+        self.raw = np.memmap(file_name, dtype=np.int16, mode='r', offset=header_block_size,
+                             shape=(self.n_timepoints, header['NC']))
+
+        self._channels = {}
+
+    @property
+    def time(self):
+        """Time vector (in seconds) of the recording."""
+        return np.arange(self.n_timepoints) * self.dt
+
+    def scale(self, col):
+        """Factor converting raw samples of a channel to calibrated units."""
+        channel = self.cols.index(col)
+        ad = float(self.header['AD'])
+        adcmax = float(self.header['ADCMAX'] + 1)
+        return ad / (adcmax * self.header['YCF%d' % channel])
+
+    def channel(self, col):
+        """Return calibrated data from one channel, decoding it on first access."""
+        if col not in self._channels:
+            if col not in self.cols:
+                raise KeyError('Column type "{}" not recognized!'.format(col))
+            raw = self.raw[:, self.cols.index(col)]
+            self._channels[col] = np.multiply(raw, self.scale(col), dtype=self.dtype)
+
+        return self._channels[col]
+
+    __getitem__ = channel
+
+
+def open_edr(file_name, header_block_size=HEADER_BLOCK_SIZE, dtype=float):
+    """Open an edr file without loading its data (see EdrRecording)."""
+    return EdrRecording(file_name, header_block_size=header_block_size, dtype=dtype)
+
+
+BarposKinematics = namedtuple('BarposKinematics', ['wrapped', 'unwrapped', 'vel'])
+
+
+def _unwrapped_steps(wrapped, mod_range):
+    """Differences between consecutive samples of a wrapped signal, with the wraps removed."""
+    steps = np.diff(wrapped, axis=-1)
+    steps -= mod_range * np.round(steps / mod_range)
+    return steps
+
+
+def _kinematics_from_wrapped(wrapped, dt, mod_range):
+    """Unwrapped position and its gradient from a wrapped position (along the last axis)."""
+    steps = _unwrapped_steps(wrapped, mod_range)
+
+    zeros = np.zeros(wrapped.shape[:-1] + (1,), dtype=wrapped.dtype)
+    unwrapped = wrapped[..., :1] + np.concatenate([zeros, np.cumsum(steps, axis=-1)], axis=-1)
+
+    # same as np.gradient of the unwrapped position: one-sided at the ends, centered elsewhere
+    vel = np.zeros_like(wrapped)
+    if wrapped.shape[-1] > 1:
+        vel[..., 0] = steps[..., 0]
+        vel[..., -1] = steps[..., -1]
+        vel[..., 1:-1] = (steps[..., :-1] + steps[..., 1:]) / 2
+        vel /= dt
+
+    return unwrapped, vel
+
+
+def _barpos_range(in_degrees):
+    """Range over which bar position wraps around, in degrees or volts."""
+    return BARPOS_RANGE_DEGREES if in_degrees else BARPOS_RANGE_VOLTS
+
+
+def barpos_kinematics(barpos, dt, scale=1., in_degrees=True, dtype=float):
+    """
+    Wrapped and unwrapped bar position and bar velocity from raw bar position, in one pass.
+
+    The wraps are removed from the differences between consecutive samples, whose
+    cumulative sum gives the unwrapped position and whose centered averages give the
+    velocity, so no separate unwrapping or gradient is needed.
+
+    :param barpos: array of raw bar position (along the last axis), in volts or as int16
+                   samples (see scale)
+    :param dt: sampling interval
+    :param scale: factor converting barpos to volts (e.g. EdrRecording.scale('Barpos'))
+    :param in_degrees: set to True to return positions in degrees (from -180 to 180) and
+                       velocity in degrees per second, otherwise in volts
+    :param dtype: floating point type of results
+    :return: BarposKinematics of wrapped position, unwrapped position and velocity
+    """
+    wrapped = np.multiply(barpos, scale, dtype=dtype)
+
+    if in_degrees:
+        wrapped *= BARPOS_CONVERSION
+        wrapped[wrapped > BARPOS_RANGE_DEGREES / 2] -= BARPOS_RANGE_DEGREES
+
+    unwrapped, vel = _kinematics_from_wrapped(wrapped, dt, _barpos_range(in_degrees))
+
+    return BarposKinematics(wrapped, unwrapped, vel)
+
+
+DecimationPlan = namedtuple('DecimationPlan', ['up', 'down', 'block_size', 'taps'])
+
+_decimation_plans = {}
+
+
+def decimation_plan(source_dt, dt):
+    """
+    Return the (cached) plan for resampling a signal from source_dt to dt.
+
+    The sampling ratio is approximated as down/up. For integer ratios (up == 1) as many
+    samples as possible are first averaged in blocks of block_size, whose nulls
+    fall on exactly the frequencies that would alias, and the remaining factor
+    (at least DECIMATION_MIN_FIR_FACTOR) is handled by a polyphase anti-alias
+    filter with coefficients taps; odd block sizes are preferred so that block
+    averages stay centered on the samples they replace. Non-integer ratios use the filter alone.
+    """
+
+    key = (source_dt, dt)
+
+    if key not in _decimation_plans:
+        ratio = Fraction(dt / source_dt).limit_denominator(DECIMATION_MAX_DENOMINATOR)
+        up, down = ratio.denominator, ratio.numerator
+
+        block_size = 1
+        if up == 1:
+            fir_factors = [factor for factor in range(1, down + 1)
+                           if down % factor == 0 and factor >= min(down, DECIMATION_MIN_FIR_FACTOR)]
+            # prefer odd block sizes, whose averages are centered exactly on a sample
+            fir_factors_odd = [factor for factor in fir_factors if (down // factor) % 2 == 1]
+            block_size = down // min(fir_factors_odd or fir_factors)
+
+        max_rate = max(up, down // block_size)
+        taps = sp_signal.firwin(2 * DECIMATION_HALF_LENGTH * max_rate + 1, 1. / max_rate,
+                                window=('kaiser', DECIMATION_KAISER_BETA))
+
+        _decimation_plans[key] = DecimationPlan(up, down, block_size, taps)
+
+    return _decimation_plans[key]
+
+
+def _block_mean(x, block_size, dtype=float):
+    """Average blocks of samples centered on every block_size-th sample of x."""
+    n_blocks = -(-len(x) // block_size)
+    pad_before = (block_size - 1) // 2
+    pad_after = max(0, n_blocks * block_size - len(x) - pad_before)
+
+    x = np.pad(x, (pad_before, pad_after), 'edge')[:n_blocks * block_size]
+
+    return x.reshape((n_blocks, block_size)).mean(axis=1, dtype=dtype)
+
+
+def decimate(x, source_dt, dt, dtype=float):
+    """
+    Downsample a 1D signal from source_dt to approximately dt with anti-aliasing.
+
+    x can be raw int16 data; it is only expanded to floating point after block
+    averaging (or inside the polyphase filter), so the full-rate signal is never
+    converted as a whole. The result has ceil(len(x) * up / down) samples of type
+    dtype, the kth of which corresponds to time k * source_dt * down / up.
+    """
+    plan = decimation_plan(source_dt, dt)
+
+    if plan.block_size > 1:
+        x = _block_mean(x, plan.block_size, dtype=dtype)
+
+    down = plan.down // plan.block_size
+    if plan.up == 1 and down == 1:
+        return np.asarray(x, dtype=dtype)
+
+    x = np.asarray(x, dtype=dtype)
+    taps = plan.taps.astype(dtype)
+
+    return sp_signal.resample_poly(x, plan.up, down, window=taps)
+
+
+def _zscore(x):
+    """Z-score an array without leaving its floating point type."""
+    return (x - x.mean()) / x.std()
+
+
+class _SampleGrid(object):
+    """
+    Timepoints of a recording that remain after downsampling it to dt.
+
+    The grid is uniform, so the raw index and time of any timepoint, and the
+    timepoint corresponding to any time, are computed directly rather than looked
+    up in a time vector.
+    """
+
+    def __init__(self, header, dt, anti_alias):
+        self.dt = dt
+        self.source_dt = header['DT']
+        self.n_raw = header['n_timepoints']
+
+        self.downsample = dt > self.source_dt
+        self.decimated = self.downsample and anti_alias
+
+        if self.decimated:
+            plan = decimation_plan(self.source_dt, dt)
+            self.step = plan.down / plan.up
+            self.n_timepoints = -(-self.n_raw * plan.up // plan.down)
+            self.sample_dt = self.source_dt * self.step
+        elif self.downsample:
+            # pick every (dt / DT)th sample
+            self.step = dt / self.source_dt
+            self.n_timepoints = int(np.ceil(self.n_raw / self.step))
+            if np.round((self.n_timepoints - 1) * self.step) == self.n_raw:
+                self.n_timepoints -= 1
+            self.sample_dt = dt
+        else:
+            self.step = 1
+            self.n_timepoints = self.n_raw
+            self.sample_dt = self.source_dt
+
+    def idxs(self, k):
+        """Raw data indices of timepoints k."""
+        idxs = np.round(np.asarray(k) * self.step).astype(int)
+        return np.minimum(idxs, self.n_raw - 1)
+
+    def times(self, k):
+        """Times of timepoints k."""
+        return self.idxs(k) * self.source_dt
+
+    def count_before(self, times):
+        """Number of timepoints strictly earlier than each of times."""
+        times = np.asarray(times, dtype=float)
+        n = self.n_timepoints
+
+        k = np.clip(np.ceil(times / self.sample_dt), 0, n).astype(int)
+
+        # correct for rounding of raw indices
+        k = np.where((k > 0) & (self.times(np.maximum(k - 1, 0)) >= times), k - 1, k)
+        k = np.where((k < n) & (self.times(np.minimum(k, n - 1)) < times), k + 1, k)
+
+        return k
+
+    def kept_ranges(self, ignored_segments, min_seg_length):
+        """
+        Return (start, end) timepoint indices of the segments left between ignored segments.
+
+        :param ignored_segments: list of (start time, end time) tuples
+        :param min_seg_length: minimum number of time points that must be in a segment
+        """
+        n = self.n_timepoints
+
+        ignored_times = np.array(ignored_segments, dtype=float).reshape((-1, 2))
+        ignored_idxs = np.minimum(self.count_before(ignored_times), n - 1)
+
+        starts = np.concatenate([[0], ignored_idxs[:, 1]])
+        ends = np.concatenate([ignored_idxs[:, 0], [n]])
+
+        keep = (ends - starts) >= min_seg_length
+
+        return [(int(start), int(end)) for start, end in zip(starts[keep], ends[keep])]
+
+
+def _pick_range(recording, grid, col, start, end):
+    """Pick the raw (int16) samples of timepoints start to end of one channel, without filtering."""
+    raw = recording.raw[:, recording.cols.index(col)]
+
+    if grid.downsample:
+        return raw[grid.idxs(np.arange(start, end))]
+    else:
+        return raw[start:end]
+
+
+def _read_range(recording, grid, col, start, end, dtype):
+    """Read, downsample and calibrate timepoints start to end of one channel."""
+    raw = recording.raw[:, recording.cols.index(col)]
+
+    if end <= start:
+        return np.empty((0,), dtype=dtype)
+
+    if grid.decimated and col not in WRAPPED_COLS:
+        raw_start = grid.idxs(start)
+        raw_end = grid.idxs(end) if end < grid.n_timepoints else grid.n_raw
+
+        x = decimate(raw[raw_start:raw_end], grid.source_dt, grid.dt, dtype=dtype)[:end - start]
+
+        # non-integer ratios can leave a range one sample short
+        if len(x) < end - start:
+            x = np.pad(x, (0, end - start - len(x)), 'edge')
+
+    else:
+        x = _pick_range(recording, grid, col, start, end)
+
+    return np.multiply(x, recording.scale(col), dtype=dtype)
+
+
+def _zscore_segments(segments):
+    """Z-score a list of arrays using the mean and std of all of them together."""
+    if not segments:
+        return []
+
+    z = _zscore(np.concatenate(segments))
+
+    return np.split(z, np.cumsum([len(segment) for segment in segments])[:-1])
+
+
+def load_edr(file_name, header_block_size=HEADER_BLOCK_SIZE, dt=.01,
+             lmr_zscore=True, barpos_in_degrees=True, cols=None, anti_alias=True, dtype=float,
+             use_cache=True):
+    """
+    Load header info and data from binary file.
+
+    Only the channels named in cols (plus any channel a derived column such as
+    'Barvel' depends on) are read from disk, calibrated and downsampled.
+
+    When dt exceeds the recording's sampling interval, channels are decimated on
+    the raw int16 data (see decimate) before being calibrated, unless anti_alias is
+    False, in which case every (dt / DT)th sample is simply picked out.
+
+    All returned data (including time and derived columns) has the floating
+    point type dtype; use np.float32 to halve memory use.
+
+    If an on-disk cache has been set up (see edr_cache; by default one is used
+    whenever EDR_CACHE_DIRECTORY is set) the result is read from it when possible
+    and stored in it otherwise, unless use_cache is False. Cached data is returned
+    as a copy-on-write memory map.
+    """
+
+    segments, file_start, cols, header = _load_segments(
+        file_name, ignored_segments=None, min_seg_length=0, header_block_size=header_block_size,
+        dt=dt, lmr_zscore=lmr_zscore, barpos_in_degrees=barpos_in_degrees, cols=cols,
+        anti_alias=anti_alias, dtype=dtype, use_cache=use_cache)
+
+    return segments[0], file_start, cols, header
+
+
+def _load_segments(file_name, ignored_segments, min_seg_length, header_block_size, dt,
+                   lmr_zscore, barpos_in_degrees, cols, anti_alias, dtype, use_cache, time_col=True):
+    """
+    Load the segments of an edr file lying between ignored segments, through the cache.
+
+    If ignored_segments is None the whole file is returned as a single segment. Set
+    time_col to False to leave out the time column.
+    """
+
+    load_kwargs = dict(ignored_segments=ignored_segments, min_seg_length=min_seg_length,
+                       header_block_size=header_block_size, dt=dt, lmr_zscore=lmr_zscore,
+                       barpos_in_degrees=barpos_in_degrees, cols=cols, anti_alias=anti_alias,
+                       dtype=dtype, time_col=time_col)
+
+    if not (use_cache and cache):
+        return _read_segments(file_name, **load_kwargs)
+
+    params = dict(load_kwargs, dt=float(dt), cols=list(cols) if cols else None, dtype=np.dtype(dtype).str)
+    if ignored_segments is not None:
+        params['ignored_segments'] = [[float(start), float(end)] for start, end in ignored_segments]
+
+    key = cache.key(file_name, **params)
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    segments, file_start, cols, header = _read_segments(file_name, **load_kwargs)
+    cache.put(key, segments, file_start, cols, header, file_name=file_name, params=params)
+
+    return segments, file_start, cols, header
+
+
+def _read_segments(file_name, ignored_segments, min_seg_length, header_block_size, dt,
+                   lmr_zscore, barpos_in_degrees, cols, anti_alias, dtype, time_col):
+    """
+    Read only the kept segments of an edr file from disk, bypassing the cache.
+
+    Segment boundaries are computed from the header alone, so ignored parts of the
+    file are never read. A z-scored LmR uses statistics pooled over kept segments.
+    """
+
+    recording = open_edr(file_name, header_block_size=header_block_size)
+    grid = _SampleGrid(recording.header, dt, anti_alias)
 
     if cols:
-        cols = ['time'] + list(cols)
-        # rearrange data matrix
-        data_new = np.zeros((data.shape[0], len(cols)),)
+        cols = list(cols)
+    else:
+        cols = list(recording.cols)
+
+    for col in cols:
+        if col not in recording.cols and col not in DERIVED_COLS:
+            raise KeyError('Column type "{}" not recognized!'.format(col))
+
+    if time_col:
+        cols = ['time'] + cols
+
+    if ignored_segments is None:
+        ranges = [(0, grid.n_timepoints)]
+    else:
+        ranges = grid.kept_ranges(ignored_segments, min_seg_length)
+
+    channels = {}
+
+    def get_channel(col):
+        # read, downsample and calibrate the kept ranges of a channel the first time it is needed
+        if col not in channels:
+            if col == 'LmR' and lmr_zscore:
+                lamp_z = _zscore_segments(get_channel('Lamp'))
+                ramp_z = _zscore_segments(get_channel('Ramp'))
+                channel = [l - r for l, r in zip(lamp_z, ramp_z)]
+            elif col in ('Barpos', 'Barvel'):
+                # bar position and velocity come from the same picked int16 samples in one pass
+                kinematics = [barpos_kinematics(_pick_range(recording, grid, 'Barpos', start, end),
+                                                grid.sample_dt, scale=recording.scale('Barpos'),
+                                                in_degrees=barpos_in_degrees, dtype=dtype)
+                              for start, end in ranges]
+                channels['Barpos'] = [k.wrapped for k in kinematics]
+                channels['Barvel'] = [k.vel for k in kinematics]
+                channel = channels[col]
+            else:
+                channel = [_read_range(recording, grid, col, start, end, dtype) for start, end in ranges]
+
+            channels[col] = channel
+
+        return channels[col]
+
+    segments = []
+
+    for r_ctr, (start, end) in enumerate(ranges):
+        data = np.empty((end - start, len(cols)), dtype=dtype)
+
         for c_ctr, col in enumerate(cols):
-            if col in cols_edr:
-                data_new[:, c_ctr] = data[:, cols_edr.index(col)]
-            elif col == 'Barvel':
-                # un mod the position so we can calculate velocities properly
-                pos = data[:, cols_edr.index('Barpos')]
-                if barpos_in_degrees:
-                    mod_range = 360
-                else:
-                    mod_range = 5
-                pos_unmod = signal.unmod(pos, range=mod_range)
-                vel = np.gradient(pos_unmod) / dt
-                data_new[:, c_ctr] = vel
+            if col == 'time':
+                data[:, c_ctr] = grid.times(np.arange(start, end))
             else:
-                raise KeyError('Column type "{}" not recognized!'.format(col))
-        data = data_new
-    else:
-        cols = cols_edr
-    return data, file_start, cols, header
+                data[:, c_ctr] = get_channel(col)[r_ctr]
+
+        segments += [data]
+
+    return segments, recording.file_start, cols, recording.header
+
+
+class TrialMemo(object):
+    """
+    Least recently used store of load_from_trial results, bounded by their total size.
+
+    :param max_bytes: maximum total number of bytes of data arrays to keep
+    """
+
+    def __init__(self, max_bytes=TRIAL_MEMO_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a stored result (marking it as recently used), or None."""
+        if key not in self._entries:
+            return None
+
+        entry = self._entries.pop(key)
+        self._entries[key] = entry
+
+        return entry[0]
 
+    def put(self, key, result):
+        """Store a result whose first element is a list of data arrays, evicting old results if needed."""
+        n_bytes = sum([data_segment.nbytes for data_segment in result[0]])
 
-def load_from_trial(trial, dt=0, lmr_zscore=True, barpos_in_degrees=True, min_seg_lenth=10, unwrap_barpos=False, cols=None):
+        if key in self._entries:
+            self.n_bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (result, n_bytes)
+        self.n_bytes += n_bytes
+
+        while self.n_bytes > self.max_bytes and self._entries:
+            _, (_, n_bytes_evicted) = self._entries.popitem(last=False)
+            self.n_bytes -= n_bytes_evicted
+
+    def clear(self):
+        self._entries.clear()
+        self.n_bytes = 0
+
+
+def load_from_trial(trial, dt=0, lmr_zscore=True, barpos_in_degrees=True, min_seg_lenth=10, unwrap_barpos=False, cols=None,
+                    dtype=float, use_memo=True):
     """
     Load an edr file from a trial, splitting it into segments as indicated by
     trial.ignored_segments.
 
+    If trial_memo has been set to a TrialMemo (and use_memo is True) results are
+    memoized on the trial id, its ignored segments and all other arguments. The
+    data arrays of memoized results are shared between calls and so are read-only.
+
     :param trial: trial data model
     :param dt: time interval for discretization (if down-sampling is desired)
     :param lmr_zscore: set to True to return difference of zscores
     :param barpos_in_degrees: set to True to return bar position in degrees
     :param min_seg_length: minimum number of time points that must be in a segment
     :param unwrap_barpos: set to True to return bar position "un-modded"; useful for calculating bar velocity
+    :param cols: columns to load (all columns if None)
+    :param dtype: floating point type of returned data (e.g. np.float32 to halve memory use)
+    :param use_memo: set to False to bypass trial_memo
     :return: list of 2D arrays, with rows indicating time points and columns variables,
              file start datetime,
              column names,
              edr file header,
     """
 
-    experiment_directory_path = os.path.join(DATA_DIRECTORY, trial.experiment.directory_path)
-    file_path = os.path.join(experiment_directory_path, trial.file_name)
+    load_kwargs = dict(dt=dt, lmr_zscore=lmr_zscore, barpos_in_degrees=barpos_in_degrees,
+                       min_seg_lenth=min_seg_lenth, unwrap_barpos=unwrap_barpos, cols=cols, dtype=dtype)
 
-    data, file_start, cols, header = load_edr(file_path, dt=dt,
-                                              lmr_zscore=lmr_zscore,
-                                              barpos_in_degrees=barpos_in_degrees,
-                                              cols=cols)
+    if not (use_memo and trial_memo is not None and trial.id is not None):
+        return _load_from_trial(trial, **load_kwargs)
 
-    t = data[:, 0]  # get time vector
-    n_timesteps = len(t)
+    ignored_segments = tuple([(i_s.start_time, i_s.end_time) for i_s in trial.ignored_segments])
+    key = (trial.id, ignored_segments, tuple(cols) if cols else None, np.dtype(dtype).str) + \
+        tuple(sorted([(k, v) for k, v in load_kwargs.items() if k not in ('cols', 'dtype')]))
 
-    # get indices of ignored segments
+    result = trial_memo.get(key)
 
-    ignored_segments_idx = []
-    for i_s in trial.ignored_segments:
-        start_time_idx = np.sum(t < i_s.start_time)
-        end_time_idx = np.sum(t < i_s.end_time)
+    if result is None:
+        data, file_start, cols, header = _load_from_trial(trial, **load_kwargs)
 
-        start_time_idx = min(start_time_idx, n_timesteps - 1)
-        end_time_idx = min(end_time_idx, n_timesteps - 1)
+        # keep standalone, read-only copies so that stored results are neither
+        # larger than they appear nor modifiable in place
+        data = [np.array(data_segment) for data_segment in data]
+        for data_segment in data:
+            data_segment.setflags(write=False)
 
-        ignored_segments_idx += [(start_time_idx, end_time_idx)]
+        result = (data, file_start, cols, header)
+        trial_memo.put(key, result)
 
-    # get indices of segments to keep
-    kept_segments_idx = []
-    for k_s_ctr in range(len(ignored_segments_idx) + 1):
-        if k_s_ctr == 0:
-            start_idx = 0
-        else:
-            start_idx = ignored_segments_idx[k_s_ctr - 1][1]
+    data, file_start, cols, header = result
 
-        if k_s_ctr == len(ignored_segments_idx):
-            end_idx = n_timesteps
-        else:
-            end_idx = ignored_segments_idx[k_s_ctr][0]
+    return list(data), file_start, list(cols), dict(header)
+
+
+def _load_from_trial(trial, dt, lmr_zscore, barpos_in_degrees, min_seg_lenth, unwrap_barpos, cols, dtype):
+    """Load segments of a trial's edr file, bypassing trial_memo (see load_from_trial)."""
 
-        kept_segments_idx += [(start_idx, end_idx)]
+    experiment_directory_path = os.path.join(DATA_DIRECTORY, trial.experiment.directory_path)
+    file_path = os.path.join(experiment_directory_path, trial.file_name)
 
-    # return segments of data as long as they are long enough
-    data = [data[s[0]:s[1]] for s in kept_segments_idx if (s[1] - s[0]) >= min_seg_lenth]
+    ignored_segments = [(i_s.start_time, i_s.end_time) for i_s in trial.ignored_segments]
+
+    # read only the segments of data that are long enough
+    data, file_start, cols, header = _load_segments(
+        file_path, ignored_segments=ignored_segments, min_seg_length=min_seg_lenth,
+        header_block_size=HEADER_BLOCK_SIZE, dt=dt, lmr_zscore=lmr_zscore,
+        barpos_in_degrees=barpos_in_degrees, cols=cols, anti_alias=True, dtype=dtype,
+        use_cache=True)
 
     if unwrap_barpos:
         for data_segment in data:
             original_barpos = data_segment[:, cols.index('Barpos')]
-            data_segment[:, cols.index('Barpos')] = signal.unmod(original_barpos, range=360)
+            data_segment[:, cols.index('Barpos')], _ = _kinematics_from_wrapped(
+                original_barpos, 1., _barpos_range(barpos_in_degrees))
+
+    return data, file_start, cols, header
+
+
+class _memoized_property(object):
+    """Property computed on first access and then stored on the instance."""
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
+class TrialRecording(object):
+    """
+    Segments of a trial's recording with an implicit time base and derived channels.
+
+    Segments hold only channel data; the time of sample i of segment k is
+    t0s[k] + i * dt. Derived channels (unwrapped bar position, velocity, etc.)
+    are lists with one array per segment, computed on first access and then kept.
+
+    :param segments: list of 2D arrays, with rows indicating time points and columns channels
+    :param t0s: start time of each segment
+    :param dt: sampling interval
+    :param cols: channel names
+    :param barpos_in_degrees: whether the Barpos channel is in degrees (rather than volts)
+    :param file_start: recording start datetime
+    :param header: edr file header
+    """
 
-    return data, file_start, cols, header
\ No newline at end of file
+    def __init__(self, segments, t0s, dt, cols, barpos_in_degrees=True, file_start=None, header=None):
+        self.segments = segments
+        self.t0s = list(t0s)
+        self.dt = dt
+        self.cols = list(cols)
+        self.barpos_in_degrees = barpos_in_degrees
+        self.file_start = file_start
+        self.header = header
+
+    @classmethod
+    def from_trial(cls, trial, dt=0, cols=None, barpos_in_degrees=True, min_seg_length=10, dtype=float,
+                   use_cache=True):
+        """
+        Load the kept segments of a trial (see load_from_trial) without a time column.
+
+        LmR is loaded as recorded; its z-scored version is available as lmr_zscore.
+        """
+        experiment_directory_path = os.path.join(DATA_DIRECTORY, trial.experiment.directory_path)
+        file_path = os.path.join(experiment_directory_path, trial.file_name)
+
+        ignored_segments = [(i_s.start_time, i_s.end_time) for i_s in trial.ignored_segments]
+
+        segments, file_start, cols, header = _load_segments(
+            file_path, ignored_segments=ignored_segments, min_seg_length=min_seg_length,
+            header_block_size=HEADER_BLOCK_SIZE, dt=dt, lmr_zscore=False,
+            barpos_in_degrees=barpos_in_degrees, cols=cols, anti_alias=True, dtype=dtype,
+            use_cache=use_cache, time_col=False)
+
+        # segment start times follow from the header alone
+        grid = _SampleGrid(header, dt, True)
+        ranges = grid.kept_ranges(ignored_segments, min_seg_length)
+        t0s = grid.times([start for start, _ in ranges])
+
+        return cls(segments, t0s, grid.sample_dt, cols, barpos_in_degrees=barpos_in_degrees,
+                   file_start=file_start, header=header)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def channel(self, col):
+        """Return a list with one array per segment of a recorded channel."""
+        if col not in self.cols:
+            raise KeyError('Column type "{}" not recognized!'.format(col))
+        c_ctr = self.cols.index(col)
+        return [segment[:, c_ctr] for segment in self.segments]
+
+    __getitem__ = channel
+
+    def time(self, segment_idx):
+        """Return the time vector of one segment."""
+        t0 = self.t0s[segment_idx]
+        return t0 + np.arange(len(self.segments[segment_idx])) * self.dt
+
+    @_memoized_property
+    def _barpos_kinematics(self):
+        mod_range = _barpos_range(self.barpos_in_degrees)
+        return [_kinematics_from_wrapped(barpos, self.dt, mod_range) for barpos in self['Barpos']]
+
+    @_memoized_property
+    def barpos_unwrapped(self):
+        """Bar position, un-modded so that it changes continuously."""
+        return [unwrapped for unwrapped, _ in self._barpos_kinematics]
+
+    @_memoized_property
+    def vel(self):
+        """Bar velocity."""
+        return [vel for _, vel in self._barpos_kinematics]
+
+    @_memoized_property
+    def vel_abs(self):
+        """Absolute bar velocity."""
+        return [np.abs(vel) for vel in self.vel]
+
+    @_memoized_property
+    def lpr(self):
+        """Left plus right wing beat amplitude."""
+        return [lamp + ramp for lamp, ramp in zip(self['Lamp'], self['Ramp'])]
+
+    @_memoized_property
+    def lmr_zscore(self):
+        """Difference of left and right wing beat amplitude zscores (pooled over segments)."""
+        lamp_z = _zscore_segments(self['Lamp'])
+        ramp_z = _zscore_segments(self['Ramp'])
+        return [l - r for l, r in zip(lamp_z, ramp_z)]
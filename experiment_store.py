@@ -0,0 +1,160 @@
+"""
+Consolidated, channel-major archive of all the edr recordings of an experiment.
+
+An archive consists of three files sharing a common path prefix:
+
+    <path>.bin: raw int16 samples, stored channel by channel for each trial
+    <path>.index.npy: index table with one (trial id, channel, offset, length, scale)
+                      record per trial channel, offset and length being in samples
+    <path>.json: header and file info for each trial
+
+The whole archive is mapped into memory once, after which the raw samples of any
+channel of any trial are available as a zero-copy view.
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import numpy as np
+
+import edr_handling
+
+INDEX_DTYPE = np.dtype([('trial_id', np.int64), ('channel', 'S32'), ('offset', np.int64),
+                        ('length', np.int64), ('scale', np.float64)])
+CHUNK_SIZE = 2 ** 20  # number of samples copied at once when packing
+
+
+def _paths(store_path):
+    return store_path + '.bin', store_path + '.index.npy', store_path + '.json'
+
+
+def pack_experiment(experiment, store_path, cols=None):
+    """
+    Pack the edr files of all trials of an experiment into one archive.
+
+    :param experiment: experiment data model
+    :param store_path: path prefix of archive files
+    :param cols: channels to include (all channels if None)
+    :return: ExperimentStore for the new archive
+    """
+    paths = _paths(store_path)
+
+    # write to temporary files first, so that a failure leaves no partial archive behind
+    temp_paths = [path + '.tmp' for path in paths]
+    data_path, index_path, info_path = temp_paths
+
+    experiment_directory_path = os.path.join(edr_handling.DATA_DIRECTORY, experiment.directory_path)
+
+    index = []
+    info = {'experiment_id': experiment.id, 'trials': {}}
+    offset = 0
+
+    try:
+        with open(data_path, 'wb') as f:
+            for trial in sorted(experiment.trials, key=lambda trial: trial.id):
+                file_path = os.path.join(experiment_directory_path, trial.file_name)
+                recording = edr_handling.open_edr(file_path)
+
+                for col in (cols or recording.cols):
+                    column = recording.raw[:, recording.cols.index(col)]
+
+                    # copy strided column to contiguous block, a chunk at a time
+                    for start in range(0, len(column), CHUNK_SIZE):
+                        np.ascontiguousarray(column[start:start + CHUNK_SIZE]).tofile(f)
+
+                    index += [(trial.id, col, offset, len(column), recording.scale(col))]
+                    offset += len(column)
+
+                info['trials'][str(trial.id)] = {
+                    'file_name': trial.file_name,
+                    'file_start': recording.file_start.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'header': recording.header,
+                }
+
+        with open(index_path, 'wb') as f:
+            np.save(f, np.array(index, dtype=INDEX_DTYPE))
+
+        with open(info_path, 'w') as f:
+            json.dump(info, f)
+
+    except Exception:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+    for temp_path, path in zip(temp_paths, paths):
+        os.rename(temp_path, path)
+
+    return ExperimentStore(store_path)
+
+
+class ExperimentStore(object):
+    """
+    Memory-mapped archive created by pack_experiment.
+
+    :param store_path: path prefix of archive files
+    """
+
+    def __init__(self, store_path):
+        data_path, index_path, info_path = _paths(store_path)
+
+        self.store_path = store_path
+        self.index = np.load(index_path)
+
+        with open(info_path) as f:
+            info = json.load(f)
+
+        self.experiment_id = info['experiment_id']
+        self.headers = dict([(int(trial_id), trial_info['header'])
+                             for trial_id, trial_info in info['trials'].items()])
+        self.file_names = dict([(int(trial_id), trial_info['file_name'])
+                                for trial_id, trial_info in info['trials'].items()])
+
+        # map (but do not read) all samples
+        if os.path.getsize(data_path):
+            self.data = np.memmap(data_path, dtype=np.int16, mode='r')
+        else:
+            self.data = np.zeros((0,), dtype=np.int16)
+
+        self._records = {}
+        self._cols = {}
+        for record in self.index:
+            trial_id = int(record['trial_id'])
+            channel = record['channel']
+            if not isinstance(channel, str):
+                channel = channel.decode('utf-8')
+
+            self._records[(trial_id, channel)] = record
+            self._cols.setdefault(trial_id, []).append(channel)
+
+    @property
+    def trial_ids(self):
+        return sorted(self.headers.keys())
+
+    def cols(self, trial_id):
+        """Channels stored for a trial."""
+        return list(self._cols.get(trial_id, []))
+
+    def dt(self, trial_id):
+        """Sampling interval of a trial."""
+        return self.headers[trial_id]['DT']
+
+    def _record(self, trial_id, col):
+        try:
+            return self._records[(trial_id, col)]
+        except KeyError:
+            raise KeyError('Channel "{}" of trial {} not in store!'.format(col, trial_id))
+
+    def scale(self, trial_id, col):
+        """Factor converting raw samples of a trial channel to calibrated units."""
+        return float(self._record(trial_id, col)['scale'])
+
+    def raw(self, trial_id, col):
+        """Zero-copy view of the raw int16 samples of a trial channel."""
+        record = self._record(trial_id, col)
+        return self.data[record['offset']:record['offset'] + record['length']]
+
+    def channel(self, trial_id, col, dtype=float):
+        """Calibrated samples of a trial channel."""
+        return np.multiply(self.raw(trial_id, col), self.scale(trial_id, col), dtype=dtype)
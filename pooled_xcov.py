@@ -0,0 +1,138 @@
+"""
+Experiment-level cross-covariances pooled over trials.
+
+The cross-covariance statistics (see xcov.XcovStats) of every trial are computed in
+a pool of worker processes and then summed within groups of trials (by insect, odor
+and solenoid state, or any subset of these). Summing the statistics pools the
+samples of all segments of all trials in a group, so each trial is weighted by its
+total segment length, and the pooled correlations, p-values and confidence bounds
+follow exactly as for a single trial.
+
+Example:
+    table, errors = pooled_xcov(trial_ids, [('vel', 'lmr'), ('odor', 'freq')], 12, 125, dt=.04,
+                                group_by=('odor', 'solenoid_active'))
+    for row in table:
+        print(row.odor, row.solenoid_active, row.cause, row.effect, row.n_trials, row.xcov.max())
+"""
+from __future__ import print_function, division
+
+from collections import namedtuple
+
+from db_api import queries
+
+import batch
+import edr_handling
+import xcov
+
+GROUP_COLUMNS = ('insect', 'odor', 'solenoid_active')
+
+PooledXcov = namedtuple('PooledXcov', list(GROUP_COLUMNS) + ['cause', 'effect', 'n_trials', 'n_samples']
+                        + list(xcov.XcovResult._fields))
+
+
+def trial_signals(trial, recording):
+    """
+    Signals of a trial that can be cross-correlated, by name.
+
+    :param trial: models.Trial
+    :param recording: edr_handling.TrialRecording of the trial
+    :return: dict mapping names to lists of segments ('odor' only if the solenoid was active)
+    """
+    signals = {'vel': recording.vel, 'vel_abs': recording.vel_abs, 'lmr': recording['LmR'],
+               'lpr': recording.lpr, 'freq': recording['Freq']}
+
+    if trial.odor_status is not None and trial.odor_status.solenoid_active:
+        signals['odor'] = recording['S1']
+
+    return signals
+
+
+def trial_group(trial):
+    """Values of GROUP_COLUMNS for a trial."""
+    if trial.odor_status is None:
+        return trial.insect_id, None, False
+    return trial.insect_id, trial.odor_status.odor, bool(trial.odor_status.solenoid_active)
+
+
+class _TrialXcovStats(object):
+    """Compute the group and cross-covariance statistics of one trial (in a worker process)."""
+
+    def __init__(self, pairs, n_lags_back, n_lags_forward, dt):
+        self.pairs = pairs
+        self.n_lags_back = n_lags_back
+        self.n_lags_forward = n_lags_forward
+        self.dt = dt
+
+    def __call__(self, trial_id):
+        try:
+            trial = queries.get_trial(batch.session, trial_id)
+
+            recording = edr_handling.TrialRecording.from_trial(trial, dt=self.dt)
+            signals = trial_signals(trial, recording)
+
+            # pairs involving signals the trial does not have are left out of its group
+            pairs = [pair for pair in self.pairs if pair[0] in signals and pair[1] in signals]
+
+            return trial_group(trial), xcov.xcov_stats(signals, pairs, self.n_lags_back, self.n_lags_forward)
+        finally:
+            batch.session.rollback()
+
+
+def pool_stats(trial_stats, group_by=GROUP_COLUMNS):
+    """
+    Sum the statistics of trials within groups.
+
+    :param trial_stats: list of (group, stats) tuples, with group the values of GROUP_COLUMNS
+                        and stats a dict mapping pairs to XcovStats
+    :param group_by: columns to group by (others are pooled over)
+    :return: dict mapping (group, pair) to (number of trials, summed XcovStats), with the
+             values of columns not grouped by set to None
+    """
+    pooled = {}
+
+    for group, stats in trial_stats:
+        group = tuple([value if column in group_by else None for column, value in zip(GROUP_COLUMNS, group)])
+
+        for pair, pair_stats in stats.items():
+            if (group, pair) in pooled:
+                n_trials, summed = pooled[group, pair]
+                pooled[group, pair] = (n_trials + 1, summed + pair_stats)
+            else:
+                pooled[group, pair] = (1, pair_stats)
+
+    return pooled
+
+
+def pooled_xcov(trial_ids, pairs, n_lags_back, n_lags_forward, dt, group_by=GROUP_COLUMNS, confidence=.95,
+                normed=True, n_processes=batch.N_PROCESSES):
+    """
+    Compute cross-covariances pooled over groups of trials.
+
+    :param trial_ids: ids of trials to include
+    :param pairs: list of (cause name, effect name) tuples (names as in trial_signals)
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param dt: sampling interval to load trials at
+    :param group_by: columns of GROUP_COLUMNS to group trials by
+    :param confidence: confidence level of bounds
+    :param normed: if True, return correlations, otherwise covariances
+    :param n_processes: number of worker processes
+    :return: list of PooledXcov rows sorted by group and pair, dict of formatted tracebacks
+             of trials that could not be processed
+    """
+    for column in group_by:
+        if column not in GROUP_COLUMNS:
+            raise ValueError('Cannot group by "{}"; columns are {}!'.format(column, GROUP_COLUMNS))
+
+    trial_stats, errors = batch.map_in_pool(_TrialXcovStats(pairs, n_lags_back, n_lags_forward, dt),
+                                            trial_ids, n_processes=n_processes)
+
+    pooled = pool_stats([trial_stats[trial_id] for trial_id in trial_ids if trial_id in trial_stats],
+                        group_by=group_by)
+
+    table = []
+    for (group, pair), (n_trials, summed) in sorted(pooled.items(), key=lambda item: repr(item[0])):
+        result = summed.result(confidence=confidence, normed=normed)
+        table += [PooledXcov(*(group + pair + (n_trials, summed.n.max()) + tuple(result)))]
+
+    return table, errors
@@ -0,0 +1,81 @@
+"""
+Render figures for many trials without a display, in parallel.
+
+Plotting functions used for reports take an item (e.g. a trial id) and a subplots
+function with the same signature as plt.subplots, and return a list of
+(name, figure) tuples. Interactively they are called with plt.subplots; for reports
+they are called in worker processes with reports.subplots, which creates figures
+attached to a non-interactive Agg canvas, so no windows are opened. Every figure is
+saved as a PNG, and all figures are collected into one multi-page PDF.
+"""
+from __future__ import print_function, division
+
+import os
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+
+import batch
+
+REPORT_DPI = 100
+
+
+def subplots(nrows=1, ncols=1, figsize=None, tight_layout=False, **kwargs):
+    """Drop-in replacement for plt.subplots that does not need a display or pyplot."""
+    fig = Figure(figsize=figsize, tight_layout=tight_layout)
+    FigureCanvasAgg(fig)
+
+    axs = fig.subplots(nrows, ncols, **kwargs)
+
+    return fig, axs
+
+
+class _RenderItem(object):
+    """Render the figures of one item to PNGs and return them (to be added to the PDF)."""
+
+    def __init__(self, plot_function, directory, item_name, dpi):
+        self.plot_function = plot_function
+        self.directory = directory
+        self.item_name = item_name
+        self.dpi = dpi
+
+    def __call__(self, item):
+        figs = self.plot_function(item, subplots)
+
+        for name, fig in figs:
+            file_name = '{}_{}.png'.format(self.item_name(item), name)
+            fig.savefig(os.path.join(self.directory, file_name), dpi=self.dpi)
+
+        return figs
+
+
+def render_report(plot_function, items, directory, report_name='report', item_name=str,
+                  n_processes=batch.N_PROCESSES, dpi=REPORT_DPI):
+    """
+    Render the figures of several items in a pool of worker processes, save each one as
+    <directory>/<item name>_<figure name>.png and collect them all, in order of items, in
+    <directory>/<report_name>.pdf.
+
+    :param plot_function: function of item and subplots function returning (name, figure) tuples
+    :param items: list of items to plot (e.g. trial ids)
+    :param directory: directory to save figures in (created if needed)
+    :param report_name: name of PDF file
+    :param item_name: module-level function giving the name of an item used in PNG file names
+    :param n_processes: number of worker processes
+    :param dpi: resolution of PNGs
+    :return: path of PDF file, dict of formatted tracebacks of items that could not be plotted
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    figs, errors = batch.map_in_pool(_RenderItem(plot_function, directory, item_name, dpi), items,
+                                     n_processes=n_processes, use_database=False)
+
+    pdf_path = os.path.join(directory, '{}.pdf'.format(report_name))
+
+    with PdfPages(pdf_path) as pdf:
+        for item in items:
+            for _, fig in figs.get(item, []):
+                pdf.savefig(fig)
+
+    return pdf_path, errors
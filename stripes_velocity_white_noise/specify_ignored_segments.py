@@ -9,7 +9,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from db_api.connect import session
-from db_api import models
+from db_api import models, queries
 
 import edr_handling
 from plotting import SegmentSelector, plot_trial_basic
@@ -28,8 +28,7 @@ def main():
     print(instructions)
 
     # get trials
-    trials = session.query(models.Trial). \
-        filter(models.Trial.experiment_id == EXPERIMENT_ID). \
+    trials = queries.trials_query(session, experiment_id=EXPERIMENT_ID). \
         filter(models.Trial.recording_start >= EARLIEST_DATETIME)
 
     for trial in trials:
@@ -4,20 +4,30 @@ Plot the cross-correlations between the following pairs of variables for a speci
 velocity vs. left-minus-right
 velocity vs. frequency
 absolute velocity vs. frequency
+
+Cross-correlations for all trials are first computed in parallel by a pool of worker
+processes and saved to RESULTS_SUBDIRECTORY of batch.RESULTS_DIRECTORY (set COMPUTE to
+False to only view saved results); the plots for each trial are then shown one by one,
+or, if REPORT is True, rendered in parallel to PNG files and one combined PDF.
 """
 from __future__ import print_function, division
 
+import os
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal as sp_signal
 
-from math_tools import signal
-
-from db_api import models
-from db_api.connect import session
+from db_api import queries
 
+import batch
 import edr_handling
+import reports
+import surrogates
+import xcov
 
+COMPUTE = True
+REPORT = False  # save figures of all trials to files instead of showing them
 PLOT_TIME_SERIES = False
 PLOT_AUTO_CORRELATIONS = True
 PLOT_P_VALUES = False
@@ -25,6 +35,8 @@ PLOT_P_VALUES = False
 FIG_SIZE_TIME_SERIES = (16, 16)
 
 TRIAL_IDS = xrange(1, 36)
+RESULTS_SUBDIRECTORY = 'stripes_velocity_white_noise_cross_correlations'
+
 LAG_FORWARD = 5  # in seconds
 LAG_BACK = 0.5  # in seconds
 DT = .04  # in seconds
@@ -37,164 +49,243 @@ CONTROL_FILTER = np.concatenate([np.zeros(20,), CONTROL_FILTER[:-CONTROL_SHIFT]]
 CONTROL_NOISE = 0.000001
 N_TIMESTEPS_FILTER = len(CONTROL_FILTER)
 
+# (cause, effect) pairs of signals to cross-correlate
+XCOV_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('rand', 'lpr'), ('vel', 'control'), ('vel', 'freq'),
+              ('vel_abs', 'freq'), ('vel', 'vel'), ('rand', 'rand'), ('lmr', 'lmr'), ('lpr', 'lpr'),
+              ('freq', 'freq')]
+
 # for building a random time-series
 STIM_RANDOM_NOISE = 100
 
+# (cause, effect) pairs for which to compute empirical null bands from surrogate causes
+NULL_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('vel', 'freq'), ('vel_abs', 'freq')]
+N_SURROGATES = 200
+SURROGATE_METHOD = 'phase'  # 'phase' or 'shift'
+
 LW = 2
 ALPHA = 0.3
 
 
-def main():
-    for trial_id in TRIAL_IDS:
+def results_path(trial_id):
+    return batch.results_path(RESULTS_SUBDIRECTORY, 'trial_{}.npz'.format(trial_id))
 
-        print('Trial {}'.format(trial_id))
-        trial = session.query(models.Trial).get(trial_id)
 
-        data, _, cols, _ = edr_handling.load_from_trial(trial, dt=DT, unwrap_barpos=True, lmr_zscore=False)
+def compute_trial(trial_id):
+    """Compute the cross-correlations for one trial and save them along with its down-sampled time-series."""
+    try:
+        trial = queries.get_trial(batch.session, trial_id)
 
-        pos = [data_segment[:, cols.index('Barpos')] for data_segment in data]
-        vel = [np.gradient(pos_segment) / DT for pos_segment in pos]
-        vel_abs = [np.abs(vel_segment) for vel_segment in vel]
-        lmr = [data_segment[:, cols.index('LmR')] for data_segment in data]
-        lpr = [data_segment[:, cols.index('Lamp')] + data_segment[:, cols.index('Ramp')]
-               for data_segment in data]
-        freq = [data_segment[:, cols.index('Freq')] for data_segment in data]
-        stim_rand = [np.random.normal(0, STIM_RANDOM_NOISE, len(v)) for v in vel]
+        recording = edr_handling.TrialRecording.from_trial(trial, dt=DT)
+
+        vel = recording.vel
+
+        # seed by trial so that worker processes do not share random time-series
+        random_state = np.random.RandomState(trial_id)
+        stim_rand = [random_state.normal(0, STIM_RANDOM_NOISE, len(v)) for v in vel]
 
         # build a control response to make sure we'd be able to accurately recover the filter if there was one
         control = [sp_signal.fftconvolve(v, CONTROL_FILTER, 'full') for v in vel]
-        control = [c + np.random.normal(0, CONTROL_NOISE, c.shape) for c in control]
+        control = [c + random_state.normal(0, CONTROL_NOISE, c.shape) for c in control]
         control = [c[:-N_TIMESTEPS_FILTER + 1] for c in control]
 
-        # calculate various cross-correlations (first variable is always "cause", second, "effect")
+        # calculate all cross- and auto-correlations at once (first variable is always "cause", second, "effect")
         n_lags_back = int(round(LAG_BACK / DT))
         n_lags_forward = int(round(LAG_FORWARD / DT))
 
-        vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = \
-            signal.xcov_simple_two_sided_multi(vel, lmr, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True,
-                                               confidence=.95)
-        vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = \
-            signal.xcov_simple_two_sided_multi(vel, lpr, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        rand_x_lpr, p_rand_x_lpr, lb_rand_x_lpr, ub_rand_x_lpr = \
-            signal.xcov_simple_two_sided_multi(stim_rand, lpr, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        vel_x_control, p_vel_x_control, lb_vel_x_control, ub_vel_x_control = \
-            signal.xcov_simple_two_sided_multi(vel, control, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = \
-            signal.xcov_simple_two_sided_multi(vel, freq, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = \
-            signal.xcov_simple_two_sided_multi(vel_abs, freq, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-
-        # calculate auto-correlations for different variables
-        vel_x_vel, p_vel_x_vel, lb_vel_x_vel, ub_vel_x_vel = \
-            signal.xcov_simple_two_sided_multi(vel, vel, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        rand_x_rand, p_rand_x_rand, lb_rand_x_rand, ub_rand_x_rand = \
-            signal.xcov_simple_two_sided_multi(stim_rand, stim_rand, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        lmr_x_lmr, p_lmr_x_lmr, lb_lmr_x_lmr, ub_lmr_x_lmr = \
-            signal.xcov_simple_two_sided_multi(lmr, lmr, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        lpr_x_lpr, p_lpr_x_lpr, lb_lpr_x_lpr, ub_lpr_x_lpr = \
-            signal.xcov_simple_two_sided_multi(lmr, lmr, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-        freq_x_freq, p_freq_x_freq, lb_freq_x_freq, ub_freq_x_freq = \
-            signal.xcov_simple_two_sided_multi(freq, freq, n_lags_back=n_lags_back,
-                                               n_lags_forward=n_lags_forward, normed=True)
-
-        t = np.arange(-n_lags_back, n_lags_forward) * DT
-
-        # plot cross-correlations
-        fig, axs = plt.subplots(5, 1, sharex=True, tight_layout=True)
-        [ax.axhline(0, ls='--') for ax in axs]
-
-        axs[0].plot(t, vel_x_lmr, lw=LW)
-        axs[0].fill_between(t, lb_vel_x_lmr, ub_vel_x_lmr, color='b', alpha=ALPHA)
-
-        axs[1].plot(t, vel_x_lpr, lw=LW)
-        axs[1].fill_between(t, lb_vel_x_lpr, ub_vel_x_lpr, color='b', alpha=ALPHA)
-
-        axs[2].plot(t, rand_x_lpr, lw=LW)
-        axs[2].fill_between(t, lb_rand_x_lpr, ub_rand_x_lpr, color='b', alpha=ALPHA)
-
-        axs[3].plot(t, vel_x_freq, lw=LW)
-        axs[3].fill_between(t, lb_vel_x_freq, ub_vel_x_freq, color='b', alpha=ALPHA)
-
-        axs[4].plot(t, vel_abs_x_freq, lw=LW)
-        axs[4].fill_between(t, lb_vel_abs_x_freq, ub_vel_abs_x_freq, color='b', alpha=ALPHA)
+        signals = {'vel': vel, 'vel_abs': recording.vel_abs, 'lmr': recording['LmR'], 'lpr': recording.lpr,
+                   'freq': recording['Freq'], 'rand': stim_rand, 'control': control}
+        results = xcov.xcov_multi(signals, XCOV_PAIRS, n_lags_back=n_lags_back,
+                                  n_lags_forward=n_lags_forward, normed=True, confidence=.95)
+
+        # empirical null bands from surrogates of the cause
+        null = {}
+        for cause, effect in NULL_PAIRS:
+            bands = surrogates.null_bands(signals[cause], signals[effect], n_lags_back, n_lags_forward,
+                                          n_surrogates=N_SURROGATES, method=SURROGATE_METHOD,
+                                          random_state=random_state)
+            null['null_lb__{}__{}'.format(cause, effect)] = bands.lb
+            null['null_ub__{}__{}'.format(cause, effect)] = bands.ub
+
+        # store time-series segments end to end
+        time_series = dict([(name, np.concatenate(signals[name]))
+                            for name in ['lmr', 'lpr', 'freq', 'vel', 'vel_abs']])
+        time_series['pos'] = np.concatenate(recording.barpos_unwrapped)
+        time_series['time'] = np.concatenate([recording.time(d_ctr) for d_ctr in range(len(recording))])
+
+        xcov.save_results(results_path(trial_id), results,
+                          t=np.arange(-n_lags_back, n_lags_forward) * DT,
+                          segment_lengths=np.array([len(v) for v in vel]), **dict(time_series, **null))
+    finally:
+        batch.session.rollback()
+
+    return results_path(trial_id)
+
+
+def plot_null_band(ax, arrays, cause, effect, color):
+    """Plot the saved null band of a cross-correlation, if there is one."""
+    key = '{}__{}'.format(cause, effect)
+    if 'null_lb__' + key in arrays:
+        ax.plot(arrays['t'], arrays['null_lb__' + key], color=color, ls=':')
+        ax.plot(arrays['t'], arrays['null_ub__' + key], color=color, ls=':')
+
+
+def trial_name(trial_id):
+    return 'trial_{}'.format(trial_id)
+
+
+def plot_trial(trial_id, subplots=plt.subplots, time_series=PLOT_TIME_SERIES, p_values=PLOT_P_VALUES,
+               auto_correlations=PLOT_AUTO_CORRELATIONS):
+    """
+    Plot the saved results of one trial.
+
+    :param trial_id: trial id
+    :param subplots: function creating figures (plt.subplots or reports.subplots)
+    :param time_series, p_values, auto_correlations: whether to plot these figures
+    :return: list of (name, figure) tuples
+    """
+    results, arrays = xcov.load_results(results_path(trial_id))
+
+    vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = results['vel', 'lmr']
+    vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = results['vel', 'lpr']
+    rand_x_lpr, p_rand_x_lpr, lb_rand_x_lpr, ub_rand_x_lpr = results['rand', 'lpr']
+    vel_x_control, p_vel_x_control, lb_vel_x_control, ub_vel_x_control = results['vel', 'control']
+    vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = results['vel', 'freq']
+    vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = results['vel_abs', 'freq']
+
+    # auto-correlations for different variables
+    vel_x_vel, p_vel_x_vel, lb_vel_x_vel, ub_vel_x_vel = results['vel', 'vel']
+    rand_x_rand, p_rand_x_rand, lb_rand_x_rand, ub_rand_x_rand = results['rand', 'rand']
+    lmr_x_lmr, p_lmr_x_lmr, lb_lmr_x_lmr, ub_lmr_x_lmr = results['lmr', 'lmr']
+    lpr_x_lpr, p_lpr_x_lpr, lb_lpr_x_lpr, ub_lpr_x_lpr = results['lpr', 'lpr']
+    freq_x_freq, p_freq_x_freq, lb_freq_x_freq, ub_freq_x_freq = results['freq', 'freq']
+
+    t = arrays['t']
+
+    figs = []
+
+    # plot cross-correlations
+    fig, axs = subplots(5, 1, sharex=True, tight_layout=True)
+    figs += [('cross_correlations', fig)]
+    [ax.axhline(0, ls='--') for ax in axs]
+
+    axs[0].plot(t, vel_x_lmr, lw=LW)
+    axs[0].fill_between(t, lb_vel_x_lmr, ub_vel_x_lmr, color='b', alpha=ALPHA)
+    plot_null_band(axs[0], arrays, 'vel', 'lmr', 'k')
+
+    axs[1].plot(t, vel_x_lpr, lw=LW)
+    axs[1].fill_between(t, lb_vel_x_lpr, ub_vel_x_lpr, color='b', alpha=ALPHA)
+    plot_null_band(axs[1], arrays, 'vel', 'lpr', 'k')
+
+    axs[2].plot(t, rand_x_lpr, lw=LW)
+    axs[2].fill_between(t, lb_rand_x_lpr, ub_rand_x_lpr, color='b', alpha=ALPHA)
+
+    axs[3].plot(t, vel_x_freq, lw=LW)
+    axs[3].fill_between(t, lb_vel_x_freq, ub_vel_x_freq, color='b', alpha=ALPHA)
+    plot_null_band(axs[3], arrays, 'vel', 'freq', 'k')
+
+    axs[4].plot(t, vel_abs_x_freq, lw=LW)
+    axs[4].fill_between(t, lb_vel_abs_x_freq, ub_vel_abs_x_freq, color='b', alpha=ALPHA)
+    plot_null_band(axs[4], arrays, 'vel_abs', 'freq', 'k')
+
+    axs[0].set_ylabel('vel x lmr')
+    axs[1].set_ylabel('vel x lpr')
+    axs[2].set_ylabel('rand x lpr')
+    axs[3].set_ylabel('vel x freq')
+    axs[4].set_ylabel('|vel| x freq')
+
+    axs[3].set_xlabel('t (s)')
+
+    axs[0].set_title('cross-correlations\nTrial {}'.format(trial_id))
+
+    if time_series:
+        # plot time-series
+        fig, axs = subplots(6, 1, figsize=FIG_SIZE_TIME_SERIES, sharex=True, tight_layout=True)
+        figs += [('time_series', fig)]
+        split_idxs = np.cumsum(arrays['segment_lengths'])[:-1]
+        segments = dict([(name, np.split(arrays[name], split_idxs))
+                         for name in ['time', 'lmr', 'lpr', 'freq', 'vel', 'vel_abs', 'pos']])
+        for d_ctr in range(len(arrays['segment_lengths'])):
+            t_segment = segments['time'][d_ctr]
+            axs[0].plot(t_segment, segments['lmr'][d_ctr], lw=LW, color='b')
+            axs[1].plot(t_segment, segments['lpr'][d_ctr], lw=LW, color='b')
+            axs[2].plot(t_segment, segments['freq'][d_ctr], lw=LW, color='b')
+            axs[3].plot(t_segment, segments['vel'][d_ctr], lw=LW, color='r')
+            axs[4].plot(t_segment, segments['vel_abs'][d_ctr], lw=LW, color='r')
+            axs[5].plot(t_segment, segments['pos'][d_ctr], lw=LW, color='r')
+        axs[0].set_ylabel('lmr')
+        axs[1].set_ylabel('lpr')
+        axs[2].set_ylabel('freq')
+        axs[3].set_ylabel('vel')
+        axs[4].set_ylabel('vel_abs')
+        axs[5].set_ylabel('pos')
+        axs[5].set_xlabel('t (s)')
+        axs[0].set_title('down-sampled time-series')
+        axs[0].set_xlim(arrays['time'][0], arrays['time'][-1])
+
+    # plot p-values
+    if p_values:
+        fig, axs = subplots(4, 1, sharex=True, tight_layout=True)
+        figs += [('p_values', fig)]
+        axs[0].plot(t, p_vel_x_lmr)
+        #axs[0].plot(t, p_vel_x_control, c='k')
+        axs[1].plot(t, p_vel_x_lpr)
+        axs[2].plot(t, p_vel_x_freq)
+        axs[3].plot(t, p_vel_abs_x_freq)
+
+        [ax.set_ylim(0, 0.1) for ax in axs]
 
         axs[0].set_ylabel('vel x lmr')
         axs[1].set_ylabel('vel x lpr')
-        axs[2].set_ylabel('rand x lpr')
-        axs[3].set_ylabel('vel x freq')
-        axs[4].set_ylabel('|vel| x freq')
+        axs[2].set_ylabel('vel x freq')
+        axs[3].set_ylabel('|vel| x freq')
 
         axs[3].set_xlabel('t (s)')
 
-        axs[0].set_title('cross-correlations')
-
-        if PLOT_TIME_SERIES:
-            # plot time-series
-            fig, axs = plt.subplots(6, 1, figsize=FIG_SIZE_TIME_SERIES, sharex=True, tight_layout=True)
-            for d_ctr, data_segment in enumerate(data):
-                t = data_segment[:, 0]
-                axs[0].plot(t, lmr[d_ctr], lw=LW, color='b')
-                axs[1].plot(t, lpr[d_ctr], lw=LW, color='b')
-                axs[2].plot(t, freq[d_ctr], lw=LW, color='b')
-                axs[3].plot(t, vel[d_ctr], lw=LW, color='r')
-                axs[4].plot(t, vel_abs[d_ctr], lw=LW, color='r')
-                axs[5].plot(t, pos[d_ctr], lw=LW, color='r')
-            axs[0].set_ylabel('lmr')
-            axs[1].set_ylabel('lpr')
-            axs[2].set_ylabel('freq')
-            axs[3].set_ylabel('vel')
-            axs[4].set_ylabel('vel_abs')
-            axs[5].set_ylabel('pos')
-            axs[5].set_xlabel('t (s)')
-            axs[0].set_title('down-sampled time-series')
-            axs[0].set_xlim(data[0][0, 0], data[-1][-1, 0])
-
-        # plot p-values
-        if PLOT_P_VALUES:
-            fig, axs = plt.subplots(4, 1, sharex=True, tight_layout=True)
-            axs[0].plot(t, p_vel_x_lmr)
-            #axs[0].plot(t, p_vel_x_control, c='k')
-            axs[1].plot(t, p_vel_x_lpr)
-            axs[2].plot(t, p_vel_x_freq)
-            axs[3].plot(t, p_vel_abs_x_freq)
-
-            [ax.set_ylim(0, 0.1) for ax in axs]
-
-            axs[0].set_ylabel('vel x lmr')
-            axs[1].set_ylabel('vel x lpr')
-            axs[2].set_ylabel('vel x freq')
-            axs[3].set_ylabel('|vel| x freq')
-
-            axs[3].set_xlabel('t (s)')
-
-            axs[0].set_title('p-values')
-
-        # plot auto-correlations
-        if PLOT_AUTO_CORRELATIONS:
-            fig, axs = plt.subplots(4, 1, sharex=True, tight_layout=True)
-            axs[0].plot(t, vel_x_vel)
-            axs[1].plot(t, lmr_x_lmr)
-            axs[2].plot(t, lpr_x_lpr)
-            axs[3].plot(t, freq_x_freq)
-
-            axs[0].set_ylabel('vel')
-            axs[1].set_ylabel('lmr')
-            axs[2].set_ylabel('lpr')
-            axs[3].set_ylabel('freq')
-
-            axs[3].set_xlabel('t (s)')
-
-            axs[0].set_title('auto-correlations')
+        axs[0].set_title('p-values')
+
+    # plot auto-correlations
+    if auto_correlations:
+        fig, axs = subplots(4, 1, sharex=True, tight_layout=True)
+        figs += [('auto_correlations', fig)]
+        axs[0].plot(t, vel_x_vel)
+        axs[1].plot(t, lmr_x_lmr)
+        axs[2].plot(t, lpr_x_lpr)
+        axs[3].plot(t, freq_x_freq)
+
+        axs[0].set_ylabel('vel')
+        axs[1].set_ylabel('lmr')
+        axs[2].set_ylabel('lpr')
+        axs[3].set_ylabel('freq')
+
+        axs[3].set_xlabel('t (s)')
+
+        axs[0].set_title('auto-correlations')
+
+    return figs
+
+
+def main():
+    if COMPUTE:
+        batch.map_in_pool(compute_trial, TRIAL_IDS)
+
+    trial_ids = [trial_id for trial_id in TRIAL_IDS if os.path.exists(results_path(trial_id))]
+    for trial_id in sorted(set(TRIAL_IDS) - set(trial_ids)):
+        print('No results saved for trial {}'.format(trial_id))
+
+    if REPORT:
+        # render all figures of all trials without opening any windows
+        plot_function = functools.partial(plot_trial, time_series=True, p_values=True, auto_correlations=True)
+        figure_directory = batch.results_path(RESULTS_SUBDIRECTORY, 'figures')
+        pdf_path, _ = reports.render_report(plot_function, trial_ids, figure_directory,
+                                            report_name='cross_correlations', item_name=trial_name)
+        print('Report saved to {}'.format(pdf_path))
+        return
+
+    for trial_id in trial_ids:
+
+        print('Trial {}'.format(trial_id))
+
+        plot_trial(trial_id)
 
         plt.show(block=True)
 
@@ -4,29 +4,49 @@ Plot the cross-correlations between the following pairs of variables for a speci
 velocity vs. left-minus-right
 velocity vs. frequency
 absolute velocity vs. frequency
+
+Cross-correlations for all trials of all trial pairs are first computed in parallel by a
+pool of worker processes and saved to RESULTS_SUBDIRECTORY of batch.RESULTS_DIRECTORY (set
+COMPUTE to False to only view saved results). The on-minus-off differences of the
+DIFFERENCE_PAIRS are computed per trial pair by trial_pairs.analyze_trial_pairs, which
+normalizes both trials jointly so that their difference can be compared against bootstrap
+and surrogate null bands; the per-trial cross-correlations above remain for everything the
+paired analysis does not cover (random and control inputs, auto-correlations, time-series).
+The plots for each trial pair are then shown one by one, or, if REPORT is True, rendered in
+parallel to PNG files and one combined PDF.
 """
 from __future__ import print_function, division
 
+import os
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal as sp_signal
 
-from math_tools import signal
-
-from db_api import models
+from db_api import queries
 from db_api.connect import session
 
+import batch
 import edr_handling
+import reports
+import surrogates
+import trial_pairs as paired
+import xcov
 
+COMPUTE = True
+REPORT = False  # save figures of all trial pairs to files instead of showing them
 PLOT_TIME_SERIES = True
 PLOT_AUTO_CORRELATIONS = False
 PLOT_P_VALUES = False
+PLOT_DIFFERENCES = True
 COLORS = ('k', 'b')
 
 FIG_SIZE_CC = (12, 12)
 FIG_SIZE_TIME_SERIES = (16, 16)
 
 EXPERIMENT_ID = 'stripes_velocity_white_noise_footodor_vs_control'
+RESULTS_SUBDIRECTORY = 'stripes_velocity_white_noise_footodor_vs_control_cross_correlations'
+
 LAG_FORWARD = 5  # in seconds
 LAG_BACK = 0.5  # in seconds
 DT = .04  # in seconds
@@ -39,17 +59,310 @@ CONTROL_FILTER = np.concatenate([np.zeros(20,), CONTROL_FILTER[:-CONTROL_SHIFT]]
 CONTROL_NOISE = 0.000001
 N_TIMESTEPS_FILTER = len(CONTROL_FILTER)
 
+# (cause, effect) pairs of signals to cross-correlate
+XCOV_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('rand', 'lpr'), ('vel', 'control'), ('vel', 'freq'),
+              ('vel_abs', 'freq'), ('vel', 'vel'), ('rand', 'rand'), ('lmr', 'lmr'), ('lpr', 'lpr'),
+              ('freq', 'freq')]
+
 # for building a random time-series
 STIM_RANDOM_NOISE = 100
 
+# (cause, effect) pairs for which to compute empirical null bands from surrogate causes
+NULL_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('vel', 'freq'), ('vel_abs', 'freq')]
+N_SURROGATES = 200
+SURROGATE_METHOD = 'phase'  # 'phase' or 'shift'
+
+# (cause, effect) pairs for which to compute on-minus-off differences within each trial pair
+DIFFERENCE_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('vel', 'freq'), ('vel_abs', 'freq')]
+N_BOOTSTRAP = 1000
+
 LW = 2
 ALPHA = 0.3
 
 
+def results_path(trial_id):
+    return batch.results_path(RESULTS_SUBDIRECTORY, 'trial_{}.npz'.format(trial_id))
+
+
+def difference_path(trial_pair_id):
+    return batch.results_path(RESULTS_SUBDIRECTORY, 'trial_pair_{}.npz'.format(trial_pair_id))
+
+
+def compute_differences(trial_pair_ids):
+    """Compute and save the on-minus-off differences of all trial pairs."""
+    n_lags_back = int(round(LAG_BACK / DT))
+    n_lags_forward = int(round(LAG_FORWARD / DT))
+
+    differences, _ = paired.analyze_trial_pairs(trial_pair_ids, DIFFERENCE_PAIRS, n_lags_back, n_lags_forward, DT,
+                                                n_bootstrap=N_BOOTSTRAP, n_surrogates=N_SURROGATES,
+                                                surrogate_method=SURROGATE_METHOD)
+
+    for trial_pair_id, difference in differences.items():
+        paired.save_differences(difference_path(trial_pair_id), difference,
+                                t=np.arange(-n_lags_back, n_lags_forward) * DT)
+
+
+def compute_trial(trial_id):
+    """Compute the cross-correlations for one trial and save them along with its down-sampled time-series."""
+    try:
+        trial = queries.get_trial(batch.session, trial_id)
+
+        recording = edr_handling.TrialRecording.from_trial(trial, dt=DT)
+
+        vel = recording.vel
+
+        # seed by trial so that worker processes do not share random time-series
+        random_state = np.random.RandomState(trial_id)
+        stim_rand = [random_state.normal(0, STIM_RANDOM_NOISE, len(v)) for v in vel]
+
+        # build a control response to make sure we'd be able to accurately recover the filter if there was one
+        control = [sp_signal.fftconvolve(v, CONTROL_FILTER, 'full') for v in vel]
+        control = [c + random_state.normal(0, CONTROL_NOISE, c.shape) for c in control]
+        control = [c[:-N_TIMESTEPS_FILTER + 1] for c in control]
+
+        # calculate all cross- and auto-correlations at once (first variable is always "cause", second, "effect")
+        n_lags_back = int(round(LAG_BACK / DT))
+        n_lags_forward = int(round(LAG_FORWARD / DT))
+
+        signals = {'vel': vel, 'vel_abs': recording.vel_abs, 'lmr': recording['LmR'], 'lpr': recording.lpr,
+                   'freq': recording['Freq'], 'rand': stim_rand, 'control': control}
+        pairs = list(XCOV_PAIRS)
+
+        if trial.odor_status.solenoid_active:
+            signals['odor'] = recording['S1']
+            pairs += [('odor', 'freq')]
+
+        results = xcov.xcov_multi(signals, pairs, n_lags_back=n_lags_back,
+                                  n_lags_forward=n_lags_forward, normed=True, confidence=.95)
+
+        # empirical null bands from surrogates of the cause
+        null = {}
+        for cause, effect in NULL_PAIRS:
+            bands = surrogates.null_bands(signals[cause], signals[effect], n_lags_back, n_lags_forward,
+                                          n_surrogates=N_SURROGATES, method=SURROGATE_METHOD,
+                                          random_state=random_state)
+            null['null_lb__{}__{}'.format(cause, effect)] = bands.lb
+            null['null_ub__{}__{}'.format(cause, effect)] = bands.ub
+
+        # store time-series segments end to end
+        time_series = dict([(name, np.concatenate(signals[name]))
+                            for name in ['lmr', 'lpr', 'freq', 'vel', 'vel_abs', 'odor'] if name in signals])
+        time_series['pos'] = np.concatenate(recording.barpos_unwrapped)
+        time_series['time'] = np.concatenate([recording.time(d_ctr) for d_ctr in range(len(recording))])
+
+        xcov.save_results(results_path(trial_id), results,
+                          t=np.arange(-n_lags_back, n_lags_forward) * DT,
+                          segment_lengths=np.array([len(v) for v in vel]), **dict(time_series, **null))
+    finally:
+        batch.session.rollback()
+
+    return results_path(trial_id)
+
+
+def plot_null_band(ax, arrays, cause, effect, color):
+    """Plot the saved null band of a cross-correlation, if there is one."""
+    key = '{}__{}'.format(cause, effect)
+    if 'null_lb__' + key in arrays:
+        ax.plot(arrays['t'], arrays['null_lb__' + key], color=color, ls=':')
+        ax.plot(arrays['t'], arrays['null_ub__' + key], color=color, ls=':')
+
+
+def trial_pair_name(trial_pair):
+    return 'trial_pair_{}'.format(trial_pair[0])
+
+
+def plot_differences(trial_pair_id, axs):
+    """Plot the saved on-minus-off differences of a trial pair with their bootstrap and null bands."""
+    differences, arrays = paired.load_differences(difference_path(trial_pair_id))
+    t = arrays['t']
+
+    for ax, (cause, effect) in zip(axs, DIFFERENCE_PAIRS):
+        ax.axhline(0, ls='--')
+        if (cause, effect) not in differences:
+            continue
+
+        difference = differences[cause, effect]
+        ax.plot(t, difference.diff, lw=LW, color='k')
+        ax.fill_between(t, difference.lb, difference.ub, color='k', alpha=ALPHA)
+        if difference.null_lb is not None:
+            ax.plot(t, difference.null_lb, color='k', ls=':')
+            ax.plot(t, difference.null_ub, color='k', ls=':')
+
+        ax.set_ylabel('{} x {}'.format(cause, effect).replace('vel_abs', '|vel|'))
+
+    axs[-1].set_xlabel('t (s)')
+    axs[0].set_title('on minus off (jointly normalized)\nTrial pair {}'.format(trial_pair_id))
+
+
+def plot_trial_pair(trial_pair, subplots=plt.subplots, time_series=PLOT_TIME_SERIES, p_values=PLOT_P_VALUES,
+                    auto_correlations=PLOT_AUTO_CORRELATIONS, differences=PLOT_DIFFERENCES):
+    """
+    Plot the saved results of both trials of a trial pair on top of each other.
+
+    :param trial_pair: (trial pair id, solenoid off trial id, solenoid on trial id, odor) tuple
+    :param subplots: function creating figures (plt.subplots or reports.subplots)
+    :param time_series, p_values, auto_correlations, differences: whether to plot these figures
+    :return: list of (name, figure) tuples
+    """
+    trial_pair_id, trial_solenoid_off_id, trial_solenoid_on_id, odor = trial_pair
+
+    # open figures
+    ## cross correlations
+    fig_cc, axs_cc = subplots(6, 1, figsize=FIG_SIZE_CC, sharex=True, tight_layout=True)
+    figs = [('cross_correlations', fig_cc)]
+
+    if time_series:
+        fig_ts, axs_ts = subplots(7, 1, figsize=FIG_SIZE_TIME_SERIES, sharex=True, tight_layout=True)
+        figs += [('time_series', fig_ts)]
+
+    if p_values:
+        fig_pv, axs_pv = subplots(4, 1, sharex=True, tight_layout=True)
+        figs += [('p_values', fig_pv)]
+
+    if auto_correlations:
+        fig_ac, axs_ac = subplots(4, 1, sharex=True, tight_layout=True)
+        figs += [('auto_correlations', fig_ac)]
+
+    if differences:
+        if os.path.exists(difference_path(trial_pair_id)):
+            fig_df, axs_df = subplots(len(DIFFERENCE_PAIRS), 1, figsize=FIG_SIZE_CC, sharex=True, tight_layout=True)
+            plot_differences(trial_pair_id, axs_df)
+            figs += [('differences', fig_df)]
+        else:
+            print('No differences saved for trial pair {}'.format(trial_pair_id))
+
+    # loop over odor off and odor on trial
+    for trial_id, color in zip([trial_solenoid_off_id, trial_solenoid_on_id], COLORS):
+        if not os.path.exists(results_path(trial_id)):
+            print('No results saved for trial {}'.format(trial_id))
+            continue
+
+        results, arrays = xcov.load_results(results_path(trial_id))
+
+        vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = results['vel', 'lmr']
+        vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = results['vel', 'lpr']
+        rand_x_lpr, p_rand_x_lpr, lb_rand_x_lpr, ub_rand_x_lpr = results['rand', 'lpr']
+        vel_x_control, p_vel_x_control, lb_vel_x_control, ub_vel_x_control = results['vel', 'control']
+        vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = results['vel', 'freq']
+        vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = results['vel_abs', 'freq']
+
+        if trial_id == trial_solenoid_on_id:
+            odor_x_freq, p_vel_odor_x_freq, lb_odor_x_freq, ub_odor_x_freq = results['odor', 'freq']
+
+        # auto-correlations for different variables
+        vel_x_vel, p_vel_x_vel, lb_vel_x_vel, ub_vel_x_vel = results['vel', 'vel']
+        rand_x_rand, p_rand_x_rand, lb_rand_x_rand, ub_rand_x_rand = results['rand', 'rand']
+        lmr_x_lmr, p_lmr_x_lmr, lb_lmr_x_lmr, ub_lmr_x_lmr = results['lmr', 'lmr']
+        lpr_x_lpr, p_lpr_x_lpr, lb_lpr_x_lpr, ub_lpr_x_lpr = results['lpr', 'lpr']
+        freq_x_freq, p_freq_x_freq, lb_freq_x_freq, ub_freq_x_freq = results['freq', 'freq']
+
+        t = arrays['t']
+
+        # plot cross-correlations
+        [ax.axhline(0, ls='--') for ax in axs_cc]
+
+        axs_cc[0].plot(t, vel_x_lmr, lw=LW, color=color)
+        axs_cc[0].fill_between(t, lb_vel_x_lmr, ub_vel_x_lmr, color=color, alpha=ALPHA)
+        plot_null_band(axs_cc[0], arrays, 'vel', 'lmr', color)
+
+        axs_cc[1].plot(t, vel_x_lpr, lw=LW, color=color)
+        axs_cc[1].fill_between(t, lb_vel_x_lpr, ub_vel_x_lpr, color=color, alpha=ALPHA)
+        plot_null_band(axs_cc[1], arrays, 'vel', 'lpr', color)
+
+        axs_cc[2].plot(t, rand_x_lpr, lw=LW, color=color)
+        axs_cc[2].fill_between(t, lb_rand_x_lpr, ub_rand_x_lpr, color=color, alpha=ALPHA)
+
+        axs_cc[3].plot(t, vel_x_freq, lw=LW, color=color)
+        axs_cc[3].fill_between(t, lb_vel_x_freq, ub_vel_x_freq, color=color, alpha=ALPHA)
+        plot_null_band(axs_cc[3], arrays, 'vel', 'freq', color)
+
+        axs_cc[4].plot(t, vel_abs_x_freq, lw=LW, color=color)
+        axs_cc[4].fill_between(t, lb_vel_abs_x_freq, ub_vel_abs_x_freq, color=color, alpha=ALPHA)
+        plot_null_band(axs_cc[4], arrays, 'vel_abs', 'freq', color)
+
+        if trial_id == trial_solenoid_on_id:
+            axs_cc[5].plot(t, odor_x_freq, lw=LW, color=color)
+            axs_cc[5].fill_between(t, lb_odor_x_freq, ub_odor_x_freq, color=color, alpha=ALPHA)
+
+        axs_cc[0].set_ylabel('vel x lmr')
+        axs_cc[1].set_ylabel('vel x lpr')
+        axs_cc[2].set_ylabel('rand x lpr')
+        axs_cc[3].set_ylabel('vel x freq')
+        axs_cc[4].set_ylabel('|vel| x freq')
+        axs_cc[5].set_ylabel('odor x freq')
+
+        axs_cc[3].set_xlabel('t (s)')
+
+        axs_cc[0].set_title('cross-correlations\nTrial pair {}, odor = {}'.format(trial_pair_id, odor))
+
+        if time_series:
+            split_idxs = np.cumsum(arrays['segment_lengths'])[:-1]
+            segments = dict([(name, np.split(arrays[name], split_idxs))
+                             for name in ['time', 'lmr', 'lpr', 'freq', 'vel', 'vel_abs', 'pos', 'odor']
+                             if name in arrays])
+            for d_ctr in range(len(arrays['segment_lengths'])):
+                t_segment = segments['time'][d_ctr]
+                axs_ts[0].plot(t_segment, segments['lmr'][d_ctr], lw=LW, color=color)
+                axs_ts[1].plot(t_segment, segments['lpr'][d_ctr], lw=LW, color=color)
+                axs_ts[2].plot(t_segment, segments['freq'][d_ctr], lw=LW, color=color)
+                axs_ts[3].plot(t_segment, segments['vel'][d_ctr], lw=LW, color=color)
+                axs_ts[4].plot(t_segment, segments['vel_abs'][d_ctr], lw=LW, color=color)
+                axs_ts[5].plot(t_segment, segments['pos'][d_ctr], lw=LW, color=color)
+                if trial_id == trial_solenoid_on_id:
+                    axs_ts[6].plot(t_segment, segments['odor'][d_ctr], lw=LW, color=color)
+            axs_ts[0].set_ylabel('lmr')
+            axs_ts[1].set_ylabel('lpr')
+            axs_ts[2].set_ylabel('freq')
+            axs_ts[3].set_ylabel('vel')
+            axs_ts[4].set_ylabel('vel_abs')
+            axs_ts[5].set_ylabel('pos')
+            axs_ts[6].set_ylabel('odor')
+            axs_ts[6].set_xlabel('t (s)')
+            axs_ts[0].set_title('down-sampled time-series')
+            axs_ts[0].set_xlim(arrays['time'][0], arrays['time'][-1])
+
+        # plot p-values
+        if p_values:
+            axs_pv[0].plot(t, p_vel_x_lmr, color=color)
+            #axs[0].plot(t, p_vel_x_control, c='k')
+            axs_pv[1].plot(t, p_vel_x_lpr, color=color)
+            axs_pv[2].plot(t, p_vel_x_freq, color=color)
+            axs_pv[3].plot(t, p_vel_abs_x_freq, color=color)
+
+            [ax.set_ylim(0, 0.1) for ax in axs_pv]
+
+            axs_pv[0].set_ylabel('vel x lmr')
+            axs_pv[1].set_ylabel('vel x lpr')
+            axs_pv[2].set_ylabel('vel x freq')
+            axs_pv[3].set_ylabel('|vel| x freq')
+
+            axs_pv[3].set_xlabel('t (s)')
+
+            axs_pv[0].set_title('p-values')
+
+        # plot auto-correlations
+        if auto_correlations:
+            axs_ac[0].plot(t, vel_x_vel, color=color)
+            axs_ac[1].plot(t, lmr_x_lmr, color=color)
+            axs_ac[2].plot(t, lpr_x_lpr, color=color)
+            axs_ac[3].plot(t, freq_x_freq, color=color)
+
+            axs_ac[0].set_ylabel('vel')
+            axs_ac[1].set_ylabel('lmr')
+            axs_ac[2].set_ylabel('lpr')
+            axs_ac[3].set_ylabel('freq')
+
+            axs_ac[3].set_xlabel('t (s)')
+
+            axs_ac[0].set_title('auto-correlations')
+
+    return figs
+
+
 def main():
     # get trial pairs
-    trial_pairs = session.query(models.TrialPair)
-    for trial_pair in trial_pairs:
+    trial_pairs = []
+    for trial_pair in queries.trial_pairs_query(session):
         # get trials and attach them to the correct labels according to their solenoid state
         if trial_pair.trials[0].odor_status.solenoid_active:
             trial_solenoid_on = trial_pair.trials[0]
@@ -58,179 +371,29 @@ def main():
             trial_solenoid_on = trial_pair.trials[1]
             trial_solenoid_off = trial_pair.trials[0]
 
-        print('Trial pair {}, odor = {}'.format(trial_pair.id, trial_solenoid_on.odor_status.odor))
-
-        # open figures
-        ## cross correlations
-        fig_cc, axs_cc = plt.subplots(6, 1, figsize=FIG_SIZE_CC, sharex=True, tight_layout=True)
-
-        if PLOT_TIME_SERIES:
-            fig_ts, axs_ts = plt.subplots(7, 1, figsize=FIG_SIZE_TIME_SERIES, sharex=True, tight_layout=True)
-
-        if PLOT_P_VALUES:
-            fig_pv, axs_pv = plt.subplots(4, 1, sharex=True, tight_layout=True)
-
-        if PLOT_AUTO_CORRELATIONS:
-            fig_ac, axs_ac = plt.subplots(4, 1, sharex=True, tight_layout=True)
-
-        # loop over odor off and odor on trial
-        for trial, color in zip([trial_solenoid_off, trial_solenoid_on], COLORS):
-            data, _, cols, _ = edr_handling.load_from_trial(trial, dt=DT, unwrap_barpos=True, lmr_zscore=False)
-
-            pos = [data_segment[:, cols.index('Barpos')] for data_segment in data]
-            vel = [np.gradient(pos_segment) / DT for pos_segment in pos]
-            vel_abs = [np.abs(vel_segment) for vel_segment in vel]
-            lmr = [data_segment[:, cols.index('LmR')] for data_segment in data]
-            lpr = [data_segment[:, cols.index('Lamp')] + data_segment[:, cols.index('Ramp')]
-                   for data_segment in data]
-            freq = [data_segment[:, cols.index('Freq')] for data_segment in data]
-            stim_rand = [np.random.normal(0, STIM_RANDOM_NOISE, len(v)) for v in vel]
-
-            if trial == trial_solenoid_on:
-                odor_stim = [data_segment[:, cols.index('S1')] for data_segment in data]
-
-            # build a control response to make sure we'd be able to accurately recover the filter if there was one
-            control = [sp_signal.fftconvolve(v, CONTROL_FILTER, 'full') for v in vel]
-            control = [c + np.random.normal(0, CONTROL_NOISE, c.shape) for c in control]
-            control = [c[:-N_TIMESTEPS_FILTER + 1] for c in control]
-
-            # calculate various cross-correlations (first variable is always "cause", second, "effect")
-            n_lags_back = int(round(LAG_BACK / DT))
-            n_lags_forward = int(round(LAG_FORWARD / DT))
-
-            vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = \
-                signal.xcov_simple_two_sided_multi(vel, lmr, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True,
-                                                   confidence=.95)
-            vel_x_lpr, p_vel_x_lpr, lb_vel_x_lpr, ub_vel_x_lpr = \
-                signal.xcov_simple_two_sided_multi(vel, lpr, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            rand_x_lpr, p_rand_x_lpr, lb_rand_x_lpr, ub_rand_x_lpr = \
-                signal.xcov_simple_two_sided_multi(stim_rand, lpr, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            vel_x_control, p_vel_x_control, lb_vel_x_control, ub_vel_x_control = \
-                signal.xcov_simple_two_sided_multi(vel, control, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            vel_x_freq, p_vel_x_freq, lb_vel_x_freq, ub_vel_x_freq = \
-                signal.xcov_simple_two_sided_multi(vel, freq, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            vel_abs_x_freq, p_vel_abs_x_freq, lb_vel_abs_x_freq, ub_vel_abs_x_freq = \
-                signal.xcov_simple_two_sided_multi(vel_abs, freq, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-
-            if trial == trial_solenoid_on:
-                odor_x_freq, p_vel_odor_x_freq, lb_odor_x_freq, ub_odor_x_freq = \
-                signal.xcov_simple_two_sided_multi(odor_stim, freq, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-
-            # calculate auto-correlations for different variables
-            vel_x_vel, p_vel_x_vel, lb_vel_x_vel, ub_vel_x_vel = \
-                signal.xcov_simple_two_sided_multi(vel, vel, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            rand_x_rand, p_rand_x_rand, lb_rand_x_rand, ub_rand_x_rand = \
-                signal.xcov_simple_two_sided_multi(stim_rand, stim_rand, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            lmr_x_lmr, p_lmr_x_lmr, lb_lmr_x_lmr, ub_lmr_x_lmr = \
-                signal.xcov_simple_two_sided_multi(lmr, lmr, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            lpr_x_lpr, p_lpr_x_lpr, lb_lpr_x_lpr, ub_lpr_x_lpr = \
-                signal.xcov_simple_two_sided_multi(lmr, lmr, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-            freq_x_freq, p_freq_x_freq, lb_freq_x_freq, ub_freq_x_freq = \
-                signal.xcov_simple_two_sided_multi(freq, freq, n_lags_back=n_lags_back,
-                                                   n_lags_forward=n_lags_forward, normed=True)
-
-            t = np.arange(-n_lags_back, n_lags_forward) * DT
-
-            # plot cross-correlations
-            [ax.axhline(0, ls='--') for ax in axs_cc]
-
-            axs_cc[0].plot(t, vel_x_lmr, lw=LW, color=color)
-            axs_cc[0].fill_between(t, lb_vel_x_lmr, ub_vel_x_lmr, color=color, alpha=ALPHA)
-
-            axs_cc[1].plot(t, vel_x_lpr, lw=LW, color=color)
-            axs_cc[1].fill_between(t, lb_vel_x_lpr, ub_vel_x_lpr, color=color, alpha=ALPHA)
-
-            axs_cc[2].plot(t, rand_x_lpr, lw=LW, color=color)
-            axs_cc[2].fill_between(t, lb_rand_x_lpr, ub_rand_x_lpr, color=color, alpha=ALPHA)
-
-            axs_cc[3].plot(t, vel_x_freq, lw=LW, color=color)
-            axs_cc[3].fill_between(t, lb_vel_x_freq, ub_vel_x_freq, color=color, alpha=ALPHA)
-
-            axs_cc[4].plot(t, vel_abs_x_freq, lw=LW, color=color)
-            axs_cc[4].fill_between(t, lb_vel_abs_x_freq, ub_vel_abs_x_freq, color=color, alpha=ALPHA)
-
-            if trial == trial_solenoid_on:
-                axs_cc[5].plot(t, odor_x_freq, lw=LW, color=color)
-                axs_cc[5].fill_between(t, lb_odor_x_freq, ub_odor_x_freq, color=color, alpha=ALPHA)
-
-            axs_cc[0].set_ylabel('vel x lmr')
-            axs_cc[1].set_ylabel('vel x lpr')
-            axs_cc[2].set_ylabel('rand x lpr')
-            axs_cc[3].set_ylabel('vel x freq')
-            axs_cc[4].set_ylabel('|vel| x freq')
-            axs_cc[5].set_ylabel('odor x freq')
-
-            axs_cc[3].set_xlabel('t (s)')
-
-            axs_cc[0].set_title('cross-correlations\nTrial pair {}, odor = {}'.format(trial_pair.id, trial_solenoid_on.odor_status.odor))
-
-            if PLOT_TIME_SERIES:
-                for d_ctr, data_segment in enumerate(data):
-                    t = data_segment[:, 0]
-                    axs_ts[0].plot(t, lmr[d_ctr], lw=LW, color=color)
-                    axs_ts[1].plot(t, lpr[d_ctr], lw=LW, color=color)
-                    axs_ts[2].plot(t, freq[d_ctr], lw=LW, color=color)
-                    axs_ts[3].plot(t, vel[d_ctr], lw=LW, color=color)
-                    axs_ts[4].plot(t, vel_abs[d_ctr], lw=LW, color=color)
-                    axs_ts[5].plot(t, pos[d_ctr], lw=LW, color=color)
-                    if trial == trial_solenoid_on:
-                        axs_ts[6].plot(t, odor_stim[d_ctr], lw=LW, color=color)
-                axs_ts[0].set_ylabel('lmr')
-                axs_ts[1].set_ylabel('lpr')
-                axs_ts[2].set_ylabel('freq')
-                axs_ts[3].set_ylabel('vel')
-                axs_ts[4].set_ylabel('vel_abs')
-                axs_ts[5].set_ylabel('pos')
-                axs_ts[6].set_ylabel('odor')
-                axs_ts[6].set_xlabel('t (s)')
-                axs_ts[0].set_title('down-sampled time-series')
-                axs_ts[0].set_xlim(data[0][0, 0], data[-1][-1, 0])
-
-            # plot p-values
-            if PLOT_P_VALUES:
-                axs_ts[0].plot(t, p_vel_x_lmr, color=color)
-                #axs[0].plot(t, p_vel_x_control, c='k')
-                axs_ts[1].plot(t, p_vel_x_lpr, color=color)
-                axs_ts[2].plot(t, p_vel_x_freq, color=color)
-                axs_ts[3].plot(t, p_vel_abs_x_freq, color=color)
-
-                [ax.set_ylim(0, 0.1) for ax in axs_ts]
-
-                axs_ts[0].set_ylabel('vel x lmr')
-                axs_ts[1].set_ylabel('vel x lpr')
-                axs_ts[2].set_ylabel('vel x freq')
-                axs_ts[3].set_ylabel('|vel| x freq')
-
-                axs_ts[3].set_xlabel('t (s)')
-
-                axs_ts[0].set_title('p-values')
-
-            # plot auto-correlations
-            if PLOT_AUTO_CORRELATIONS:
-                axs_ac[0].plot(t, vel_x_vel, color=color)
-                axs_ac[1].plot(t, lmr_x_lmr, color=color)
-                axs_ac[2].plot(t, lpr_x_lpr, color=color)
-                axs_ac[3].plot(t, freq_x_freq, color=color)
-
-                axs_ac[0].set_ylabel('vel')
-                axs_ac[1].set_ylabel('lmr')
-                axs_ac[2].set_ylabel('lpr')
-                axs_ac[3].set_ylabel('freq')
-
-                axs_ac[3].set_xlabel('t (s)')
-
-                axs_ac[0].set_title('auto-correlations')
+        trial_pairs += [(trial_pair.id, trial_solenoid_off.id, trial_solenoid_on.id,
+                         trial_solenoid_on.odor_status.odor)]
+
+    if COMPUTE:
+        trial_ids = [trial_id for trial_pair in trial_pairs for trial_id in trial_pair[1:3]]
+        batch.map_in_pool(compute_trial, trial_ids)
+        compute_differences([trial_pair[0] for trial_pair in trial_pairs])
+
+    if REPORT:
+        # render all figures of all trial pairs without opening any windows
+        plot_function = functools.partial(plot_trial_pair, time_series=True, p_values=True,
+                                          auto_correlations=True, differences=True)
+        figure_directory = batch.results_path(RESULTS_SUBDIRECTORY, 'figures')
+        pdf_path, _ = reports.render_report(plot_function, trial_pairs, figure_directory,
+                                            report_name='cross_correlations', item_name=trial_pair_name)
+        print('Report saved to {}'.format(pdf_path))
+        return
+
+    for trial_pair in trial_pairs:
+
+        print('Trial pair {}, odor = {}'.format(trial_pair[0], trial_pair[3]))
+
+        plot_trial_pair(trial_pair)
 
         plt.show(block=True)
 
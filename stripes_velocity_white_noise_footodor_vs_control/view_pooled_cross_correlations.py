@@ -0,0 +1,76 @@
+"""
+Plot the cross-correlations of all trials of the experiment pooled by odor and solenoid state:
+
+velocity vs. left-minus-right
+velocity vs. left-plus-right
+velocity vs. frequency
+absolute velocity vs. frequency
+odor vs. frequency (solenoid active only)
+
+Trials are processed in parallel by a pool of worker processes (see pooled_xcov) and the
+pooled results are printed as one table before being plotted.
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from db_api import models
+from db_api.connect import session
+
+import pooled_xcov
+
+EXPERIMENT_ID = 'stripes_velocity_white_noise_footodor_vs_control'
+
+GROUP_BY = ('odor', 'solenoid_active')
+
+LAG_FORWARD = 5  # in seconds
+LAG_BACK = 0.5  # in seconds
+DT = .04  # in seconds
+
+XCOV_PAIRS = [('vel', 'lmr'), ('vel', 'lpr'), ('vel', 'freq'), ('vel_abs', 'freq'), ('odor', 'freq')]
+
+FIG_SIZE = (12, 12)
+LW = 2
+ALPHA = 0.3
+
+
+def main():
+    trial_ids = [trial.id for trial in session.query(models.Trial).filter_by(experiment_id=EXPERIMENT_ID)]
+
+    n_lags_back = int(round(LAG_BACK / DT))
+    n_lags_forward = int(round(LAG_FORWARD / DT))
+    t = np.arange(-n_lags_back, n_lags_forward) * DT
+
+    table, errors = pooled_xcov.pooled_xcov(trial_ids, XCOV_PAIRS, n_lags_back, n_lags_forward, dt=DT,
+                                            group_by=GROUP_BY)
+
+    print('{} trials pooled ({} failed)'.format(len(trial_ids) - len(errors), len(errors)))
+    print('{:>10} {:>10} {:>16} {:>8} {:>10} {:>10} {:>10}'.format(
+        'odor', 'solenoid', 'pair', 'trials', 'samples', 'max |xcov|', 'min p'))
+    for row in table:
+        print('{:>10} {:>10} {:>16} {:>8} {:>10} {:>10.3f} {:>10.2g}'.format(
+            str(row.odor), str(row.solenoid_active), '{} x {}'.format(row.cause, row.effect), row.n_trials,
+            int(row.n_samples), np.nanmax(np.abs(row.xcov)), np.nanmin(row.p)))
+
+    fig, axs = plt.subplots(len(XCOV_PAIRS), 1, facecolor='white', figsize=FIG_SIZE, tight_layout=True)
+
+    for ax, (cause, effect) in zip(axs, XCOV_PAIRS):
+        for row in table:
+            if (row.cause, row.effect) != (cause, effect):
+                continue
+
+            label = '{}, solenoid {}'.format(row.odor, 'on' if row.solenoid_active else 'off')
+            line, = ax.plot(t, row.xcov, lw=LW, label='{} ({} trials)'.format(label, row.n_trials))
+            ax.fill_between(t, row.lb, row.ub, color=line.get_color(), alpha=ALPHA)
+
+        ax.set_ylabel('{} x {}'.format(cause, effect))
+        ax.legend(loc='best')
+
+    axs[-1].set_xlabel('lag (s)')
+
+    plt.show(block=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Null distributions of cross-covariances from surrogate cause signals.
+
+A surrogate keeps some properties of a cause signal but destroys its timing
+relative to the effect:
+
+    phase: random Fourier phases, which keeps the power spectrum (and hence the
+           auto-covariance) of each segment
+    shift: circular shift of each segment by a random offset, which keeps the
+           signal itself
+
+Many surrogates of a segment are generated and transformed as one 2D array, and
+their cross-covariances with the effect are computed with a single batched
+inverse FFT, using the same pooled statistics as xcov.xcov_multi. The spread of
+the surrogate cross-covariances at each lag gives an empirical null band.
+"""
+from __future__ import print_function, division
+
+from collections import namedtuple
+import numpy as np
+from scipy import fftpack
+
+import xcov
+
+SURROGATE_METHODS = ('phase', 'shift')
+SURROGATE_BATCH_SIZE = 50  # number of surrogates transformed at once (limits memory use)
+
+NullBands = namedtuple('NullBands', ['lb', 'ub', 'xcovs'])
+
+
+def make_surrogates(x, n_surrogates, method='phase', random_state=np.random):
+    """
+    Make surrogates of a 1D signal.
+
+    :param x: 1D array
+    :param n_surrogates: number of surrogates
+    :param method: 'phase' (phase randomization) or 'shift' (random circular shift)
+    :param random_state: numpy RandomState
+    :return: array of shape (n_surrogates, len(x))
+    """
+    x = np.asarray(x, dtype=float)
+
+    if method == 'phase':
+        spectrum = np.fft.rfft(x)
+
+        phases = random_state.uniform(0, 2 * np.pi, (n_surrogates, len(spectrum)))
+        # keep the mean, and the Nyquist component real
+        phases[:, 0] = 0
+        if len(x) % 2 == 0:
+            phases[:, -1] = 0
+
+        return np.fft.irfft(spectrum * np.exp(1j * phases), n=len(x), axis=1)
+
+    elif method == 'shift':
+        shifts = random_state.randint(0, max(len(x), 1), n_surrogates)
+        return x[(np.arange(len(x)) + shifts[:, None]) % max(len(x), 1)]
+
+    else:
+        raise ValueError('Surrogate method must be one of {}!'.format(SURROGATE_METHODS))
+
+
+def surrogate_xcov_stats(cause, effect, n_lags_back, n_lags_forward, n_surrogates=200, method='phase',
+                         random_state=np.random):
+    """
+    Compute the cross-covariance statistics between surrogates of a segmented cause and an effect.
+
+    :param cause: list of 1D cause segments
+    :param effect: list of 1D effect segments of the same lengths
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param n_surrogates: number of surrogates of each cause segment
+    :param method: 'phase' or 'shift' (see make_surrogates)
+    :param random_state: numpy RandomState
+    :return: XcovStats whose sums have shape (n_surrogates, number of lags)
+    """
+    if [len(segment) for segment in cause] != [len(segment) for segment in effect]:
+        raise ValueError('Cause and effect must be split into the same segments!')
+
+    lags = np.arange(-n_lags_back, n_lags_forward)
+
+    # both surrogate methods keep the mean of each segment, so the same offsets suit all surrogates
+    if sum([len(segment) for segment in cause]):
+        x0 = float(np.mean(np.concatenate(cause)))
+        y0 = float(np.mean(np.concatenate(effect)))
+    else:
+        x0, y0 = 0., 0.
+
+    stats = xcov.XcovStats.empty(lags, x0, y0)
+
+    for x, y in zip(cause, effect):
+        segment_length = len(x)
+        if segment_length == 0:
+            continue
+
+        n_fft = fftpack.next_fast_len(segment_length + max(n_lags_back, n_lags_forward))
+
+        x_start, x_end, y_start, y_end = xcov.lag_window(lags, segment_length)
+        n = x_end - x_start
+
+        y = np.asarray(y, dtype=float) - y0
+        y_spectrum = np.fft.rfft(y, n=n_fft)
+        y_cumsum = np.concatenate([[0], np.cumsum(y)])
+        y_cumsum_sq = np.concatenate([[0], np.cumsum(y ** 2)])
+
+        sx, sxx, sxy = [], [], []
+
+        for start in range(0, n_surrogates, SURROGATE_BATCH_SIZE):
+            xs = make_surrogates(x, min(SURROGATE_BATCH_SIZE, n_surrogates - start), method, random_state) - x0
+
+            xs_spectra = np.fft.rfft(xs, n=n_fft, axis=1)
+            xs_cumsum = np.concatenate([np.zeros((len(xs), 1)), np.cumsum(xs, axis=1)], axis=1)
+            xs_cumsum_sq = np.concatenate([np.zeros((len(xs), 1)), np.cumsum(xs ** 2, axis=1)], axis=1)
+
+            sx += [xs_cumsum[:, x_end] - xs_cumsum[:, x_start]]
+            sxx += [xs_cumsum_sq[:, x_end] - xs_cumsum_sq[:, x_start]]
+            sxy += [np.fft.irfft(xs_spectra.conj() * y_spectrum, n=n_fft, axis=1)[:, lags % n_fft]]
+
+        stats.n = stats.n + n
+        stats.sx = stats.sx + np.concatenate(sx)
+        stats.sy = stats.sy + y_cumsum[y_end] - y_cumsum[y_start]
+        stats.sxx = stats.sxx + np.concatenate(sxx)
+        stats.syy = stats.syy + y_cumsum_sq[y_end] - y_cumsum_sq[y_start]
+        stats.sxy = stats.sxy + np.where(n > 0, np.concatenate(sxy), 0)
+
+    return stats
+
+
+def null_bands(cause, effect, n_lags_back, n_lags_forward, n_surrogates=200, method='phase', confidence=.95,
+               normed=True, random_state=np.random):
+    """
+    Compute empirical null bands of the cross-covariance between a segmented cause and effect.
+
+    :param cause: list of 1D cause segments
+    :param effect: list of 1D effect segments of the same lengths
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param n_surrogates: number of surrogates
+    :param method: 'phase' or 'shift' (see make_surrogates)
+    :param confidence: fraction of surrogate cross-covariances within the bands at each lag
+    :param normed: if True, use correlations, otherwise covariances
+    :param random_state: numpy RandomState
+    :return: NullBands of lower and upper bands over lags and all surrogate cross-covariances
+             (n_surrogates x number of lags)
+    """
+    stats = surrogate_xcov_stats(cause, effect, n_lags_back, n_lags_forward, n_surrogates=n_surrogates,
+                                 method=method, random_state=random_state)
+
+    xcovs = stats.result(normed=normed).xcov
+
+    lb = np.percentile(xcovs, 100 * (1 - confidence) / 2, axis=0)
+    ub = np.percentile(xcovs, 100 * (1 + confidence) / 2, axis=0)
+
+    return NullBands(lb, ub, xcovs)
+
+
+def empirical_p(xcov_, null_xcovs):
+    """
+    Two-sided empirical p-values of cross-covariances given surrogate cross-covariances.
+
+    :param xcov_: array of cross-covariances over lags
+    :param null_xcovs: array of surrogate cross-covariances (n_surrogates x number of lags)
+    :return: array of p-values over lags
+    """
+    n_extreme = np.sum(np.abs(null_xcovs) >= np.abs(xcov_), axis=0)
+    return (n_extreme + 1) / (len(null_xcovs) + 1)
@@ -0,0 +1,46 @@
+from __future__ import print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch
+
+
+def square_or_fail(x):
+    if x < 0:
+        raise ValueError('Negative number!')
+    return x ** 2
+
+
+class MapInPoolTestCase(unittest.TestCase):
+
+    def test_results_and_errors_are_collected_by_item(self):
+        results, errors = batch.map_in_pool(square_or_fail, [1, 2, -1, 3], n_processes=2,
+                                           use_database=False)
+
+        self.assertEqual(results, {1: 1, 2: 4, 3: 9})
+        self.assertEqual(list(errors.keys()), [-1])
+        self.assertIn('Negative number!', errors[-1])
+
+
+class ResultsPathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.results_directory = batch.RESULTS_DIRECTORY
+        batch.RESULTS_DIRECTORY = self.directory
+
+    def tearDown(self):
+        batch.RESULTS_DIRECTORY = self.results_directory
+        shutil.rmtree(self.directory)
+
+    def test_directories_are_created(self):
+        path = batch.results_path('experiment', 'trial_1.npz')
+
+        self.assertEqual(path, os.path.join(self.directory, 'experiment', 'trial_1.npz'))
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+
+import benchmark_xcov
+
+CONFIGS = [
+    dict(n_segments=1, segment_length=20000, n_lags_back=12, n_lags_forward=125, noise=.01),
+    dict(n_segments=40, segment_length=300, n_lags_back=12, n_lags_forward=125, noise=.1),
+    dict(n_segments=3, segment_length=10000, n_lags_back=50, n_lags_forward=500, noise=1.),
+]
+
+
+class FilterRecoveryTestCase(unittest.TestCase):
+
+    def test_every_engine_recovers_control_filter(self):
+        rows = benchmark_xcov.run_benchmark(CONFIGS, n_repeats=1, random_state=np.random.RandomState(0))
+
+        self.assertEqual(len(rows), len(CONFIGS) * len(benchmark_xcov.available_engines()))
+
+        for row in rows:
+            self.assertLess(row.error, benchmark_xcov.MAX_STANDARD_ERRORS * row.standard_error,
+                            'engine {} failed to recover filter for {}'.format(row.engine, row))
+
+    def test_engines_agree(self):
+        filter_ = benchmark_xcov.control_filter(60)
+        xs, ys = benchmark_xcov.synthetic_pair(7, 400, filter_, .1, np.random.RandomState(1))
+
+        engines = benchmark_xcov.available_engines()
+        results = dict([(name, engine(xs, ys, 6, 60)) for name, engine in engines.items()])
+
+        for name in engines:
+            np.testing.assert_array_almost_equal(results[name].xcov, results['xcov_multi'].xcov)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+from scipy import stats
+
+import calibration
+import xcov
+
+
+class CalibrationTestCase(unittest.TestCase):
+
+    def test_batch_pearsonr_matches_scipy(self):
+        x = np.random.normal(0, 1, (20, 30))
+        y = x + np.random.normal(0, 3, (20, 30))
+
+        result = calibration.pearsonr_batch(x, y)
+
+        for x_, y_, r, p in zip(x, y, result.xcov, result.p):
+            r_expected, p_expected = stats.pearsonr(x_, y_)
+            self.assertAlmostEqual(r, r_expected)
+            self.assertAlmostEqual(p, p_expected)
+
+    def test_replicate_statistics_match_xcov_of_each_replicate(self):
+        x = calibration.smoothed_noise(5, 200, 4, np.random.RandomState(0))
+        y = calibration.smoothed_noise(5, 200, 1, np.random.RandomState(1)) + 50
+
+        xcovs = calibration.replicate_xcov_stats(x, y, 7, 12).result().xcov
+
+        for x_, y_, xcov_ in zip(x, y, xcovs):
+            expected = xcov.xcov_multi({'x': [x_], 'y': [y_]}, [('x', 'y')], 7, 12)['x', 'y'].xcov
+            np.testing.assert_array_almost_equal(xcov_, expected)
+
+    def test_white_noise_is_calibrated_and_smoothed_noise_is_not(self):
+        random_state = np.random.RandomState(2)
+
+        white = calibration.calibrate_xcov(2000, 300, 2, 3, random_state=random_state)
+        smooth = calibration.calibrate_xcov(2000, 300, 2, 3, smoothing_x=20, smoothing_y=20,
+                                            random_state=random_state)
+
+        self.assertTrue(np.all(np.abs(white.false_positive_rate - .05) < .025))
+        self.assertTrue(np.all(np.abs(white.coverage - .95) < .025))
+        self.assertTrue(np.all(smooth.false_positive_rate > .2))
+
+
+if __name__ == '__main__':
+    unittest.main()
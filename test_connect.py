@@ -0,0 +1,136 @@
+from __future__ import print_function, division
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from db_api import connect
+
+
+def get_engine_url(_):
+    try:
+        return str(connect.get_engine().url)
+    except RuntimeError as e:
+        return str(e)
+
+
+class ConnectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.database = connect.DATABASE
+
+        connect.release()
+        connect._engine = None
+        connect._engine_pid = None
+        connect._production_confirmed = False
+
+        os.environ['TEST_TETHER_DB_CXN_URL'] = 'sqlite:///' + os.path.join(self.directory, 'test.db')
+        connect.DATABASE = 'test'
+
+    def tearDown(self):
+        connect.release()
+        connect._engine = None
+        connect._engine_pid = None
+        connect._production_confirmed = False
+        connect.__dict__.pop('raw_input', None)
+
+        connect.DATABASE = self.database
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def test_engine_is_only_created_when_a_session_is_used(self):
+        self.assertIsNone(connect._engine)
+
+        session = connect.Session()
+        self.assertEqual(session.execute(text('SELECT 1')).scalar(), 1)
+        session.close()
+
+        self.assertIsNotNone(connect._engine)
+        self.assertEqual(connect._engine_pid, os.getpid())
+
+    def test_scoped_session_uses_url_from_environment(self):
+        self.assertEqual(connect.session.execute(text('SELECT 1')).scalar(), 1)
+        self.assertEqual(str(connect.get_engine().url), os.environ['TEST_TETHER_DB_CXN_URL'])
+
+    def test_engine_is_recreated_in_a_new_process(self):
+        engine = connect.get_engine()
+        self.assertIs(connect.get_engine(), engine)
+
+        # pretend the engine was created by a parent process
+        connect._engine_pid = -1
+        self.assertIsNot(connect.get_engine(), engine)
+        self.assertEqual(connect._engine_pid, os.getpid())
+
+    def test_unknown_database_is_an_error(self):
+        connect.DATABASE = 'staging'
+
+        with self.assertRaises(ValueError):
+            connect.get_engine()
+
+    def use_production(self, answers):
+        """Point the production database at a second SQLite file and answer its confirmation prompts."""
+        os.environ['TETHER_DB_CXN_URL'] = 'sqlite:///' + os.path.join(self.directory, 'production.db')
+        os.environ.pop('TETHER_DB_CONFIRM_PRODUCTION', None)
+        connect.DATABASE = 'production'
+
+        prompts = []
+
+        def answer(prompt):
+            prompts.append(prompt)
+            return answers.pop(0)
+
+        connect.raw_input = answer
+        return prompts
+
+    def test_production_is_confirmed_once(self):
+        prompts = self.use_production(['y'])
+
+        self.assertEqual(str(connect.get_engine().url), os.environ['TETHER_DB_CXN_URL'])
+
+        connect._engine_pid = -1
+        connect.get_engine()
+        self.assertEqual(len(prompts), 1)
+
+    def test_production_is_refused_without_confirmation(self):
+        self.use_production(['n'])
+
+        with self.assertRaises(RuntimeError):
+            connect.get_engine()
+        self.assertIsNone(connect._engine)
+
+    def test_production_can_be_confirmed_through_environment(self):
+        prompts = self.use_production([])
+        os.environ['TETHER_DB_CONFIRM_PRODUCTION'] = 'yes'
+
+        self.assertEqual(str(connect.get_engine().url), os.environ['TETHER_DB_CXN_URL'])
+        self.assertEqual(prompts, [])
+
+    def test_workers_only_use_production_once_confirmed(self):
+        self.use_production(['y'])
+
+        pool = multiprocessing.Pool(1)
+        try:
+            self.assertIn('TETHER_DB_CONFIRM_PRODUCTION', pool.map(get_engine_url, [0])[0])
+        finally:
+            pool.close()
+            pool.join()
+
+        # confirming in the parent carries over to workers forked afterwards
+        connect.confirm_production()
+
+        pool = multiprocessing.Pool(1)
+        try:
+            self.assertEqual(pool.map(get_engine_url, [0])[0], os.environ['TETHER_DB_CXN_URL'])
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
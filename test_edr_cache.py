@@ -0,0 +1,104 @@
+from __future__ import print_function, division
+import unittest
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import numpy as np
+
+import edr_cache
+
+
+class EdrCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = edr_cache.EdrCache(os.path.join(self.directory, 'cache'), max_bytes=10 ** 6)
+
+        self.file_name = os.path.join(self.directory, 'test.EDR')
+        with open(self.file_name, 'wb') as f:
+            f.write(b'0' * 100)
+
+        self.data = np.random.normal(0, 1, (1000, 4))
+        self.file_start = datetime.datetime(2015, 6, 12, 11, 36, 59)
+        self.cols = ['time', 'Freq', 'LmR', 'Barpos']
+        self.header = {'DT': .0002, 'NC': 3, 'CTIME': '06-12-2015 11:36:59 AM'}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_are_stored_and_retrieved(self):
+        key = self.cache.key(self.file_name, dt=.01)
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, self.data, self.file_start, self.cols, self.header, file_name=self.file_name)
+        data, file_start, cols, header = self.cache.get(key)
+
+        np.testing.assert_array_equal(data, self.data)
+        self.assertEqual(file_start, self.file_start)
+        self.assertEqual(cols, self.cols)
+        self.assertEqual(header, self.header)
+
+    def test_segments_are_stored_and_retrieved(self):
+        key = self.cache.key(self.file_name, dt=.01, ignored_segments=[[1, 2]])
+        segments = [self.data[:300], self.data[300:310], self.data[500:]]
+
+        self.cache.put(key, segments, self.file_start, self.cols, self.header, file_name=self.file_name)
+        cached_segments, _, _, _ = self.cache.get(key)
+
+        self.assertEqual(len(cached_segments), len(segments))
+        for cached_segment, segment in zip(cached_segments, segments):
+            np.testing.assert_array_equal(cached_segment, segment)
+
+    def test_key_depends_on_parameters_and_file_state(self):
+        key = self.cache.key(self.file_name, dt=.01)
+
+        self.assertEqual(key, self.cache.key(self.file_name, dt=.01))
+        self.assertNotEqual(key, self.cache.key(self.file_name, dt=.02))
+
+        with open(self.file_name, 'ab') as f:
+            f.write(b'0')
+
+        self.assertNotEqual(key, self.cache.key(self.file_name, dt=.01))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [self.cache.key(self.file_name, dt=dt) for dt in [.01, .02, .03]]
+
+        for key, age in zip(keys[:2], [200, 100]):
+            self.cache.put(key, self.data, self.file_start, self.cols, self.header)
+            last_used = time.time() - age
+            os.utime(self.cache._paths(key)[0], (last_used, last_used))
+
+        # use first entry so that second one becomes the least recently used
+        self.cache.get(keys[0])
+
+        self.cache.max_bytes = 2.5 * self.data.nbytes
+        self.cache.put(keys[2], self.data, self.file_start, self.cols, self.header)
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+
+    def test_invalidation(self):
+        other_file_name = os.path.join(self.directory, 'other.EDR')
+        with open(other_file_name, 'wb') as f:
+            f.write(b'1' * 100)
+
+        key = self.cache.key(self.file_name, dt=.01)
+        other_key = self.cache.key(other_file_name, dt=.01)
+
+        self.cache.put(key, self.data, self.file_start, self.cols, self.header, file_name=self.file_name)
+        self.cache.put(other_key, self.data, self.file_start, self.cols, self.header, file_name=other_file_name)
+
+        self.cache.invalidate(self.file_name)
+        self.assertIsNone(self.cache.get(key))
+        self.assertIsNotNone(self.cache.get(other_key))
+
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get(other_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 from __future__ import print_function, division
+import os
 import unittest
+import numpy as np
 
 from db_api import models
 from db_api.connect import session
@@ -38,6 +40,117 @@ class EdrFileTestCase(unittest.TestCase):
         self.assertAlmostEqual(self.downsampled_data[1, 0] - self.downsampled_data[0, 0], .01, delta=.00001)
         self.assertEqual(self.header['n_timepoints'], self.downsampled_header['n_timepoints'])
 
+    def test_selected_columns_match_full_load(self):
+        cols = ('Freq', 'LmR', 'Barpos')
+        data, _, cols_selected, _ = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0.01, cols=cols)
+        _, _, cols_all, _ = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0.01)
+
+        self.assertEqual(cols_selected, ['time'] + list(cols))
+        for col in cols_selected:
+            np.testing.assert_array_almost_equal(data[:, cols_selected.index(col)],
+                                                 self.downsampled_data[:, cols_all.index(col)])
+
+    def test_float32_loading(self):
+        cols = ('Freq', 'LmR', 'Barpos', 'Barvel')
+        data, _, _, _ = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0.01, cols=cols)
+        data_32, _, _, _ = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0.01, cols=cols, dtype=np.float32)
+
+        self.assertEqual(data_32.dtype, np.float32)
+        np.testing.assert_allclose(data_32, data, rtol=1e-4, atol=1e-4)
+
+
+class DecimationTestCase(unittest.TestCase):
+
+    def test_low_frequencies_kept_and_aliasing_frequencies_removed(self):
+        source_dt = .0002
+        t = np.arange(100000) * source_dt
+
+        for dt in [.005, .01, .04, .0035]:
+            plan = edr_handling.decimation_plan(source_dt, dt)
+            dt_eff = source_dt * plan.down / plan.up
+            t_decimated = np.arange(-(-len(t) * plan.up // plan.down)) * dt_eff
+
+            # a slow sinusoid should survive decimation unchanged
+            f_low = .2 / (2 * dt_eff)
+            x = (1000 * np.sin(2 * np.pi * f_low * t)).astype(np.int16)
+            y = edr_handling.decimate(x, source_dt, dt)
+
+            self.assertEqual(len(y), len(t_decimated))
+            np.testing.assert_allclose(y[50:-50], 1000 * np.sin(2 * np.pi * f_low * t_decimated)[50:-50],
+                                       atol=2)
+
+            # a sinusoid above the new nyquist frequency should be filtered out instead of aliased
+            f_high = 1.3 / (2 * dt_eff)
+            x = (1000 * np.sin(2 * np.pi * f_high * t)).astype(np.int16)
+            y = edr_handling.decimate(x, source_dt, dt)
+
+            self.assertLess(np.abs(y[50:-50]).max(), 2)
+
+
+class BarposKinematicsTestCase(unittest.TestCase):
+
+    def test_wrapped_bar_position_is_unwrapped_and_differentiated(self):
+        dt = .001
+        scale = 10 / 65536  # volts per int16 sample
+
+        # bar rotating steadily through several wraps, recorded as int16 samples of 0 to 5 volts
+        pos = 90 * np.sin(np.arange(5000) * dt) + 400 * np.arange(5000) * dt
+        barpos = np.round(((pos + 180) % 360) / 72 / scale).astype(np.int16)
+
+        kinematics = edr_handling.barpos_kinematics(barpos, dt, scale=scale)
+
+        self.assertTrue(np.all((-180 <= kinematics.wrapped) & (kinematics.wrapped <= 180)))
+        np.testing.assert_allclose(kinematics.unwrapped - kinematics.unwrapped[0], pos - pos[0], atol=.02)
+        np.testing.assert_array_almost_equal(kinematics.vel, np.gradient(kinematics.unwrapped) / dt)
+
+        # the same in volts, without the int16 samples
+        kinematics_volts = edr_handling.barpos_kinematics(barpos * scale, dt, in_degrees=False)
+        np.testing.assert_array_almost_equal(kinematics_volts.vel * 72, kinematics.vel)
+
+
+class EdrHeaderTestCase(unittest.TestCase):
+
+    def test_header_matches_fully_loaded_file(self):
+        file_start, header = edr_handling.read_edr_header(TEST_EDR_FILE_PATH)
+        _, file_start_loaded, _, header_loaded = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0)
+
+        self.assertEqual(file_start, file_start_loaded)
+        self.assertEqual(header['n_timepoints'], header_loaded['n_timepoints'])
+        self.assertAlmostEqual(header['recording_duration'], header_loaded['recording_duration'])
+
+
+class EdrRecordingTestCase(unittest.TestCase):
+
+    def test_lazily_decoded_channels_match_loaded_data(self):
+        recording = edr_handling.open_edr(TEST_EDR_FILE_PATH)
+        data, _, cols, header = edr_handling.load_edr(TEST_EDR_FILE_PATH, dt=0, lmr_zscore=False,
+                                                      barpos_in_degrees=False)
+
+        self.assertEqual(recording.n_timepoints, header['n_timepoints'])
+        self.assertEqual(len(recording.cols), len(cols) - 1)
+
+        for col in recording.cols:
+            np.testing.assert_array_almost_equal(recording[col], data[:, cols.index(col)])
+
+
+class TrialMemoTestCase(unittest.TestCase):
+
+    def test_memo_is_bounded_by_bytes(self):
+        memo = edr_handling.TrialMemo(max_bytes=2500 * 8)
+        results = [([np.zeros((500, 2)), np.zeros((100, 2))], None, ['time', 'Freq'], {}) for _ in range(3)]
+
+        memo.put('a', results[0])
+        memo.put('b', results[1])
+        self.assertEqual(len(memo), 2)
+
+        # using 'a' makes 'b' the least recently used result, which should be evicted first
+        self.assertIs(memo.get('a'), results[0])
+        memo.put('c', results[2])
+
+        self.assertEqual(len(memo), 2)
+        self.assertIsNone(memo.get('b'))
+        self.assertLessEqual(memo.n_bytes, memo.max_bytes)
+
 
 class LoadFromTrialTestCase(unittest.TestCase):
 
@@ -105,5 +218,54 @@ class LoadFromTrialTestCase(unittest.TestCase):
 
         session.rollback()
 
+    def test_segments_match_slices_of_whole_file(self):
+        trial = session.query(models.Trial).get(1)
+
+        trial.ignored_segments = []
+        trial.ignored_segments += [models.IgnoredSegment(start_time=10, end_time=20)]
+        trial.ignored_segments += [models.IgnoredSegment(start_time=100, end_time=200)]
+
+        data, _, _, _ = edr_handling.load_from_trial(trial, dt=0, lmr_zscore=False, use_memo=False)
+        file_path = os.path.join(edr_handling.DATA_DIRECTORY, trial.experiment.directory_path, trial.file_name)
+        data_whole, _, _, _ = edr_handling.load_edr(file_path, dt=0, lmr_zscore=False)
+
+        for data_segment in data:
+            start_idx = int(np.round(data_segment[0, 0] / (data_whole[1, 0] - data_whole[0, 0])))
+            np.testing.assert_array_equal(data_segment, data_whole[start_idx:start_idx + len(data_segment)])
+
+        session.rollback()
+
+
+class TrialRecordingTestCase(unittest.TestCase):
+
+    def test_derived_channels_match_loaded_segments(self):
+        trial = session.query(models.Trial).get(1)
+
+        trial.ignored_segments = []
+        trial.ignored_segments += [models.IgnoredSegment(start_time=10, end_time=20)]
+
+        dt = .04
+        recording = edr_handling.TrialRecording.from_trial(trial, dt=dt)
+        data, _, cols, _ = edr_handling.load_from_trial(trial, dt=dt, unwrap_barpos=True, lmr_zscore=False,
+                                                        use_memo=False)
+
+        self.assertEqual(len(recording), len(data))
+
+        for d_ctr, data_segment in enumerate(data):
+            vel = np.gradient(data_segment[:, cols.index('Barpos')]) / dt
+            lpr = data_segment[:, cols.index('Lamp')] + data_segment[:, cols.index('Ramp')]
+
+            np.testing.assert_array_almost_equal(recording.time(d_ctr), data_segment[:, 0])
+            np.testing.assert_array_almost_equal(recording.vel[d_ctr], vel)
+            np.testing.assert_array_almost_equal(recording.vel_abs[d_ctr], np.abs(vel))
+            np.testing.assert_array_almost_equal(recording.lpr[d_ctr], lpr)
+            np.testing.assert_array_almost_equal(recording['Freq'][d_ctr], data_segment[:, cols.index('Freq')])
+
+        # derived channels are only computed once
+        self.assertIs(recording.vel, recording.vel)
+
+        session.rollback()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,85 @@
+from __future__ import print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+import numpy as np
+
+import edr_handling
+import experiment_store
+
+COLS = ['Freq', 'LmR', 'Barpos', 'S1']
+
+# stand-ins for the database models, which are all pack_experiment needs
+Experiment = namedtuple('Experiment', ['id', 'directory_path', 'trials'])
+Trial = namedtuple('Trial', ['id', 'file_name'])
+
+
+def write_edr(file_name, n_timepoints, random_state):
+    header = ['NC={}'.format(len(COLS)), 'NP={}'.format(n_timepoints * len(COLS)), 'AD=10.0', 'ADCMAX=32767',
+              'DT=0.0002', 'CTIME=06-12-2015 11:36:59 AM']
+    header += ['YN{}={}\r\nYCF{}={}'.format(c_ctr, col, c_ctr, 1. + c_ctr) for c_ctr, col in enumerate(COLS)]
+    header = '\r\n'.join(header) + '\r\n'
+
+    with open(file_name, 'wb') as f:
+        f.write((header + ' ' * (2048 - len(header))).encode('ascii'))
+        random_state.randint(-3000, 3000, (n_timepoints, len(COLS))).astype(np.int16).tofile(f)
+
+
+class ExperimentStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_directory = edr_handling.DATA_DIRECTORY
+        edr_handling.DATA_DIRECTORY = self.directory
+
+        os.makedirs(os.path.join(self.directory, 'experiment'))
+
+        random_state = np.random.RandomState(0)
+        trials = []
+        for trial_id, n_timepoints in [(3, 1000), (1, 2500), (2, 10)]:
+            file_name = 'trial{}.EDR'.format(trial_id)
+            write_edr(os.path.join(self.directory, 'experiment', file_name), n_timepoints, random_state)
+            trials += [Trial(trial_id, file_name)]
+
+        self.experiment = Experiment('experiment', 'experiment', trials)
+
+    def tearDown(self):
+        edr_handling.DATA_DIRECTORY = self.data_directory
+        shutil.rmtree(self.directory)
+
+    def test_stored_channels_match_edr_files(self):
+        experiment = self.experiment
+        cols = ['Freq', 'LmR', 'Barpos']
+
+        store = experiment_store.pack_experiment(experiment, os.path.join(self.directory, 'store'), cols=cols)
+
+        self.assertEqual(store.trial_ids, sorted([trial.id for trial in experiment.trials]))
+
+        for trial in experiment.trials:
+            file_path = os.path.join(edr_handling.DATA_DIRECTORY, experiment.directory_path, trial.file_name)
+            recording = edr_handling.open_edr(file_path)
+
+            self.assertEqual(store.cols(trial.id), cols)
+            self.assertEqual(store.dt(trial.id), recording.dt)
+
+            for col in cols:
+                np.testing.assert_array_equal(store.raw(trial.id, col), recording.raw[:, recording.cols.index(col)])
+                np.testing.assert_array_almost_equal(store.channel(trial.id, col), recording[col])
+
+        # reopening the archive gives the same index
+        reopened = experiment_store.ExperimentStore(store.store_path)
+        np.testing.assert_array_equal(reopened.index, store.index)
+
+    def test_failed_packing_leaves_no_files(self):
+        experiment = self.experiment._replace(trials=self.experiment.trials + [Trial(4, 'missing.EDR')])
+
+        with self.assertRaises(IOError):
+            experiment_store.pack_experiment(experiment, os.path.join(self.directory, 'store'))
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['experiment'])
+
+
+if __name__ == '__main__':
+    unittest.main()
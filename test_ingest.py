@@ -0,0 +1,108 @@
+from __future__ import print_function, division
+import datetime
+import functools
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from db_api import ingest, models, queries
+
+import edr_handling
+
+
+def make_trial(p_ctr, solenoid_active):
+    return dict(file_name='trial{:02d}_{}.EDR'.format(p_ctr, solenoid_active),
+                recording_start=datetime.datetime(2015, 6, 12, 11, 36, p_ctr), recording_duration=360.,
+                insect_id='20150612_{}'.format(p_ctr // 4), pair_id='pair{:02d}'.format(p_ctr),
+                odor_status=dict(odor='foot', solenoid_active=solenoid_active))
+
+
+def write_edr(file_name, n_timepoints=10):
+    header = 'NC=1\r\nNP={}\r\nDT=0.001\r\nCTIME=06-12-2015 11:36:59 AM\r\n'.format(n_timepoints)
+    with open(file_name, 'wb') as f:
+        f.write((header + ' ' * (2048 - len(header))).encode('ascii'))
+        f.write(b'\x00\x00' * n_timepoints)
+
+
+def parse_file(file_name, recording_start, header):
+    insect_number = re.findall('insect(\d*)_', file_name)[0]
+    return dict(file_name=file_name, recording_start=recording_start,
+                recording_duration=header['recording_duration'], insect_id=insect_number)
+
+
+class BulkAddTrialsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        models.Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        self.session.add(models.Experiment(id='experiment', directory_path='experiment'))
+        self.session.commit()
+
+        self.n_statements = 0
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def count(*args):
+            self.n_statements += 1
+
+    def test_new_trials_are_added_once_with_related_rows(self):
+        trials = [make_trial(p_ctr, solenoid_active) for p_ctr in range(10) for solenoid_active in [False, True]]
+
+        added = ingest.bulk_add_trials(self.session, 'experiment', trials[:6], batch_size=4)
+        self.assertEqual(len(added), 6)
+
+        self.n_statements = 0
+        added = ingest.bulk_add_trials(self.session, 'experiment', trials, batch_size=4)
+
+        # the trials added before are skipped, and the rest (4 batches) take a fixed number of statements per batch
+        self.assertEqual(added, sorted([trial['file_name'] for trial in trials[6:]]))
+        self.assertLessEqual(self.n_statements, 1 + 7 * 4)
+
+        self.session.expire_all()
+        loaded = queries.trials_query(self.session, experiment_id='experiment').all()
+
+        self.assertEqual(len(loaded), 20)
+        self.assertEqual(self.session.query(models.Insect).count(), 3)
+        self.assertEqual(self.session.query(models.TrialPair).count(), 10)
+
+        for trial in loaded:
+            self.assertTrue(trial.file_name.endswith('_{}.EDR'.format(trial.odor_status.solenoid_active)))
+            self.assertEqual(trial.pair.id, 'pair' + trial.file_name[5:7])
+            self.assertEqual(len(trial.pair.trials), 2)
+
+    def test_directory_is_ingested_with_errors_reported(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for t_ctr in range(5):
+                write_edr(os.path.join(directory, 'insect{}_tr{}.EDR'.format(t_ctr % 2, t_ctr)))
+            write_edr(os.path.join(directory, 'unnamed.EDR'))
+            with open(os.path.join(directory, 'insect3_corrupt.EDR'), 'wb') as f:
+                f.write(b'not a header')
+
+            scan_directory = functools.partial(edr_handling.scan_edr_directory, n_threads=3)
+            report = ingest.ingest_directory(self.session, 'experiment', directory, scan_directory, parse_file,
+                                             batch_size=2)
+            report_again = ingest.ingest_directory(self.session, 'experiment', directory,
+                                                   edr_handling.scan_edr_directory, parse_file)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(report.added, sorted(['insect{}_tr{}.EDR'.format(t_ctr % 2, t_ctr) for t_ctr in range(5)]))
+        self.assertEqual(report.skipped, [])
+        self.assertEqual(sorted(report.errors), ['insect3_corrupt.EDR', 'unnamed.EDR'])
+
+        self.assertEqual(report_again.added, [])
+        self.assertEqual(report_again.skipped, report.added)
+        self.assertEqual(sorted(report_again.errors), ['insect3_corrupt.EDR', 'unnamed.EDR'])
+
+        self.assertEqual(self.session.query(models.Trial).count(), 5)
+        self.assertEqual(self.session.query(models.Insect).count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from __future__ import print_function, division
+import datetime
+import unittest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from db_api import models, migrate
+
+
+class MigrateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # a database set up before models.py declared any indexes
+        self.engine = create_engine('sqlite://')
+        models.Base.metadata.create_all(self.engine)
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(self.engine)
+
+        self.session = sessionmaker(bind=self.engine)()
+        experiment = models.Experiment(id='experiment', directory_path='experiment')
+        for t_ctr in range(3):
+            self.session.add(models.Trial(file_name='trial{}.EDR'.format(t_ctr), experiment=experiment,
+                                          recording_start=datetime.datetime(2015, 4, 1, t_ctr)))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def index_names(self, table_name):
+        return set([index['name'] for index in inspect(self.engine).get_indexes(table_name)])
+
+    def test_missing_indexes_are_created_once(self):
+        created = migrate.migrate(self.engine)
+
+        self.assertIn('uq_trial_experiment_id_file_name', created)
+        self.assertIn('ix_ignored_segment_trial_id', created)
+        self.assertEqual(self.index_names('trial'),
+                         set(['uq_trial_experiment_id_file_name', 'ix_trial_experiment_id_recording_start',
+                              'ix_trial_insect_id', 'ix_trial_pair_id']))
+        self.assertEqual(self.index_names('trial_odor_status'), set(['ix_trial_odor_status_trial_id']))
+
+        self.assertEqual(migrate.migrate(self.engine), [])
+        self.assertEqual(self.session.query(models.Trial).count(), 3)
+
+    def test_indexes_covered_by_existing_ones_are_not_duplicated(self):
+        # as MySQL creates for foreign keys, plus a non-unique index that cannot replace the unique one
+        self.engine.execute('CREATE INDEX insect_id ON trial (insect_id)')
+        self.engine.execute('CREATE INDEX pair_id_insect_id ON trial (pair_id, insect_id)')
+        self.engine.execute('CREATE INDEX experiment_id_file_name ON trial (experiment_id, file_name)')
+
+        created = migrate.migrate(self.engine)
+
+        self.assertNotIn('ix_trial_insect_id', created)
+        self.assertNotIn('ix_trial_pair_id', created)
+        self.assertIn('uq_trial_experiment_id_file_name', created)
+        self.assertIn('ix_trial_experiment_id_recording_start', created)
+        self.assertEqual(migrate.missing_indexes(self.engine), [])
+
+    def test_file_names_are_unique_within_experiment_after_migration(self):
+        migrate.migrate(self.engine)
+
+        other = models.Experiment(id='other', directory_path='other')
+        self.session.add(models.Trial(file_name='trial0.EDR', experiment=other))
+        self.session.commit()
+
+        self.session.add(models.Trial(file_name='trial0.EDR', experiment_id='experiment'))
+        with self.assertRaises(IntegrityError):
+            self.session.commit()
+        self.session.rollback()
+
+    def test_duplicate_trials_stop_migration(self):
+        self.session.add(models.Trial(file_name='trial0.EDR', experiment_id='experiment'))
+        self.session.commit()
+
+        with self.assertRaises(ValueError):
+            migrate.migrate(self.engine)
+
+        self.assertEqual(migrate.duplicate_trials(self.engine), [('experiment', 'trial0.EDR', 2)])
+        self.assertEqual(self.index_names('trial'), set())
+
+    def test_empty_database_gets_tables_and_indexes(self):
+        engine = create_engine('sqlite://')
+
+        self.assertEqual(migrate.migrate(engine), [])
+        self.assertIn('trial', inspect(engine).get_table_names())
+        self.assertEqual(migrate.missing_indexes(engine), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+
+import pooled_xcov
+import xcov
+
+
+class PoolStatsTestCase(unittest.TestCase):
+
+    def test_trials_are_pooled_within_groups(self):
+        pairs = [('x', 'y')]
+        trials = [[np.random.normal(0, 1, n) for n in segment_lengths]
+                  for segment_lengths in [[300, 20], [500], [100, 100, 100]]]
+        signals = [{'x': x, 'y': [x_ + np.random.normal(5, 1, len(x_)) for x_ in x]} for x in trials]
+
+        trial_stats = [(('insect01', 'foot', True), xcov.xcov_stats(signals[0], pairs, 4, 10)),
+                       (('insect02', 'foot', True), xcov.xcov_stats(signals[1], pairs, 4, 10)),
+                       (('insect02', 'foot', False), xcov.xcov_stats(signals[2], pairs, 4, 10))]
+
+        pooled = pooled_xcov.pool_stats(trial_stats, group_by=('odor', 'solenoid_active'))
+
+        self.assertEqual(sorted(pooled.keys()), [((None, 'foot', False), ('x', 'y')),
+                                                 ((None, 'foot', True), ('x', 'y'))])
+
+        # pooling statistics is the same as pooling the segments of all trials in a group
+        n_trials, summed = pooled[(None, 'foot', True), ('x', 'y')]
+        expected = xcov.xcov_multi({'x': signals[0]['x'] + signals[1]['x'], 'y': signals[0]['y'] + signals[1]['y']},
+                                   pairs, 4, 10)['x', 'y']
+
+        self.assertEqual(n_trials, 2)
+        for values, expected_values in zip(summed.result(), expected):
+            np.testing.assert_array_almost_equal(values, expected_values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from __future__ import print_function, division
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from db_api import models, queries
+
+
+class EagerQueriesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        models.Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        experiment = models.Experiment(id='experiment', directory_path='experiment')
+        for p_ctr in range(10):
+            pair = models.TrialPair(id='pair{}'.format(p_ctr))
+            for solenoid_active in [False, True]:
+                trial = models.Trial(file_name='trial{}_{}.EDR'.format(p_ctr, solenoid_active), experiment=experiment,
+                                     pair=pair)
+                trial.odor_status = models.TrialOdorStatus(odor='foot', solenoid_active=solenoid_active)
+                trial.ignored_segments = [models.IgnoredSegment(start_time=0, end_time=p_ctr)]
+                self.session.add(trial)
+        self.session.commit()
+        self.session.close()
+
+        self.n_statements = 0
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def count(*args):
+            self.n_statements += 1
+
+    def read_trial(self, trial):
+        return (trial.experiment.directory_path, trial.odor_status.solenoid_active,
+                [(i_s.start_time, i_s.end_time) for i_s in trial.ignored_segments])
+
+    def test_trials_are_loaded_in_constant_number_of_queries(self):
+        session = sessionmaker(bind=self.engine)()
+
+        trials = queries.trials_query(session, experiment_id='experiment').all()
+        for trial in trials:
+            self.read_trial(trial)
+
+        self.assertEqual(len(trials), 20)
+        self.assertEqual(self.n_statements, 2)
+
+        self.assertEqual(sorted(queries.get_trials(session, [1, 3, 100]).keys()), [1, 3])
+
+    def test_trial_pairs_are_loaded_in_constant_number_of_queries(self):
+        session = sessionmaker(bind=self.engine)()
+
+        trial_pairs = queries.trial_pairs_query(session, experiment_id='experiment').all()
+        for trial_pair in trial_pairs:
+            for trial in trial_pair.trials:
+                self.read_trial(trial)
+
+        self.assertEqual(len(trial_pairs), 10)
+        self.assertEqual(self.n_statements, 3)
+        self.assertEqual(queries.trial_pairs_query(session, experiment_id='other').all(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
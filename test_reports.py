@@ -0,0 +1,43 @@
+from __future__ import print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import reports
+
+
+def plot_sine(frequency, subplots):
+    fig, axs = subplots(2, 1, sharex=True, tight_layout=True)
+    t = np.linspace(0, 1, 100)
+    axs[0].plot(t, np.sin(2 * np.pi * frequency * t))
+    axs[1].plot(t, np.cos(2 * np.pi * frequency * t))
+    return [('sine', fig)]
+
+
+class RenderReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pngs_and_pdf_are_written(self):
+        pdf_path, errors = reports.render_report(plot_sine, [1, 2, 3], self.directory, n_processes=2)
+
+        self.assertEqual(errors, {})
+        self.assertTrue(os.path.getsize(pdf_path) > 0)
+        for frequency in [1, 2, 3]:
+            self.assertTrue(os.path.exists(os.path.join(self.directory, '{}_sine.png'.format(frequency))))
+
+    def test_subplots_does_not_need_pyplot(self):
+        fig, axs = reports.subplots(3, 1, figsize=(4, 6))
+
+        self.assertEqual(len(axs), 3)
+        self.assertEqual(tuple(fig.get_size_inches()), (4, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
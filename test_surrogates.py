@@ -0,0 +1,66 @@
+from __future__ import print_function, division
+import unittest
+import numpy as np
+
+import surrogates
+import xcov
+
+
+class SurrogatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        segment_lengths = [300, 4, 513]
+
+        self.x = [np.random.normal(3, 2, n) for n in segment_lengths]
+        self.y = [np.convolve(x, np.ones(4), 'full')[:len(x)] + np.random.normal(100, 1, len(x)) for x in self.x]
+
+    def test_phase_surrogates_keep_amplitude_spectrum_and_mean(self):
+        x = self.x[2]
+        xs = surrogates.make_surrogates(x, 10, 'phase', np.random.RandomState(0))
+
+        self.assertEqual(xs.shape, (10, len(x)))
+        np.testing.assert_array_almost_equal(np.abs(np.fft.rfft(xs, axis=1)),
+                                             np.tile(np.abs(np.fft.rfft(x)), (10, 1)))
+        np.testing.assert_array_almost_equal(xs.mean(axis=1), np.repeat(x.mean(), 10))
+
+    def test_shift_surrogates_are_circular_shifts(self):
+        x = self.x[0]
+        xs = surrogates.make_surrogates(x, 10, 'shift', np.random.RandomState(0))
+
+        for x_ in xs:
+            self.assertTrue(any(np.array_equal(x_, np.roll(x, shift)) for shift in range(len(x))))
+
+    def test_surrogate_statistics_match_xcov_of_each_surrogate(self):
+        n_lags_back, n_lags_forward, n_surrogates = 6, 15, 7
+
+        stats = surrogates.surrogate_xcov_stats(self.x, self.y, n_lags_back, n_lags_forward,
+                                                n_surrogates=n_surrogates, random_state=np.random.RandomState(1))
+
+        # regenerate the same surrogates segment by segment and correlate each one directly
+        random_state = np.random.RandomState(1)
+        xs = [surrogates.make_surrogates(x, n_surrogates, 'phase', random_state) for x in self.x]
+
+        for k, xcov_ in enumerate(stats.result().xcov):
+            signals = {'x': [x_[k] for x_ in xs], 'y': self.y}
+            expected = xcov.xcov_multi(signals, [('x', 'y')], n_lags_back, n_lags_forward)['x', 'y'].xcov
+            np.testing.assert_array_almost_equal(xcov_, expected)
+
+    def test_null_bands_and_empirical_p(self):
+        bands = surrogates.null_bands(self.x, self.y, 3, 5, n_surrogates=100, random_state=np.random.RandomState(2))
+
+        self.assertEqual(bands.xcovs.shape, (100, 8))
+        self.assertTrue(np.all(bands.lb <= bands.ub))
+
+        observed = xcov.xcov_multi({'x': self.x, 'y': self.y}, [('x', 'y')], 3, 5)['x', 'y'].xcov
+        ps = surrogates.empirical_p(observed, bands.xcovs)
+
+        self.assertTrue(np.all((1 / 101 <= ps) & (ps <= 1)))
+        # the effect follows the cause over lags 0 to 3
+        self.assertTrue(np.all(ps[3:7] == 1 / 101))
+
+    def test_unknown_method_raises_error(self):
+        self.assertRaises(ValueError, surrogates.make_surrogates, self.x[0], 3, 'bootstrap')
+
+
+if __name__ == '__main__':
+    unittest.main()
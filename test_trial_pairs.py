@@ -0,0 +1,100 @@
+from __future__ import print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import trial_pairs
+import xcov
+
+
+def make_signals(n_segments, gain, random_state):
+    x = [random_state.normal(0, 1, 400) for _ in range(n_segments)]
+    y = [gain * np.concatenate([np.zeros(3), x_[:-3]]) + random_state.normal(10, 1, len(x_)) for x_ in x]
+    return {'x': x, 'y': y}
+
+
+class PairDifferenceTestCase(unittest.TestCase):
+
+    def test_segment_statistics_sum_to_trial_statistics(self):
+        signals = make_signals(5, 1., np.random.RandomState(0))
+
+        stats = trial_pairs.segment_xcov_stats(signals, [('x', 'y')], 4, 8)['x', 'y']
+        self.assertEqual(stats.sxy.shape, (5, 12))
+
+        np.testing.assert_array_almost_equal(trial_pairs.bootstrap_stats(stats, np.ones(5)).result().xcov,
+                                             xcov.xcov_multi(signals, [('x', 'y')], 4, 8)['x', 'y'].xcov)
+
+    def test_difference_and_bootstrap_bands(self):
+        random_state = np.random.RandomState(1)
+        off_signals = make_signals(10, 0., random_state)
+        on_signals = make_signals(12, 1., random_state)
+        on_signals['odor'] = on_signals['x']
+
+        differences = trial_pairs.pair_difference(off_signals, on_signals, [('x', 'y'), ('odor', 'y')], 4, 8,
+                                                  n_bootstrap=200, n_surrogates=100, random_state=random_state)
+
+        # pairs missing from the solenoid-off trial are left out
+        self.assertEqual(list(differences.keys()), [('x', 'y')])
+
+        off, on, diff, lb, ub, null_lb, null_ub = differences['x', 'y']
+        np.testing.assert_array_almost_equal(diff, on.xcov - off.xcov)
+
+        # the response appears at a lag of 3 only when the solenoid is on
+        lag_3 = 4 + 3
+        self.assertGreater(lb[lag_3], .5)
+        self.assertTrue(np.all(lb <= diff) and np.all(diff <= ub))
+        self.assertLess(np.sum((lb > 0) | (ub < 0)), 3)
+
+        # and lies far outside the null band of the difference, which contains zero
+        self.assertGreater(diff[lag_3], null_ub[lag_3])
+        self.assertTrue(np.all(null_lb < 0) and np.all(0 < null_ub))
+
+    def test_trials_are_normalized_jointly(self):
+        random_state = np.random.RandomState(2)
+        off_signals = make_signals(6, 1., random_state)
+        on_signals = make_signals(6, 1., random_state)
+        on_signals['y'] = [2 * y for y in on_signals['y']]
+
+        differences = trial_pairs.pair_difference(off_signals, on_signals, [('x', 'y')], 4, 8, n_bootstrap=10,
+                                                  n_surrogates=0, random_state=random_state)
+        off, on, _, _, _, null_lb, null_ub = differences['x', 'y']
+
+        # both trials are divided by the same scale, so their ratio is that of their covariances
+        covs = [xcov.xcov_multi(signals, [('x', 'y')], 4, 8, normed=False)['x', 'y'].xcov
+                for signals in [off_signals, on_signals]]
+        np.testing.assert_array_almost_equal(on.xcov * covs[0], off.xcov * covs[1])
+        self.assertGreater(on.xcov[4 + 3], 1.5 * off.xcov[4 + 3])
+        self.assertIsNone(null_lb)
+        self.assertIsNone(null_ub)
+
+        # which for two identical trials gives their correlations
+        same = trial_pairs.pair_difference(off_signals, off_signals, [('x', 'y')], 4, 8, n_bootstrap=10,
+                                           n_surrogates=0, random_state=random_state)['x', 'y']
+        np.testing.assert_array_almost_equal(same.on.xcov, xcov.xcov_multi(off_signals, [('x', 'y')], 4, 8)['x', 'y'].xcov)
+        np.testing.assert_array_almost_equal(same.diff, 0)
+
+    def test_differences_are_saved_and_loaded(self):
+        random_state = np.random.RandomState(3)
+        differences = trial_pairs.pair_difference(make_signals(3, 0., random_state), make_signals(3, 1., random_state),
+                                                  [('x', 'y'), ('y', 'x')], 4, 8, n_bootstrap=10, n_surrogates=10,
+                                                  random_state=random_state)
+
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'differences.npz')
+            trial_pairs.save_differences(file_name, differences, t=np.arange(-4, 8))
+            loaded, arrays = trial_pairs.load_differences(file_name)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(sorted(loaded), sorted(differences))
+        np.testing.assert_array_equal(arrays['t'], np.arange(-4, 8))
+        for pair, difference in differences.items():
+            for field, values in zip(trial_pairs.PairDifference._fields, difference):
+                np.testing.assert_array_equal(getattr(loaded[pair], field), values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+from __future__ import print_function, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import xcov
+
+
+def pooled_xcov(xs, ys, lag):
+    """Correlation of x[i] and y[i + lag] pooled over segments, computed directly."""
+    x_pooled, y_pooled = [], []
+    for x, y in zip(xs, ys):
+        if lag >= 0:
+            x_pooled += [x[:max(len(x) - lag, 0)]]
+            y_pooled += [y[lag:]]
+        else:
+            x_pooled += [x[-lag:]]
+            y_pooled += [y[:max(len(y) + lag, 0)]]
+    return np.corrcoef(np.concatenate(x_pooled), np.concatenate(y_pooled))[0, 1]
+
+
+class XcovMultiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        segment_lengths = [400, 5, 1000]
+
+        self.x = [np.random.normal(3, 2, n) for n in segment_lengths]
+        self.y = [np.convolve(x, np.ones(4), 'full')[:len(x)] + np.random.normal(100, 1, len(x)) for x in self.x]
+        self.signals = {'x': self.x, 'y': self.y}
+
+    def test_cross_and_auto_covariances_match_direct_computation(self):
+        n_lags_back, n_lags_forward = 8, 20
+        pairs = [('x', 'y'), ('y', 'x'), ('x', 'x')]
+
+        results = xcov.xcov_multi(self.signals, pairs, n_lags_back, n_lags_forward)
+
+        for cause, effect in pairs:
+            xcovs, ps, lbs, ubs = results[cause, effect]
+
+            self.assertEqual(len(xcovs), n_lags_back + n_lags_forward)
+
+            for lag, xcov_ in zip(range(-n_lags_back, n_lags_forward), xcovs):
+                self.assertAlmostEqual(xcov_, pooled_xcov(self.signals[cause], self.signals[effect], lag))
+
+            self.assertTrue(np.all(lbs <= xcovs + 1e-12))
+            self.assertTrue(np.all(ubs >= xcovs - 1e-12))
+            self.assertTrue(np.all((0 <= ps) & (ps <= 1)))
+
+    def test_statistics_can_be_combined_across_segments(self):
+        pairs = [('x', 'y')]
+
+        stats_all = xcov.xcov_stats(self.signals, pairs, 3, 5)
+        stats_first = xcov.xcov_stats({'x': self.x[:1], 'y': self.y[:1]}, pairs, 3, 5)
+        stats_rest = xcov.xcov_stats({'x': self.x[1:], 'y': self.y[1:]}, pairs, 3, 5)
+
+        np.testing.assert_array_almost_equal((stats_first['x', 'y'] + stats_rest['x', 'y']).result().xcov,
+                                             stats_all['x', 'y'].result().xcov)
+
+    def test_signals_must_have_same_segments(self):
+        signals = {'x': self.x, 'y': self.y[:2]}
+
+        self.assertRaises(ValueError, xcov.xcov_multi, signals, [('x', 'y')], 3, 5)
+
+    def test_accumulated_chunks_match_whole_segments(self):
+        pairs = [('x', 'y'), ('y', 'x'), ('x', 'x')]
+        expected = xcov.xcov_multi(self.signals, pairs, 8, 20)
+
+        for chunk_length in [1, 7, 50, 2000]:
+            accumulator = xcov.XcovAccumulator(pairs, 8, 20)
+
+            for x, y in zip(self.x, self.y):
+                for start in range(0, len(x), chunk_length):
+                    accumulator.add({'x': x[start:start + chunk_length], 'y': y[start:start + chunk_length]})
+                accumulator.end_segment()
+
+            results = accumulator.result()
+
+            for pair in pairs:
+                for values, expected_values in zip(results[pair], expected[pair]):
+                    np.testing.assert_array_almost_equal(values, expected_values)
+
+    def test_results_are_saved_and_loaded(self):
+        results = xcov.xcov_multi(self.signals, [('x', 'y'), ('y', 'y')], 3, 5)
+
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'results.npz')
+            xcov.save_results(file_name, results, t=np.arange(-3, 5))
+            loaded_results, arrays = xcov.load_results(file_name)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(sorted(loaded_results.keys()), sorted(results.keys()))
+        for pair, result in results.items():
+            for values, loaded_values in zip(result, loaded_results[pair]):
+                np.testing.assert_array_equal(loaded_values, values)
+        np.testing.assert_array_equal(arrays['t'], np.arange(-3, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+"""
+Paired analysis of the solenoid-off and solenoid-on trials of a models.TrialPair.
+
+Both trials of a pair are loaded concurrently and cross-correlated on the same lag
+grid, with the statistics of each segment kept separately. Bootstrap replicates of
+each trial are then formed all at once by resampling its segments (a matrix of
+resampling counts times the per-segment statistics), which gives bands for the
+on-minus-off difference of every cross-correlation without recomputing anything.
+
+Correlations of both trials are normalized jointly, by the standard deviations of
+cause and effect pooled within the two trials, so that their difference reflects a
+change in covariance rather than in either trial's own variances. The same scale is
+applied to the bootstrap replicates and to a surrogate null of the difference, in
+which the cause of both trials is replaced by surrogates (see surrogates.py) drawn
+from one random state.
+
+Example:
+    differences, errors = analyze_trial_pairs(trial_pair_ids, [('vel', 'lmr'), ('vel', 'freq')], 12, 125, dt=.04)
+    vel_x_lmr = differences[trial_pair_ids[0]]['vel', 'lmr']
+    plt.fill_between(t, vel_x_lmr.lb, vel_x_lmr.ub)
+"""
+from __future__ import print_function, division
+
+import zlib
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from db_api import queries
+
+import batch
+import edr_handling
+import pooled_xcov
+import surrogates
+import xcov
+
+N_BOOTSTRAP = 1000
+N_SURROGATES = 200
+
+PairDifference = namedtuple('PairDifference', ['off', 'on', 'diff', 'lb', 'ub', 'null_lb', 'null_ub'])
+
+
+def solenoid_off_on(trial_pair):
+    """Return the solenoid-off and solenoid-on trials of a trial pair."""
+    if trial_pair.trials[0].odor_status.solenoid_active:
+        return trial_pair.trials[1], trial_pair.trials[0]
+    else:
+        return trial_pair.trials[0], trial_pair.trials[1]
+
+
+def load_pair(trial_pair, dt):
+    """
+    Load the recordings of both trials of a pair concurrently.
+
+    :return: solenoid-off and solenoid-on trials, TrialRecordings of both
+    """
+    trials = solenoid_off_on(trial_pair)
+
+    # load the database attributes the recordings need first, since sessions must not be shared between threads
+    for trial in trials:
+        _ = trial.experiment.directory_path
+        _ = [(i_s.start_time, i_s.end_time) for i_s in trial.ignored_segments]
+
+    pool = ThreadPool(len(trials))
+    try:
+        recordings = pool.map(lambda trial: edr_handling.TrialRecording.from_trial(trial, dt=dt), trials)
+    finally:
+        pool.close()
+        pool.join()
+
+    return trials, recordings
+
+
+def segment_xcov_stats(signals, pairs, n_lags_back, n_lags_forward):
+    """
+    Compute cross-covariance statistics separately for every segment of a set of signals.
+
+    :param signals: dict mapping names to lists of 1D segments (see xcov.xcov_stats)
+    :param pairs: list of (cause name, effect name) tuples
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :return: dict mapping each pair to XcovStats whose sums have shape (number of segments, number of lags),
+             all relative to the means of the whole signals
+    """
+    names = sorted(set([name for pair in pairs for name in pair]))
+
+    offsets = {}
+    for name in names:
+        if sum([len(segment) for segment in signals[name]]):
+            offsets[name] = float(np.mean(np.concatenate(signals[name])))
+        else:
+            offsets[name] = 0.
+
+    n_segments = len(signals[names[0]]) if names else 0
+    segment_stats = [xcov.xcov_stats(dict([(name, [signals[name][s_ctr]]) for name in names]), pairs,
+                                     n_lags_back, n_lags_forward, offsets=offsets)
+                     for s_ctr in range(n_segments)]
+
+    lags = np.arange(-n_lags_back, n_lags_forward)
+    all_stats = {}
+
+    for pair in pairs:
+        stacked = [[getattr(stats[pair], field) for stats in segment_stats]
+                   for field in ['n', 'sx', 'sy', 'sxx', 'syy', 'sxy']]
+        stacked = [np.array(values).reshape((n_segments, len(lags))) for values in stacked]
+        all_stats[pair] = xcov.XcovStats(lags, *stacked, x0=offsets[pair[0]], y0=offsets[pair[1]])
+
+    return all_stats
+
+
+def bootstrap_stats(stats, counts):
+    """
+    Combine per-segment statistics with resampling counts.
+
+    :param stats: XcovStats whose sums have shape (number of segments, number of lags)
+    :param counts: array of shape (number of replicates, number of segments) of how often each
+                   segment is drawn in each replicate (or 1D over segments for a single replicate)
+    :return: XcovStats whose sums have shape (number of replicates, number of lags)
+    """
+    return xcov.XcovStats(stats.lags, counts.dot(stats.n), counts.dot(stats.sx), counts.dot(stats.sy),
+                          counts.dot(stats.sxx), counts.dot(stats.syy), counts.dot(stats.sxy),
+                          x0=stats.x0, y0=stats.y0)
+
+
+def _sums_of_squares(stats):
+    """Sums of squared deviations of cause and effect from their means, at each lag."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssx = np.where(stats.n > 0, stats.sxx - stats.sx ** 2 / stats.n, 0)
+        ssy = np.where(stats.n > 0, stats.syy - stats.sy ** 2 / stats.n, 0)
+
+    return ssx, ssy
+
+
+def joint_scale(off_stats, on_stats):
+    """
+    Product of the standard deviations of cause and effect pooled within two trials, at each lag.
+
+    :param off_stats: XcovStats of the solenoid-off trial (sums over lags)
+    :param on_stats: XcovStats of the solenoid-on trial
+    :return: array over lags
+    """
+    off_ssx, off_ssy = _sums_of_squares(off_stats)
+    on_ssx, on_ssy = _sums_of_squares(on_stats)
+    n = off_stats.n + on_stats.n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt((off_ssx + on_ssx) / n * (off_ssy + on_ssy) / n)
+
+
+def _scaled(result, scale):
+    """XcovResult of covariances divided by scale."""
+    return xcov.XcovResult(result.xcov / scale, result.p, result.lb / scale, result.ub / scale)
+
+
+def _resampling_counts(n_segments, n_bootstrap, random_state):
+    if not n_segments:
+        return np.zeros((n_bootstrap, 0))
+    return random_state.multinomial(n_segments, np.ones(n_segments) / n_segments, size=n_bootstrap)
+
+
+def pair_difference(off_signals, on_signals, pairs, n_lags_back, n_lags_forward, n_bootstrap=N_BOOTSTRAP,
+                    n_surrogates=N_SURROGATES, surrogate_method='phase', confidence=.95, normed=True,
+                    random_state=np.random):
+    """
+    Compute on-minus-off differences of cross-covariances with bootstrap bands and surrogate null bands.
+
+    Segments of each trial are resampled independently, so trials with a single segment
+    give bootstrap bands of zero width. With normed, the cross-covariances of both trials
+    (and of their bootstrap replicates and surrogates) are divided by their joint_scale.
+
+    :param off_signals: dict mapping names to lists of segments of the solenoid-off trial
+    :param on_signals: same for the solenoid-on trial
+    :param pairs: list of (cause name, effect name) tuples; pairs missing from either trial are left out
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param n_bootstrap: number of bootstrap replicates
+    :param n_surrogates: number of surrogates of the cause of each trial (0 to leave out the null bands)
+    :param surrogate_method: 'phase' or 'shift' (see surrogates.make_surrogates)
+    :param confidence: confidence level of bounds and bands
+    :param normed: if True, use jointly normalized correlations, otherwise covariances
+    :param random_state: numpy RandomState
+    :return: dict mapping each pair to a PairDifference of off and on XcovResults, the difference
+             of their xcovs, its lower and upper bootstrap bands and its lower and upper null
+             bands (None without surrogates)
+    """
+    pairs = [pair for pair in pairs if all([name in off_signals and name in on_signals for name in pair])]
+
+    off_stats = segment_xcov_stats(off_signals, pairs, n_lags_back, n_lags_forward)
+    on_stats = segment_xcov_stats(on_signals, pairs, n_lags_back, n_lags_forward)
+
+    # the same resampled segments are used for every pair of signals
+    off_counts = _resampling_counts(len(off_signals[pairs[0][0]]) if pairs else 0, n_bootstrap, random_state)
+    on_counts = _resampling_counts(len(on_signals[pairs[0][0]]) if pairs else 0, n_bootstrap, random_state)
+
+    differences = {}
+
+    for pair in pairs:
+        off_total = bootstrap_stats(off_stats[pair], np.ones(off_counts.shape[1]))
+        on_total = bootstrap_stats(on_stats[pair], np.ones(on_counts.shape[1]))
+
+        scale = joint_scale(off_total, on_total) if normed else 1.
+
+        off = _scaled(off_total.result(confidence, normed=False), scale)
+        on = _scaled(on_total.result(confidence, normed=False), scale)
+
+        diffs = (bootstrap_stats(on_stats[pair], on_counts).result(confidence, normed=False).xcov
+                 - bootstrap_stats(off_stats[pair], off_counts).result(confidence, normed=False).xcov) / scale
+
+        lb = np.nanpercentile(diffs, 100 * (1 - confidence) / 2, axis=0)
+        ub = np.nanpercentile(diffs, 100 * (1 + confidence) / 2, axis=0)
+
+        null_lb, null_ub = None, None
+
+        if n_surrogates:
+            cause, effect = pair
+            null_diffs = [surrogates.surrogate_xcov_stats(
+                signals[cause], signals[effect], n_lags_back, n_lags_forward, n_surrogates=n_surrogates,
+                method=surrogate_method, random_state=random_state).result(normed=False).xcov
+                for signals in [off_signals, on_signals]]
+            null_diffs = (null_diffs[1] - null_diffs[0]) / scale
+
+            null_lb = np.nanpercentile(null_diffs, 100 * (1 - confidence) / 2, axis=0)
+            null_ub = np.nanpercentile(null_diffs, 100 * (1 + confidence) / 2, axis=0)
+
+        differences[pair] = PairDifference(off, on, on.xcov - off.xcov, lb, ub, null_lb, null_ub)
+
+    return differences
+
+
+def save_differences(file_name, differences, **arrays):
+    """
+    Save the results of pair_difference to an npz file, along with any other arrays.
+
+    :param file_name: path of npz file
+    :param differences: dict mapping (cause name, effect name) pairs to PairDifferences
+    """
+    contents = dict(arrays)
+    for (cause, effect), difference in differences.items():
+        for field, values in zip(PairDifference._fields, difference):
+            if field in ('off', 'on'):
+                for result_field, result_values in zip(xcov.XcovResult._fields, values):
+                    contents['{}_{}__{}__{}'.format(field, result_field, cause, effect)] = result_values
+            elif values is not None:
+                contents['{}__{}__{}'.format(field, cause, effect)] = values
+
+    np.savez(file_name, **contents)
+
+
+def load_differences(file_name):
+    """
+    Load results saved by save_differences.
+
+    :param file_name: path of npz file
+    :return: dict mapping (cause name, effect name) pairs to PairDifferences, dict of other arrays
+    """
+    field_names = set(PairDifference._fields) | set(['{}_{}'.format(trial, result_field) for trial in ['off', 'on']
+                                                     for result_field in xcov.XcovResult._fields])
+    fields = {}
+    arrays = {}
+
+    with np.load(file_name) as contents:
+        for key in contents.files:
+            parts = key.split('__')
+            if len(parts) == 3 and parts[0] in field_names:
+                fields.setdefault((parts[1], parts[2]), {})[parts[0]] = contents[key]
+            else:
+                arrays[key] = contents[key]
+
+    differences = {}
+    for pair, pair_fields in fields.items():
+        off, on = [xcov.XcovResult(*[pair_fields['{}_{}'.format(trial, result_field)]
+                                     for result_field in xcov.XcovResult._fields]) for trial in ['off', 'on']]
+        differences[pair] = PairDifference(off, on, pair_fields['diff'], pair_fields['lb'], pair_fields['ub'],
+                                           pair_fields.get('null_lb'), pair_fields.get('null_ub'))
+
+    return differences, arrays
+
+
+class _AnalyzeTrialPair(object):
+    """Compute the on-minus-off differences of one trial pair (in a worker process)."""
+
+    def __init__(self, pairs, n_lags_back, n_lags_forward, dt, n_bootstrap, n_surrogates, surrogate_method,
+                 confidence, normed):
+        self.pairs = pairs
+        self.n_lags_back = n_lags_back
+        self.n_lags_forward = n_lags_forward
+        self.dt = dt
+        self.n_bootstrap = n_bootstrap
+        self.n_surrogates = n_surrogates
+        self.surrogate_method = surrogate_method
+        self.confidence = confidence
+        self.normed = normed
+
+    def __call__(self, trial_pair_id):
+        try:
+            trial_pair = queries.get_trial_pair(batch.session, trial_pair_id)
+
+            (off_trial, on_trial), (off_recording, on_recording) = load_pair(trial_pair, self.dt)
+
+            return pair_difference(
+                pooled_xcov.trial_signals(off_trial, off_recording), pooled_xcov.trial_signals(on_trial, on_recording),
+                self.pairs, self.n_lags_back, self.n_lags_forward, n_bootstrap=self.n_bootstrap,
+                n_surrogates=self.n_surrogates, surrogate_method=self.surrogate_method,
+                confidence=self.confidence, normed=self.normed,
+                random_state=np.random.RandomState(zlib.crc32(str(trial_pair_id).encode('utf-8')) & 0xffffffff))
+        finally:
+            batch.session.rollback()
+
+
+def analyze_trial_pairs(trial_pair_ids, pairs, n_lags_back, n_lags_forward, dt, n_bootstrap=N_BOOTSTRAP,
+                        n_surrogates=N_SURROGATES, surrogate_method='phase', confidence=.95, normed=True,
+                        n_processes=batch.N_PROCESSES):
+    """
+    Compute the on-minus-off differences of cross-covariances of several trial pairs in a pool
+    of worker processes (see pair_difference).
+
+    :param trial_pair_ids: ids of trial pairs
+    :param pairs: list of (cause name, effect name) tuples (names as in pooled_xcov.trial_signals)
+    :param dt: sampling interval to load trials at
+    :param n_processes: number of worker processes
+    :return: dict mapping trial pair ids to dicts of PairDifferences by pair, dict of formatted
+             tracebacks of trial pairs that could not be processed
+    """
+    return batch.map_in_pool(_AnalyzeTrialPair(pairs, n_lags_back, n_lags_forward, dt, n_bootstrap, n_surrogates,
+                                               surrogate_method, confidence, normed),
+                             trial_pair_ids, n_processes=n_processes)
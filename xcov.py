@@ -0,0 +1,351 @@
+"""
+Batched cross-covariance of many pairs of segmented signals.
+
+All signals passed to xcov_multi are split into the same segments (e.g. the
+segments of a trial between ignored segments). For a lag tau the cross-covariance
+between a cause x and an effect y pools the pairs (x[i], y[i + tau]) of every
+segment and computes their Pearson correlation, so that samples are never paired
+across segment boundaries.
+
+The lagged sums of products are computed with one real FFT per segment per
+signal. The spectra are shared by every pair involving a signal, so the
+transform cost scales with the number of signals rather than the number of
+pairs; the remaining per-lag sums come from cumulative sums.
+
+Recordings too long to hold in memory can be fed to an XcovAccumulator chunk by
+chunk, which gives the same results as xcov_multi with memory that does not grow
+with the length of the recording.
+
+Results can be saved to and loaded from npz files with save_results and
+load_results, so that they can be computed and viewed separately.
+"""
+from __future__ import print_function, division
+
+from collections import namedtuple
+import numpy as np
+from scipy import fftpack
+from scipy import stats
+
+XcovResult = namedtuple('XcovResult', ['xcov', 'p', 'lb', 'ub'])
+
+
+class XcovStats(object):
+    """
+    Per-lag sufficient statistics of the cross-covariance between a cause x and an
+    effect y, from which pooled correlations, p-values and confidence bounds follow.
+
+    Sums are stored relative to offsets x0 and y0 (usually the means of x and y) so
+    that they remain accurate for signals far from zero.
+
+    :param lags: array of lags (in timesteps)
+    :param n: number of pairs at each lag
+    :param sx, sy: sums of (x - x0) and (y - y0) at each lag
+    :param sxx, syy: sums of (x - x0)**2 and (y - y0)**2 at each lag
+    :param sxy: sums of (x - x0) * (y - y0) at each lag
+    :param x0, y0: offsets subtracted from x and y
+    """
+
+    def __init__(self, lags, n, sx, sy, sxx, syy, sxy, x0=0., y0=0.):
+        self.lags = np.asarray(lags)
+        self.n = np.asarray(n, dtype=float)
+        self.sx = np.asarray(sx, dtype=float)
+        self.sy = np.asarray(sy, dtype=float)
+        self.sxx = np.asarray(sxx, dtype=float)
+        self.syy = np.asarray(syy, dtype=float)
+        self.sxy = np.asarray(sxy, dtype=float)
+        self.x0 = x0
+        self.y0 = y0
+
+    @classmethod
+    def empty(cls, lags, x0=0., y0=0.):
+        zeros = np.zeros(len(lags))
+        return cls(lags, zeros, zeros, zeros, zeros, zeros, zeros, x0=x0, y0=y0)
+
+    def recentered(self, x0, y0):
+        """Return the same statistics relative to new offsets."""
+        dx = self.x0 - x0
+        dy = self.y0 - y0
+
+        return XcovStats(
+            self.lags, self.n,
+            sx=self.sx + self.n * dx,
+            sy=self.sy + self.n * dy,
+            sxx=self.sxx + 2 * dx * self.sx + self.n * dx ** 2,
+            syy=self.syy + 2 * dy * self.sy + self.n * dy ** 2,
+            sxy=self.sxy + dy * self.sx + dx * self.sy + self.n * dx * dy,
+            x0=x0, y0=y0)
+
+    def __add__(self, other):
+        if not np.array_equal(self.lags, other.lags):
+            raise ValueError('Cannot combine statistics computed at different lags!')
+
+        other = other.recentered(self.x0, self.y0)
+
+        return XcovStats(self.lags, self.n + other.n, self.sx + other.sx, self.sy + other.sy,
+                         self.sxx + other.sxx, self.syy + other.syy, self.sxy + other.sxy,
+                         x0=self.x0, y0=self.y0)
+
+    def __sub__(self, other):
+        if not np.array_equal(self.lags, other.lags):
+            raise ValueError('Cannot combine statistics computed at different lags!')
+
+        other = other.recentered(self.x0, self.y0)
+
+        return XcovStats(self.lags, self.n - other.n, self.sx - other.sx, self.sy - other.sy,
+                         self.sxx - other.sxx, self.syy - other.syy, self.sxy - other.sxy,
+                         x0=self.x0, y0=self.y0)
+
+    def result(self, confidence=.95, normed=True):
+        """
+        Cross-covariance at each lag, with two-sided p-values (t-test of zero
+        correlation) and confidence bounds (Fisher transformation).
+
+        :param confidence: confidence level of bounds
+        :param normed: if True, return correlations, otherwise covariances
+        :return: XcovResult of xcov, p, lb, ub arrays
+        """
+        n = self.n
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.sxy / n - (self.sx / n) * (self.sy / n)
+            var_x = self.sxx / n - (self.sx / n) ** 2
+            var_y = self.syy / n - (self.sy / n) ** 2
+            std = np.sqrt(var_x * var_y)
+
+            r = np.clip(cov / std, -1, 1)
+
+            df = n - 2
+            t = r * np.sqrt(df / (1 - r ** 2))
+            p = 2 * stats.t.sf(np.abs(t), df)
+
+            z = np.arctanh(r)
+            z_crit = stats.norm.ppf(.5 + confidence / 2) / np.sqrt(n - 3)
+            lb = np.tanh(z - z_crit)
+            ub = np.tanh(z + z_crit)
+
+        if normed:
+            return XcovResult(r, p, lb, ub)
+        else:
+            return XcovResult(cov, p, lb * std, ub * std)
+
+
+def lag_window(lags, segment_length):
+    """Start and end indices of the cause and effect samples paired at each lag."""
+    x_start = np.clip(-lags, 0, segment_length)
+    x_end = np.clip(segment_length - lags, x_start, segment_length)
+    y_start = np.clip(lags, 0, segment_length)
+    y_end = y_start + (x_end - x_start)
+
+    return x_start, x_end, y_start, y_end
+
+
+def xcov_stats(signals, pairs, n_lags_back, n_lags_forward, offsets=None):
+    """
+    Compute the sufficient statistics of the cross-covariances between several pairs
+    of segmented signals.
+
+    :param signals: dict mapping names to lists of 1D segments (every signal must be split
+                    into segments of the same lengths)
+    :param pairs: list of (cause name, effect name) tuples
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param offsets: dict of offsets to subtract from signals (their means if None)
+    :return: dict mapping each pair to its XcovStats
+    """
+    names = sorted(set([name for pair in pairs for name in pair]))
+    lags = np.arange(-n_lags_back, n_lags_forward)
+
+    segment_lengths = [len(segment) for segment in signals[names[0]]] if names else []
+    for name in names:
+        if [len(segment) for segment in signals[name]] != segment_lengths:
+            raise ValueError('Signal "{}" is not split into the same segments as the others!'.format(name))
+
+    if offsets is None:
+        offsets = {}
+        for name in names:
+            if sum(segment_lengths):
+                offsets[name] = float(np.mean(np.concatenate(signals[name])))
+            else:
+                offsets[name] = 0.
+
+    all_stats = dict([(pair, XcovStats.empty(lags, offsets[pair[0]], offsets[pair[1]])) for pair in pairs])
+
+    for s_ctr, segment_length in enumerate(segment_lengths):
+        if segment_length == 0:
+            continue
+
+        # zero-pad so that circular correlation equals linear correlation at all lags
+        n_fft = fftpack.next_fast_len(segment_length + max(n_lags_back, n_lags_forward))
+
+        segments = np.array([np.asarray(signals[name][s_ctr], dtype=float) - offsets[name] for name in names])
+        spectra = np.fft.rfft(segments, n=n_fft, axis=1)
+
+        # cumulative sums give the sums of samples and squares within any window
+        cumsums = np.concatenate([np.zeros((len(names), 1)), np.cumsum(segments, axis=1)], axis=1)
+        cumsums_sq = np.concatenate([np.zeros((len(names), 1)), np.cumsum(segments ** 2, axis=1)], axis=1)
+
+        # correlate all pairs with one inverse transform: sum_i x[i] * y[i + lag]
+        idxs = [(names.index(cause), names.index(effect)) for cause, effect in pairs]
+        products = np.array([spectra[x_idx].conj() * spectra[y_idx] for x_idx, y_idx in idxs])
+        sxys = np.fft.irfft(products, n=n_fft, axis=1)[:, lags % n_fft]
+
+        x_start, x_end, y_start, y_end = lag_window(lags, segment_length)
+        n = x_end - x_start
+
+        for pair, (x_idx, y_idx), sxy in zip(pairs, idxs, sxys):
+            pair_stats = all_stats[pair]
+            pair_stats.n = pair_stats.n + n
+            pair_stats.sx = pair_stats.sx + cumsums[x_idx, x_end] - cumsums[x_idx, x_start]
+            pair_stats.sy = pair_stats.sy + cumsums[y_idx, y_end] - cumsums[y_idx, y_start]
+            pair_stats.sxx = pair_stats.sxx + cumsums_sq[x_idx, x_end] - cumsums_sq[x_idx, x_start]
+            pair_stats.syy = pair_stats.syy + cumsums_sq[y_idx, y_end] - cumsums_sq[y_idx, y_start]
+            pair_stats.sxy = pair_stats.sxy + np.where(n > 0, sxy, 0)
+
+    return all_stats
+
+
+def xcov_multi(signals, pairs, n_lags_back, n_lags_forward, confidence=.95, normed=True):
+    """
+    Compute the cross-covariances between several pairs of segmented signals at once.
+
+    Example:
+        results = xcov_multi({'vel': vel, 'lmr': lmr}, [('vel', 'lmr'), ('vel', 'vel')], 12, 125)
+        vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = results['vel', 'lmr']
+
+    :param signals: dict mapping names to lists of 1D segments (every signal must be split
+                    into segments of the same lengths)
+    :param pairs: list of (cause name, effect name) tuples (use (name, name) for auto-covariances)
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param confidence: confidence level of bounds
+    :param normed: if True, return correlations, otherwise covariances
+    :return: dict mapping each pair to an XcovResult (xcov, p, lb, ub), each an array over
+             lags np.arange(-n_lags_back, n_lags_forward)
+    """
+    all_stats = xcov_stats(signals, pairs, n_lags_back, n_lags_forward)
+
+    return dict([(pair, pair_stats.result(confidence=confidence, normed=normed))
+                 for pair, pair_stats in all_stats.items()])
+
+
+class XcovAccumulator(object):
+    """
+    Online cross-covariances of several pairs of signals that arrive chunk by chunk.
+
+    Consecutive chunks added with add continue the current segment until end_segment
+    is called. Only the last max(n_lags_back, n_lags_forward) samples of each signal
+    are kept: the statistics of a chunk are those of the kept samples followed by the
+    chunk minus those of the kept samples alone, which counts every pair of samples
+    with at least one sample in the chunk exactly once.
+
+    Example:
+        accumulator = XcovAccumulator([('vel', 'lmr')], 12, 125)
+        for vel_chunk, lmr_chunk in chunks:
+            accumulator.add({'vel': vel_chunk, 'lmr': lmr_chunk})
+        vel_x_lmr, p_vel_x_lmr, lb_vel_x_lmr, ub_vel_x_lmr = accumulator.result()['vel', 'lmr']
+
+    :param pairs: list of (cause name, effect name) tuples
+    :param n_lags_back: number of negative lags (effect preceding cause)
+    :param n_lags_forward: number of non-negative lags (cause preceding effect)
+    :param offsets: dict of offsets to subtract from signals (the means of their first
+                    chunks if None; they only affect numerical accuracy)
+    """
+
+    def __init__(self, pairs, n_lags_back, n_lags_forward, offsets=None):
+        self.pairs = list(pairs)
+        self.names = sorted(set([name for pair in self.pairs for name in pair]))
+        self.n_lags_back = n_lags_back
+        self.n_lags_forward = n_lags_forward
+        self.lags = np.arange(-n_lags_back, n_lags_forward)
+        self.n_overlap = max(n_lags_back, n_lags_forward)
+        self.offsets = None if offsets is None else dict(offsets)
+
+        self._stats = None
+        self._tails = None
+
+    def add(self, chunk):
+        """
+        Add the next samples of the current segment.
+
+        :param chunk: dict mapping names to 1D arrays of the same length
+        """
+        chunk = dict([(name, np.asarray(chunk[name], dtype=float)) for name in self.names])
+
+        if not len(chunk[self.names[0]]):
+            return
+
+        if self.offsets is None:
+            self.offsets = dict([(name, float(np.mean(chunk[name]))) for name in self.names])
+
+        if self._stats is None:
+            self._stats = dict([(pair, XcovStats.empty(self.lags, self.offsets[pair[0]], self.offsets[pair[1]]))
+                                for pair in self.pairs])
+
+        if self._tails is None:
+            self._tails = dict([(name, np.zeros(0)) for name in self.names])
+
+        extended = dict([(name, np.concatenate([self._tails[name], chunk[name]])) for name in self.names])
+
+        stats_extended = xcov_stats(dict([(name, [extended[name]]) for name in self.names]), self.pairs,
+                                    self.n_lags_back, self.n_lags_forward, offsets=self.offsets)
+        stats_tail = xcov_stats(dict([(name, [self._tails[name]]) for name in self.names]), self.pairs,
+                                self.n_lags_back, self.n_lags_forward, offsets=self.offsets)
+
+        for pair in self.pairs:
+            self._stats[pair] = self._stats[pair] + (stats_extended[pair] - stats_tail[pair])
+
+        self._tails = dict([(name, extended[name][max(len(extended[name]) - self.n_overlap, 0):])
+                            for name in self.names])
+
+    def end_segment(self):
+        """End the current segment, so that the next chunk is not paired with previous samples."""
+        self._tails = None
+
+    def stats(self):
+        """Return a dict mapping each pair to the XcovStats accumulated so far."""
+        if self._stats is None:
+            return dict([(pair, XcovStats.empty(self.lags)) for pair in self.pairs])
+        return dict(self._stats)
+
+    def result(self, confidence=.95, normed=True):
+        """Return a dict mapping each pair to an XcovResult (see xcov_multi)."""
+        return dict([(pair, pair_stats.result(confidence=confidence, normed=normed))
+                     for pair, pair_stats in self.stats().items()])
+
+
+def save_results(file_name, results, **arrays):
+    """
+    Save the results of xcov_multi to an npz file, along with any other arrays.
+
+    :param file_name: path of npz file
+    :param results: dict mapping (cause name, effect name) pairs to XcovResults
+    """
+    contents = dict(arrays)
+    for (cause, effect), result in results.items():
+        for field, values in zip(XcovResult._fields, result):
+            contents['{}__{}__{}'.format(field, cause, effect)] = values
+
+    np.savez(file_name, **contents)
+
+
+def load_results(file_name):
+    """
+    Load results saved by save_results.
+
+    :param file_name: path of npz file
+    :return: dict mapping (cause name, effect name) pairs to XcovResults, dict of other arrays
+    """
+    fields = {}
+    arrays = {}
+
+    with np.load(file_name) as contents:
+        for key in contents.files:
+            parts = key.split('__')
+            if len(parts) == 3 and parts[0] in XcovResult._fields:
+                fields.setdefault((parts[1], parts[2]), {})[parts[0]] = contents[key]
+            else:
+                arrays[key] = contents[key]
+
+    results = dict([(pair, XcovResult(**pair_fields)) for pair, pair_fields in fields.items()])
+
+    return results, arrays